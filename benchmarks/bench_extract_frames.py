@@ -0,0 +1,99 @@
+"""
+Compares frame extraction against the previous seek-per-frame implementation,
+on one thread and on the worker threads the node uses for several videos.
+
+Usage:
+    python -m benchmarks.bench_extract_frames [video.mp4 ...] [--max-side 768] [--workers 4]
+
+Without arguments a few synthetic 1280x720 clips are generated in a temp directory.
+"""
+import argparse
+import base64
+import functools
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import nodes.extract_frames as extract_frames
+
+def legacy_extract(video_path: Path, output_dir: Path, max_frames: int = 5) -> int:
+    """The previous implementation: one seek per frame, JPEG-encoded twice."""
+    capture = cv2.VideoCapture(str(video_path))
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(1, total_frames // max_frames)
+    count = 0
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    for i in range(0, total_frames, step):
+        capture.set(cv2.CAP_PROP_POS_FRAMES, i)
+        ret, frame = capture.read()
+        if ret:
+            cv2.imwrite(str(output_dir / f"frame_{count + 1}.jpg"), frame)
+            ret, buffer = cv2.imencode(".jpg", frame)
+            base64.b64encode(buffer).decode("utf-8")
+            count += 1
+        if count >= max_frames:
+            break
+
+    capture.release()
+    return count
+
+def make_synthetic_video(path: Path, seconds: int = 30, fps: int = 30, size=(1280, 720)) -> Path:
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    rng = np.random.default_rng(0)
+    for i in range(seconds * fps):
+        frame = cv2.resize(rng.integers(0, 255, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8), size)
+        cv2.putText(frame, str(i), (60, 120), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 4)
+        writer.write(frame)
+    writer.release()
+    return path
+
+def timed(label: str, fn) -> float:
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed:8.3f} s")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="*", type=Path)
+    parser.add_argument("--max-side", type=int, default=0, help="Resize target for the new path (0 = none)")
+    parser.add_argument("--workers", type=int, default=extract_frames.EXTRACT_WORKERS)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_frames_"))
+    try:
+        videos = args.videos or [make_synthetic_video(work_dir / f"synthetic_{i}.mp4") for i in range(4)]
+        extract = functools.partial(
+            extract_frames.extract_evenly_distributed_frames_from_video,
+            max_side=args.max_side, frames_dir=work_dir / "new",
+        )
+
+        legacy = timed(
+            f"legacy seek, {len(videos)} videos, 1 thread",
+            lambda: [legacy_extract(v, work_dir / "legacy" / v.stem) for v in videos],
+        )
+        single = timed(
+            f"new, {len(videos)} videos, 1 thread",
+            lambda: [extract(v) for v in videos],
+        )
+
+        shutil.rmtree(work_dir / "new")
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            pooled = timed(
+                f"new, {len(videos)} videos, {args.workers} threads",
+                lambda: list(pool.map(extract, videos)),
+            )
+
+        print(f"\nspeedup: {legacy / single:.2f}x on one thread, {legacy / pooled:.2f}x on {args.workers} threads")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Runs the whole pipeline offline against the local Graph API and OpenAI mocks
+and reports end-to-end throughput, per-stage latency and peak RSS.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--ads 50] [--videos 20] [--seconds 8]
+        [--latency-ms 400 --jitter-ms 200 --rate-limit-rate 0.05 --error-rate 0.01]
+        [--graph-latency-ms 150] [--bytes-per-sec 2000000] [--mode staged|fused]
+        [--sync] [--batch] [--warm] [--output results.json]
+
+The pipeline runs in a child process with its own data directory, so the
+repository's outputs and caches are not touched and peak RSS is the
+pipeline's alone. --warm runs it a second time on the same data to measure a
+steady-state run.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any
+
+from benchmarks.scenarios import build_scenario
+from mocks.faults import Faults
+from mocks.graph_api_server import API_VERSION, FakeGraphAPI
+from mocks.graph_api_server import serve as serve_graph_api
+from mocks.openai_server import serve as serve_openai
+from utils.results import ResultStore
+from utils.tracing import summarize_trace
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+def run_child() -> None:
+    """Entry point of the pipeline process."""
+    from graph import run_ad_analysis_graph
+    run_ad_analysis_graph()
+
+def peak_rss_mb(rusage) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def run_pipeline(env: Dict[str, str], log_path: Path, verbose: bool) -> tuple:
+    """Runs the pipeline once. Returns (exit code, wall seconds, peak RSS in MB)."""
+    started = time.perf_counter()
+    with open(log_path, "a", encoding="utf-8") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_pipeline", "--child"],
+            cwd=ROOT_DIR,
+            env=env,
+            stdout=None if verbose else log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 instead of wait() to get the child's own resource usage
+        _, status, rusage = os.wait4(process.pid, 0)
+    return os.waitstatus_to_exitcode(status), time.perf_counter() - started, peak_rss_mb(rusage)
+
+def latest_trace(data_dir: Path) -> list:
+    traces = sorted((data_dir / "traces").glob("*.jsonl"), key=lambda path: path.stat().st_mtime)
+    if not traces:
+        return []
+    with open(traces[-1], "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def stage_latencies(records: list) -> Dict[str, Dict[str, float]]:
+    """Node name -> {"runs", "p50_s", "p95_s", "total_s"} for the results file."""
+    from utils.tracing import percentile
+
+    stages: Dict[str, list] = {}
+    for record in records:
+        if record["kind"] == "node":
+            stages.setdefault(record["name"], []).append(record["wall_ms"] / 1000)
+    return {
+        name: {"runs": len(walls), "p50_s": round(percentile(walls, 50), 3), "p95_s": round(percentile(walls, 95), 3),
+               "total_s": round(sum(walls), 3)}
+        for name, walls in stages.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--ads", type=int, default=50, help="Number of synthetic ads")
+    parser.add_argument("--videos", type=int, default=20, help="Number of distinct videos shared by the ads")
+    parser.add_argument("--seconds", type=float, default=8, help="Length of every synthetic video")
+    parser.add_argument("--mode", choices=("staged", "fused"), default="staged", help="AD_ANALYSIS_MODE")
+    parser.add_argument("--sync", action="store_true", help="Run the graph with invoke() instead of ainvoke()")
+    parser.add_argument("--batch", action="store_true", help="Use the OpenAI Batch API execution mode")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="Seconds before a mock batch completes")
+    parser.add_argument("--bytes-per-sec", type=int, default=0, help="Mock CDN throttle (0 = unlimited)")
+    parser.add_argument("--warm", action="store_true", help="Run a second time on the same data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline output")
+    Faults.add_arguments(parser)
+    Faults.add_arguments(parser, prefix="graph-")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child()
+        return
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    data_dir = work_dir / "data"
+    log_path = work_dir / "pipeline.log"
+    try:
+        print(f"[🧪] Building scenario: {args.ads} ads, {args.videos} videos of {args.seconds:g}s in {work_dir}")
+        scenario = build_scenario(work_dir / "scenario", args.ads, args.videos, args.seconds)
+
+        openai_server = serve_openai(0, args.batch_delay, Faults.from_args(args, seed=args.seed))
+        graph_state = FakeGraphAPI(scenario.ads, scenario.videos, Faults.from_args(args, "graph-", seed=args.seed), args.bytes_per_sec)
+        serve_graph_api(graph_state, 0)
+
+        env = {
+            **os.environ,
+            "AD_ANALYZER_DATA_DIR": str(data_dir),
+            "FB_GRAPH_API_URL": f"{graph_state.base_url}/{API_VERSION}",
+            "FB_AD_ACCOUNT_ID": "bench",
+            "FB_ACCESS_TOKEN": "bench",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_server.server_port}/v1",
+            "OPENAI_API_KEY": "bench",
+            "AD_ANALYSIS_MODE": args.mode,
+            "AD_GRAPH_ASYNC": "0" if args.sync else "1",
+            "OPENAI_EXECUTION_MODE": "batch" if args.batch else "sync",
+            "OPENAI_BATCH_POLL_SECONDS": str(min(1.0, args.batch_delay)),
+        }
+
+        results: Dict[str, Any] = {"scenario": {k: v for k, v in vars(args).items() if k not in ("output", "child")}, "runs": []}
+        for label in ("cold", "warm") if args.warm else ("cold",):
+            exit_code, wall, rss = run_pipeline(env, log_path, args.verbose)
+            records = latest_trace(data_dir)
+            analyzed = ResultStore(data_dir / "results.sqlite").count("analyze_ad")
+            ads_per_min = args.ads / wall * 60
+
+            print(f"\n[📊] {label} run: exit {exit_code}, {wall:.1f}s wall, {ads_per_min:.1f} ads/min, "
+                  f"peak RSS {rss:.0f} MB, {analyzed}/{len(scenario.videos)} videos analyzed")
+            if exit_code != 0:
+                print(f"[❌] Pipeline failed, see {log_path}")
+            summarize_trace(records)
+            results["runs"].append({
+                "label": label, "exit_code": exit_code, "wall_s": round(wall, 3), "ads_per_min": round(ads_per_min, 2),
+                "peak_rss_mb": round(rss, 1), "videos_analyzed": analyzed, "stages": stage_latencies(records),
+            })
+
+        print(f"\n[🧪] Mock OpenAI: {openai_server.state.faults.counts}")
+        print(f"[🧪] Mock Graph API: {graph_state.counts}, injected {graph_state.faults.counts}")
+
+        if args.output:
+            results["mocks"] = {"openai": openai_server.state.faults.counts, "graph_api": graph_state.counts}
+            args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+            print(f"[✅] Saved results to: {args.output}")
+    finally:
+        if args.keep:
+            print(f"[📁] Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
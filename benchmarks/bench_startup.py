@@ -0,0 +1,82 @@
+"""
+Measures the fixed start-up cost of the pipeline: importing graph.py, the CLI
+commands that should not load the pipeline, and building the graph.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat 5] [--top 15]
+
+Every measurement runs in a fresh interpreter, so nothing is served from the
+module cache. The slowest imports are taken from `python -X importtime`.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# label -> Python code run in a fresh interpreter
+SNIPPETS = {
+    "python (baseline)": "pass",
+    "import graph": "import graph",
+    "import graph + build": "import graph; graph.compiled_graph(True, False)",
+    "main.py --help": "import runpy, sys; sys.argv = ['main.py', '--help']; runpy.run_path('main.py', run_name='__main__')",
+    "main.py runs": "import runpy, sys; sys.argv = ['main.py', 'runs']; runpy.run_path('main.py', run_name='__main__')",
+}
+
+# Modules that should only be loaded once a node that needs them runs
+HEAVY_MODULES = ("cv2", "numpy", "openai", "tiktoken")
+
+def time_snippet(code: str, repeat: int) -> list:
+    """Wall seconds of `repeat` fresh interpreters running `code`."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, check=True, capture_output=True)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def slowest_imports(module: str, top: int) -> list:
+    """(cumulative seconds, module) of the top-level imports `module` triggers, slowest first."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, check=True, capture_output=True, text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        # Direct imports are indented by two spaces, their dependencies further
+        if name.startswith("  ") and not name.startswith("    "):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+def loaded_heavy_modules(module: str) -> list:
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, check=True, capture_output=True, text=True)
+    return [name for name in result.stdout.strip().split(",") if name]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports of graph.py to list")
+    args = parser.parse_args()
+
+    print(f"{'measurement':<24} {'median s':>9} {'min s':>7} {'max s':>7}")
+    for label, code in SNIPPETS.items():
+        timings = time_snippet(code, args.repeat)
+        print(f"{label:<24} {statistics.median(timings):>9.3f} {min(timings):>7.3f} {max(timings):>7.3f}")
+
+    print("\nSlowest imports of graph.py (cumulative):")
+    for seconds, name in slowest_imports("graph", args.top):
+        print(f"  {seconds:>7.3f}s  {name}")
+
+    heavy = loaded_heavy_modules("graph")
+    print(f"\nHeavy modules loaded by `import graph`: {', '.join(heavy) if heavy else 'none'}")
+
+if __name__ == "__main__":
+    main()
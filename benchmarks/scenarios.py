@@ -0,0 +1,97 @@
+"""
+Synthetic benchmark scenarios: N ads shaped like ads.json that share M
+distinct videos, and the MP4 files for those videos.
+"""
+import copy
+import json
+import shutil
+import subprocess
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict
+
+import cv2
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TEMPLATE_ADS_PATH = ROOT_DIR / "ads.json"
+
+# First updated_time of the synthetic ads; each further ad is a minute later
+START_TIME = datetime(2024, 5, 1, 10, 0, tzinfo=timezone.utc)
+
+@dataclass
+class Scenario:
+    ads: list
+    videos: Dict[str, Path]
+
+def load_template_ads() -> list:
+    """The real ads in ads.json that have a video creative."""
+    with open(TEMPLATE_ADS_PATH, "r", encoding="utf-8") as f:
+        ads = json.load(f)
+    return [ad for ad in ads if ad.get("creative", {}).get("object_story_spec", {}).get("video_data", {}).get("video_id")]
+
+def synthesize_ads(n_ads: int, n_videos: int) -> list:
+    """
+    Returns `n_ads` copies of the template ads with fresh ad, creative and
+    video ids. Ads are spread round-robin over `n_videos` video ids, so
+    n_videos < n_ads models creatives reused across ads.
+    """
+    templates = load_template_ads()
+    ads = []
+    for i in range(n_ads):
+        ad = copy.deepcopy(templates[i % len(templates)])
+        ad["id"] = f"9{i:014d}"
+        ad["name"] = f"Bench ad {i}"
+        ad["created_time"] = ad["updated_time"] = (START_TIME + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S+0000")
+        # Every fifth ad is paused, so --active-only has something to drop
+        ad["effective_status"] = "PAUSED" if i % 5 == 4 else "ACTIVE"
+        creative = ad["creative"]
+        creative["id"] = f"7{i:014d}"
+        creative["object_story_spec"]["video_data"]["video_id"] = video_id(i % n_videos)
+        ads.append(ad)
+    return ads
+
+def video_id(index: int) -> str:
+    return f"8{index:014d}"
+
+def make_video(path: Path, seed: int, seconds: float = 8, fps: int = 25, size=(640, 360)) -> Path:
+    """
+    Writes a synthetic ad video: a few scenes of distinct colour with a moving
+    shape and a frame counter, so every video has different content and the
+    keyframe selector has real scene changes to find. With ffmpeg on PATH a
+    tone is muxed in as the audio track.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * fps)
+    scene_length = max(1, total // 4)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    colour = rng.integers(0, 255, 3)
+    for i in range(total):
+        if i % scene_length == 0:
+            colour = rng.integers(0, 255, 3)
+        frame = np.empty((size[1], size[0], 3), np.uint8)
+        frame[:] = colour
+        x = int((i / total) * (size[0] - 80))
+        cv2.rectangle(frame, (x, 120), (x + 80, 200), (255, 255, 255), -1)
+        cv2.putText(frame, f"{seed}:{i}", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+        writer.write(frame)
+    writer.release()
+
+    if shutil.which("ffmpeg"):
+        with_audio = path.with_name(path.stem + "_audio.mp4")
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", str(path),
+             "-f", "lavfi", "-i", f"sine=frequency={220 + seed % 500}:duration={seconds}",
+             "-c:v", "copy", "-c:a", "aac", "-shortest", str(with_audio)],
+            check=True,
+        )
+        with_audio.replace(path)
+    return path
+
+def build_scenario(directory: Path, n_ads: int, n_videos: int, seconds: float = 8) -> Scenario:
+    """Synthesizes the ads and writes one MP4 per distinct video into `directory`."""
+    n_videos = max(1, min(n_videos, n_ads))
+    directory.mkdir(parents=True, exist_ok=True)
+    videos = {video_id(i): make_video(directory / f"{video_id(i)}.mp4", seed=i, seconds=seconds) for i in range(n_videos)}
+    return Scenario(ads=synthesize_ads(n_ads, n_videos), videos=videos)
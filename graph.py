@@ -1,17 +1,49 @@
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, END
-from typing import Dict, Any, Annotated
+from langgraph.types import Send
+from typing import Dict, Any, Annotated, Awaitable, Callable, Optional
 from typing_extensions import TypedDict
+import asyncio
+import functools
+import hashlib
+import importlib
 import operator
+import os
+import time
 from pathlib import Path
 from rich import print
 from rich.pretty import pprint
+from utils.settings import DATA_DIR
 
 # Output directory
-FINAL_OUTPUT_DIR = Path(__file__).resolve().parent / "ad_analysis"
+FINAL_OUTPUT_DIR = DATA_DIR / "ad_analysis"
 FINAL_OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Upper bound on how many per-video sub-runs execute at the same time
+MAX_CONCURRENCY = int(os.getenv("AD_GRAPH_MAX_CONCURRENCY", "8"))
+
+# Run the graph with ainvoke so the OpenAI nodes await their requests
+# concurrently instead of blocking a worker thread each
+USE_ASYNC = os.getenv("AD_GRAPH_ASYNC", "1") == "1"
+
+# "staged" analyzes the transcript and then the whole ad in two LLM calls;
+# "fused" does both in one structured-output call from the raw transcript
+AD_ANALYSIS_MODE = os.getenv("AD_ANALYSIS_MODE", "staged")
+
+# "local" runs the per-video sub-runs in this process; "queue" puts them on
+# the durable job queue (utils/jobs.py) for `python main.py worker`
+# processes, on this host or others, and collects their results
+AD_EXECUTION = os.getenv("AD_EXECUTION", "local")
+
 # ---- Shared Graph State ----
+# The state only carries lightweight records: ad ids, resolved URLs and
+# artifact handles ({"id", "path" or "stage", "sha256", "size"}). Media stay on
+# disk and analysis payloads in the result store. Every node returns only the
+# keys it produces. `filters` is set by the caller and narrows which ads the
+# run fetches; `skip_sync` runs on the local ad store without syncing first.
 class GraphState(TypedDict):
+    filters: Dict[str, Any]
+    skip_sync: bool
     ads: Annotated[list, operator.add]
     video_urls: Annotated[list, operator.add]
     downloaded_videos: Annotated[list, operator.add]
@@ -19,53 +51,280 @@ class GraphState(TypedDict):
     transcriptions: Annotated[list, operator.add]
     transcription_analysis: Annotated[list, operator.add]
     frame_analysis: Annotated[list, operator.add]
+    final_ad_analysis: Annotated[list, operator.add]
+    errors: Annotated[list, operator.add]
+
+# ---- Per-video sub-run state (one entry of video_urls) ----
+class VideoState(TypedDict):
+    video_urls: list
+    downloaded_videos: list
+    extracted_frames: list
+    transcriptions: list
+    transcription_analysis: list
+    frame_analysis: list
     final_ad_analysis: list
+    errors: Annotated[list, operator.add]
 
-# ---- Import all nodes ----
-from nodes.get_ads import get_facebook_ads
-from nodes.get_video_urls import get_video_urls_from_ads
-from nodes.download_video import download_videos
-from nodes.transcribe_video import transcribe_all_videos
-from nodes.extract_frames import extract_all_videos_as_base64_frames
-from nodes.analyze_transcription import analyze_all_transcriptions
-from nodes.analyze_frames import analyze_all_frames
-from nodes.analyze_ad import final_ad_analysis
+class VideoOutput(TypedDict):
+    final_ad_analysis: list
+    errors: list
 
-# ---- Build the Graph ----
-def build_graph():
-    builder = StateGraph(GraphState)
+from utils.artifacts import check_state_size
+from utils.cache import get_result_cache
+from utils.checkpoints import delete_run, get_run_registry, new_run_id, open_async_checkpointer, open_checkpointer
+from utils.deps import FUSED_STAGE_DEPENDENCIES, STAGE_DEPENDENCIES, get_dependency_tracker, plan_video
+from utils.jobs import JOB_POLL_SECONDS, get_job_queue
+from utils.openai_batch import batch_mode
+from utils.openai_client import aclose_async_client
+from utils.results import get_result_store
+from utils.storage import get_storage_manager
+from utils.tracing import node_span, save_profile, summarize_trace, tracer
 
-    builder.add_node("Get Facebook Ads", get_facebook_ads)
-    builder.add_node("Get Video URLs", get_video_urls_from_ads)
-    builder.add_node("Download Video", download_videos)
-    builder.add_node("Transcribe Video", transcribe_all_videos)
-    builder.add_node("Extract Frames", extract_all_videos_as_base64_frames)
-    builder.add_node("Analyze Transcription", analyze_all_transcriptions)
-    builder.add_node("Analyze Frames", analyze_all_frames)
-    builder.add_node("Analyze Ad", final_ad_analysis)
+# ---- Nodes ----
+def lazy_node(module: str, name: str, is_async: bool = False) -> Callable:
+    """
+    Returns a stand-in for nodes.{module}.{name} that imports the module the
+    first time the node runs. Node modules pull in cv2, numpy and the OpenAI
+    SDK, which building the graph, resuming a finished run or planning a
+    run must not pay for.
+    """
+    def load() -> Callable:
+        return getattr(importlib.import_module(f"nodes.{module}"), name)
 
-    builder.set_entry_point("Get Facebook Ads")
+    if is_async:
+        async def anode(state: Dict[str, Any]) -> Dict[str, Any]:
+            return await load()(state)
+        anode.__name__ = name
+        return anode
+
+    def node(state: Dict[str, Any]) -> Dict[str, Any]:
+        return load()(state)
+    node.__name__ = name
+    return node
+
+def state_video(state: Dict[str, Any]) -> Optional[str]:
+    """Returns the video a per-video sub-run works on, or None for stages over the whole batch."""
+    video_ids = {video.get("video_id") for video in state.get("video_urls", [])}
+    return f"video_{video_ids.pop()}" if len(video_ids) == 1 else None
+
+def size_guarded(
+    name: str,
+    node: Callable[[Dict[str, Any]], Dict[str, Any]],
+    anode: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None,
+):
+    """
+    Wraps a node so that both the state it receives and the update it returns
+    are checked against MAX_STATE_ITEM_BYTES (raises StateTooLargeError past
+    the bound), and so that every run is traced as a span named `name`.
+
+    With an async variant `anode` the result is a runnable that uses `node`
+    under invoke() and `anode` under ainvoke().
+    """
+    def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+        check_state_size(state, f"{name} (input)")
+        with node_span(name, state_video(state)):
+            update = node(state)
+        check_state_size(update, f"{name} (update)")
+        return update
+
+    wrapper.__name__ = getattr(node, "__name__", "node")
+    if anode is None:
+        return wrapper
+
+    async def awrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+        check_state_size(state, f"{name} (input)")
+        with node_span(name, state_video(state)):
+            update = await anode(state)
+        check_state_size(update, f"{name} (update)")
+        return update
+
+    return RunnableLambda(wrapper, afunc=awrapper, name=wrapper.__name__)
+
+def add_analysis_nodes(builder: StateGraph, fused: bool) -> None:
+    """
+    Adds the nodes from "Download Video" to "Analyze Ad" with their edges.
+    Staged mode analyzes the transcript before the final analysis; fused mode
+    feeds the raw transcript straight into a single "Analyze Ad" call.
+    """
+    builder.add_node("Download Video", size_guarded("Download Video", lazy_node("download_video", "download_videos")))
+    builder.add_node("Transcribe Video", size_guarded(
+        "Transcribe Video",
+        lazy_node("transcribe_video", "transcribe_all_videos"),
+        lazy_node("transcribe_video", "atranscribe_all_videos", is_async=True),
+    ))
+    builder.add_node("Extract Frames", size_guarded("Extract Frames", lazy_node("extract_frames", "extract_all_video_frames")))
+    builder.add_node("Analyze Frames", size_guarded(
+        "Analyze Frames",
+        lazy_node("analyze_frames", "analyze_all_frames"),
+        lazy_node("analyze_frames", "aanalyze_all_frames", is_async=True),
+    ))
 
-    builder.add_edge("Get Facebook Ads", "Get Video URLs")
-    builder.add_edge("Get Video URLs", "Download Video")
     builder.add_edge("Download Video", "Transcribe Video")
     builder.add_edge("Download Video", "Extract Frames")
-    builder.add_edge("Transcribe Video", "Analyze Transcription")
     builder.add_edge("Extract Frames", "Analyze Frames")
-    builder.add_edge("Analyze Transcription", "Analyze Ad")
-    builder.add_edge("Analyze Frames", "Analyze Ad")
+
+    if fused:
+        builder.add_node("Analyze Ad", size_guarded(
+            "Analyze Ad",
+            lazy_node("analyze_ad_fused", "fused_ad_analysis"),
+            lazy_node("analyze_ad_fused", "afused_ad_analysis", is_async=True),
+        ))
+        builder.add_edge(["Transcribe Video", "Analyze Frames"], "Analyze Ad")
+    else:
+        builder.add_node("Analyze Transcription", size_guarded(
+            "Analyze Transcription",
+            lazy_node("analyze_transcription", "analyze_all_transcriptions"),
+            lazy_node("analyze_transcription", "aanalyze_all_transcriptions", is_async=True),
+        ))
+        builder.add_node("Analyze Ad", size_guarded(
+            "Analyze Ad",
+            lazy_node("analyze_ad", "final_ad_analysis"),
+            lazy_node("analyze_ad", "afinal_ad_analysis", is_async=True),
+        ))
+        builder.add_edge("Transcribe Video", "Analyze Transcription")
+        builder.add_edge(["Analyze Transcription", "Analyze Frames"], "Analyze Ad")
+
     builder.add_edge("Analyze Ad", END)
 
+def build_video_graph(fused: bool = AD_ANALYSIS_MODE == "fused"):
+    """
+    Builds the sub-graph that takes a single video through the pipeline:
+    download, then transcription and frame analysis in parallel, then final analysis.
+    """
+    builder = StateGraph(VideoState, output_schema=VideoOutput)
+    add_analysis_nodes(builder, fused)
+    builder.set_entry_point("Download Video")
     return builder.compile()
 
-# ---- Run the Graph (to be called from main.py) ----
-def run_ad_analysis_graph():
-    print("[🚀] Starting Ad Analysis Graph...")
-    graph = build_graph()
+def fan_out_videos(state: Dict[str, Any]) -> list:
+    """
+    Sends every resolved video to its own sub-run. Ads that share a creative
+    video are grouped so the video is only processed once.
+    """
+    videos_by_id = {}
+    for video in state.get("video_urls", []):
+        if video.get("source") or video.get("local"):
+            videos_by_id.setdefault(video["video_id"], []).append(video)
+
+    sends = [Send("Process Video", {"video_urls": videos}) for videos in videos_by_id.values()]
+    if not sends:
+        print("[⚠️] No downloadable videos found. Nothing to analyze.")
+        return [END]
+    print(f"[🔀] Fanning out {len(sends)} videos to per-video sub-runs.")
+    return sends
+
+# ---- Queue execution: per-video sub-runs as jobs for worker processes ----
+VIDEO_QUEUE = "videos"
+
+def video_job(state: Dict[str, Any], config: RunnableConfig, fused: bool) -> tuple:
+    """
+    Returns (job id, payload) of one per-video sub-run. The id is the run id
+    plus the video, so re-enqueueing on resume finds the existing job.
+    """
+    run_id = config["configurable"]["thread_id"]
+    return f"{run_id}:{state_video(state)}", {"run_id": run_id, "fused": fused, "video_urls": state["video_urls"]}
+
+def job_update(job: Dict[str, Any], video: str) -> Dict[str, Any]:
+    """Turns a finished job into the update of its "Process Video" step."""
+    if job["status"] == "failed":
+        print(f"[❌] Job for {video} failed after {job['attempts']} attempts: {job['error']}")
+        return {"final_ad_analysis": [], "errors": [{"stage": "Process Video", "video_id": video, "error": job["error"]}]}
+
+    result = job["result"]
+    # Workers on other hosts write to their own result store
+    store = get_result_store()
+    with store.transaction():
+        for item in result["final_ad_analysis"]:
+            store.put(item["video"], "analyze_ad", item["final_analysis"])
+    return {"final_ad_analysis": result["final_ad_analysis"], "errors": result["errors"]}
+
+def queued_video_nodes(fused: bool) -> tuple:
+    """
+    Returns (fan-out function, "Process Video" node) for queue execution.
+    The fan-out enqueues every video up front so workers can start at once;
+    each "Process Video" step then waits for its job and returns its result,
+    which the reducers gather into final_ad_analysis as in local execution.
+    """
+    def enqueue_videos(state: Dict[str, Any], config: RunnableConfig) -> list:
+        sends = fan_out_videos(state)
+        if sends == [END]:
+            return sends
+        queue = get_job_queue()
+        added = sum(queue.enqueue(VIDEO_QUEUE, *video_job(send.arg, config, fused)) for send in sends)
+        print(f"[📬] Queued {added} video jobs ({len(sends) - added} already queued). "
+              "Workers pick them up: python main.py worker")
+        return sends
+
+    def wait_for_job(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        queue = get_job_queue()
+        job_id, payload = video_job(state, config, fused)
+        queue.enqueue(VIDEO_QUEUE, job_id, payload)
+        while (job := queue.get(job_id))["status"] not in ("done", "failed"):
+            time.sleep(JOB_POLL_SECONDS)
+        return job_update(job, state_video(state))
+
+    async def await_job(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        queue = get_job_queue()
+        job_id, payload = video_job(state, config, fused)
+        await asyncio.to_thread(queue.enqueue, VIDEO_QUEUE, job_id, payload)
+        while (job := await asyncio.to_thread(queue.get, job_id))["status"] not in ("done", "failed"):
+            await asyncio.sleep(JOB_POLL_SECONDS)
+        return job_update(job, state_video(state))
+
+    return enqueue_videos, RunnableLambda(wait_for_job, afunc=await_job, name="wait_for_job")
+
+# ---- Build the Graph ----
+def build_graph(per_video: bool = True, fused: bool = AD_ANALYSIS_MODE == "fused", checkpointer=None, queued: bool = False):
+    """
+    Builds the ad analysis graph.
+
+    Args:
+        per_video (bool): When True, every video runs through its own sub-run
+            (map-reduce). When False, each stage runs as a barrier over the whole batch.
+        fused (bool): When True, transcript and final analysis share one LLM call.
+        checkpointer: Optional LangGraph checkpointer; per-video sub-runs share it.
+        queued (bool): With per_video, run the sub-runs as jobs on the job
+            queue instead of in this process.
+    """
+    builder = StateGraph(GraphState)
+    builder.add_node("Get Facebook Ads", size_guarded("Get Facebook Ads", lazy_node("get_ads", "get_facebook_ads")))
+    builder.add_node("Get Video URLs", size_guarded("Get Video URLs", lazy_node("get_video_urls", "get_video_urls_from_ads")))
+
+    if per_video:
+        fan_out = fan_out_videos
+        if queued:
+            fan_out, process_video = queued_video_nodes(fused)
+            builder.add_node("Process Video", process_video)
+        else:
+            builder.add_node("Process Video", build_video_graph(fused))
 
-    # Start the graph execution
-    final_state = graph.invoke({})
+        builder.set_entry_point("Get Facebook Ads")
 
+        builder.add_edge("Get Facebook Ads", "Get Video URLs")
+        builder.add_conditional_edges("Get Video URLs", fan_out, ["Process Video", END])
+        builder.add_edge("Process Video", END)
+
+        return builder.compile(checkpointer=checkpointer)
+
+    add_analysis_nodes(builder, fused)
+
+    builder.set_entry_point("Get Facebook Ads")
+
+    builder.add_edge("Get Facebook Ads", "Get Video URLs")
+    builder.add_edge("Get Video URLs", "Download Video")
+
+    return builder.compile(checkpointer=checkpointer)
+
+@functools.lru_cache(maxsize=None)
+def compiled_graph(per_video: bool, fused: bool, queued: bool = False):
+    """
+    Returns the graph for these options, compiled once per process, so
+    long-lived callers (the watcher, workers) do not rebuild it for every run.
+    Attach a checkpointer with `.copy(update={"checkpointer": ...})`.
+    """
+    return build_graph(per_video=per_video, fused=fused, queued=queued)
+
+def print_run_summary(final_state: Dict[str, Any]) -> None:
     print("\n[🎉] Workflow complete.")
 
     final_results = final_state.get("final_ad_analysis", [])
@@ -77,14 +336,220 @@ def run_ad_analysis_graph():
     else:
         print("[⚠️] No final analysis results generated.")
 
-    # ---- Visualize and save the graph structure ----
-    print("\n[🖼️] Visualizing graph structure...")
+    cache_stats = get_result_cache().session_stats
+    if cache_stats:
+        print("\n[🗄️] Result cache:")
+        for stage, counters in sorted(cache_stats.items()):
+            print(f"  {stage}: {counters['hits']} hits, {counters['misses']} misses")
+
+    stage_stats = get_dependency_tracker().session_stats
+    if stage_stats:
+        print("\n[🧮] Stages:")
+        for stage, counters in stage_stats.items():
+            print(f"  {stage}: {counters['fresh']} up to date, {counters['stale']} ran")
+
+# ---- Dry run ----
+def plan_ad_analysis(fused: bool = AD_ANALYSIS_MODE == "fused", filters: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Shows which stages a run would execute for every stored ad video inside
+    `filters`, without calling any API or touching artifacts. Ads are read
+    from the local store, so ads added since the last sync are not listed.
+
+    Returns:
+        dict: video key -> {stage: "up to date" | "stale" | "new"}
+    """
+    from nodes import analyze_ad, analyze_ad_fused, analyze_frames, analyze_transcription, extract_frames, transcribe_video
+    from nodes.get_ads import load_stored_ads
+    from nodes.get_video_urls import get_ad_video_id
+
+    dependencies = FUSED_STAGE_DEPENDENCIES if fused else STAGE_DEPENDENCIES
+    stage_params = {
+        "download": {},
+        "transcribe": transcribe_video.stage_params(),
+        "extract_frames": extract_frames.stage_params(),
+        "analyze_transcription": analyze_transcription.stage_params(),
+        "analyze_frames": analyze_frames.stage_params(),
+        "analyze_ad": analyze_ad_fused.stage_params() if fused else analyze_ad.stage_params(),
+    }
+
+    ads_by_video = {}
+    for ad in load_stored_ads(filters):
+        video_id = get_ad_video_id(ad)
+        if video_id:
+            ads_by_video.setdefault(video_id, []).append(ad.get("id"))
+
+    print(f"[🗺️] Plan for {len(ads_by_video)} videos ({'fused' if fused else 'staged'} analysis). "
+          "Get Facebook Ads and Get Video URLs always run.")
+    plans = {}
+    totals = {stage: 0 for stage in dependencies}
+    for video_id, ad_ids in ads_by_video.items():
+        video = f"video_{video_id}"
+        plans[video] = plan_video(video, dependencies, stage_params)
+        to_run = [stage for stage, status in plans[video].items() if status != "up to date"]
+        for stage in to_run:
+            totals[stage] += 1
+        detail = ", ".join(f"{stage} ({plans[video][stage]})" for stage in to_run) or "up to date"
+        print(f"  {video} ({len(ad_ids)} ads): {detail}")
+
+    print("\n[🧮] Would run:")
+    for stage, count in totals.items():
+        print(f"  {stage}: {count} of {len(ads_by_video)}")
+    return plans
+
+# ---- Run the Graph (to be called from main.py) ----
+def invoke_checkpointed(
+    inputs: Optional[Dict[str, Any]], config: Dict[str, Any], per_video: bool, fused: bool, use_async: bool, queued: bool = False
+) -> Dict[str, Any]:
+    """
+    Runs the graph with a SQLite checkpointer. Checkpoints are written
+    synchronously after every step, and each finished per-video sub-run is
+    saved as soon as it completes, so a crash loses at most the work in flight.
+    With `inputs` None the run continues from its last checkpoint.
+    """
+    if use_async:
+        async def run():
+            try:
+                async with open_async_checkpointer() as checkpointer:
+                    graph = compiled_graph(per_video, fused, queued).copy(update={"checkpointer": checkpointer})
+                    return await graph.ainvoke(inputs, config=config, durability="sync")
+            finally:
+                await aclose_async_client()
+        return asyncio.run(run())
+
+    with open_checkpointer() as checkpointer:
+        graph = compiled_graph(per_video, fused, queued).copy(update={"checkpointer": checkpointer})
+        return graph.invoke(inputs, config=config, durability="sync")
+
+def run_ad_analysis_graph(
+    per_video: bool = True,
+    max_concurrency: int = MAX_CONCURRENCY,
+    use_async: bool = USE_ASYNC,
+    run_id: Optional[str] = None,
+    profile: bool = False,
+    filters: Optional[Dict[str, Any]] = None,
+    skip_sync: bool = False,
+    keep_checkpoints: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    Runs the pipeline end to end under a new run id, or resumes `run_id` from
+    its last completed node and per-video sub-run. `filters` (see
+    nodes/get_ads.py) narrows a new run to some campaigns, ad sets or ads;
+    a resumed run keeps the filters it was started with. With `skip_sync`,
+    the run takes the ads from the local store without syncing them first.
+    Without `keep_checkpoints`, a run that completes deletes its checkpoints,
+    registry entry and trace (long-running callers like the watcher).
+
+    Returns the final graph state, or None for an unknown `run_id`.
+
+    Node spans and API calls are traced to traces/{run_id}.jsonl and
+    summarized at the end. With `profile`, the CPU-bound Extract Frames stage
+    runs in-process, one video at a time, under cProfile and its stats are
+    saved next to the trace.
+    """
+    registry = get_run_registry()
+    fused = AD_ANALYSIS_MODE == "fused"
+
+    if run_id:
+        run = registry.get(run_id)
+        if not run:
+            print(f"[❌] Unknown run: {run_id}")
+            return
+        if run["status"] == "completed":
+            print(f"[⏩] Run {run_id} already completed — showing its results.")
+        else:
+            print(f"[🔁] Resuming run {run_id}...")
+        # Checkpoints only fit the graph shape they were written by
+        per_video, fused = run["per_video"], run["fused"]
+        inputs = None
+    else:
+        run_id = new_run_id()
+        print("[🚀] Starting Ad Analysis Graph...")
+        inputs = {"filters": filters or {}, "skip_sync": skip_sync}
+
+    if batch_mode():
+        # One Batch API job per stage covers every video, so stages run as barriers
+        print("[📦] OpenAI batch mode: running stages over the whole batch.")
+        if inputs is not None:
+            per_video = False
+        use_async = False
+
+    # Both execution modes have the same graph shape, so a run may resume in the other one
+    queued = per_video and AD_EXECUTION == "queue"
+    if queued:
+        print("[📬] Queue execution: per-video sub-runs run as jobs in worker processes.")
+
+    if inputs is not None:
+        registry.start(run_id, per_video, fused)
+    print(f"[🧾] Run ID: {run_id} (resume with: python main.py resume {run_id})")
+
+    trace_path = tracer.start(run_id)
+    if profile:
+        import nodes.extract_frames as extract_frames
+
+        # cProfile only sees the thread it was enabled in
+        extract_frames.EXTRACT_WORKERS = 1
+        tracer.profile_nodes = {"Extract Frames"}
+
+    config = {"max_concurrency": max_concurrency, "configurable": {"thread_id": run_id}}
+    registry.set_status(run_id, "running")
+    try:
+        final_state = invoke_checkpointed(inputs, config, per_video, fused, use_async, queued)
+    except BaseException:
+        registry.set_status(run_id, "failed")
+        print(f"[❌] Run {run_id} stopped. Resume with: python main.py resume {run_id}")
+        raise
+    finally:
+        tracer.close()
+        get_storage_manager().unpin_all()
+    registry.set_status(run_id, "completed")
+
+    print_run_summary(final_state)
+
+    print(f"\n[⏱️] Performance (trace: {trace_path}):")
+    summarize_trace(tracer.records)
+    if profile:
+        profile_path = save_profile(run_id)
+        if profile_path:
+            print(f"[✅] Saved Extract Frames profile to: {profile_path}")
+    if not keep_checkpoints:
+        delete_run(run_id)
+        trace_path.unlink(missing_ok=True)
+    return final_state
+
+# ---- Visualize the graph structure ----
+def render_graph(per_video: bool = True, fused: bool = AD_ANALYSIS_MODE == "fused", force: bool = False) -> Optional[Path]:
+    """
+    Saves the graph as Mermaid source (graph_output.mmd) and as a PNG
+    (graph_output.png). The PNG is drawn locally with Graphviz when pygraphviz
+    is installed, otherwise by the mermaid.ink web service, and only when the
+    topology differs from the saved .mmd (or with `force`).
+
+    Returns:
+        Path: The PNG, or None if it could not be drawn.
+    """
+    graph = compiled_graph(per_video, fused).get_graph()
+    mermaid = graph.draw_mermaid()
+    topology = hashlib.sha256(mermaid.encode("utf-8")).hexdigest()[:12]
+    mermaid_path = FINAL_OUTPUT_DIR / "graph_output.mmd"
+    png_path = FINAL_OUTPUT_DIR / "graph_output.png"
+
+    unchanged = mermaid_path.exists() and mermaid_path.read_text(encoding="utf-8") == mermaid
+    if unchanged and png_path.exists() and not force:
+        print(f"[⏩] Graph topology {topology} unchanged: {png_path}")
+        return png_path
+    mermaid_path.write_text(mermaid, encoding="utf-8")
+    print(f"[✅] Saved graph topology {topology} to: {mermaid_path}")
 
     try:
-        png_bytes = graph.get_graph().draw_mermaid_png()
-        output_path = FINAL_OUTPUT_DIR / "graph_output.png"
-        with open(output_path, "wb") as f:
-            f.write(png_bytes)
-        print(f"[✅] Saved graph visualization to: {output_path}")
+        try:
+            png_bytes = graph.draw_png()
+        except ImportError:
+            print("[🖼️] pygraphviz is not installed, rendering with mermaid.ink...")
+            png_bytes = graph.draw_mermaid_png()
     except Exception as e:
         print(f"[❌] Graph visualization failed: {e}")
+        return None
+    with open(png_path, "wb") as f:
+        f.write(png_bytes)
+    print(f"[✅] Saved graph visualization to: {png_path}")
+    return png_path
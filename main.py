@@ -1,4 +1,205 @@
-from graph import run_ad_analysis_graph
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, Any
+
+def id_list(value: str) -> list:
+    """Parses "1,2" into ["1", "2"]; repeated flags are merged by merge_ids."""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def utc_date(value: str) -> int:
+    """Parses YYYY-MM-DD as midnight UTC, as a unix timestamp."""
+    try:
+        return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+def merge_ids(groups: list) -> list:
+    return sorted({item for group in groups or [] for item in group})
+
+def add_filter_arguments(parser: argparse.ArgumentParser) -> None:
+    filters = parser.add_argument_group("ad filters", "Narrow the run; repeat a flag or pass comma-separated IDs")
+    filters.add_argument("--campaign", action="append", type=id_list, metavar="ID", help="Only ads in these campaigns")
+    filters.add_argument("--adset", action="append", type=id_list, metavar="ID", help="Only ads in these ad sets")
+    filters.add_argument("--ad", action="append", type=id_list, metavar="ID", help="Only these ads")
+    filters.add_argument("--active-only", action="store_true", help="Only ads that are currently running")
+    filters.add_argument("--created-since", type=utc_date, metavar="YYYY-MM-DD", help="Only ads created on or after this day (UTC)")
+    filters.add_argument("--created-before", type=utc_date, metavar="YYYY-MM-DD", help="Only ads created before this day (UTC)")
+    filters.add_argument("--max-ads", type=int, metavar="N", help="At most N ads, the most recently updated first")
+
+def filters_from_args(args: argparse.Namespace) -> Dict[str, Any]:
+    """Builds the run filters (see nodes/get_ads.py), leaving out the ones not given."""
+    filters = {
+        "campaign_ids": merge_ids(args.campaign),
+        "adset_ids": merge_ids(args.adset),
+        "ad_ids": merge_ids(args.ad),
+        "active_only": args.active_only,
+        "created_since": args.created_since,
+        "created_before": args.created_before,
+        "max_ads": args.max_ads,
+    }
+    return {key: value for key, value in filters.items() if value}
+
+# ---- Commands ----
+# Commands import what they need, so `runs`, `trace` and --help start without
+# loading LangGraph or the pipeline nodes. Each takes the parsed arguments,
+# with the ad filters under args.filters.
+
+def run_command(args: argparse.Namespace) -> None:
+    """Starts a new run (the default command)."""
+    from graph import run_ad_analysis_graph
+    run_ad_analysis_graph(profile=args.profile, filters=args.filters)
+
+def resume_command(args: argparse.Namespace) -> None:
+    from graph import run_ad_analysis_graph
+    run_ad_analysis_graph(run_id=args.run_id, profile=args.profile)
+
+def runs_command(args: argparse.Namespace) -> None:
+    from utils.checkpoints import list_runs
+    list_runs()
+
+def trace_command(args: argparse.Namespace) -> None:
+    from utils.tracing import load_trace, summarize_trace
+    summarize_trace(load_trace(args.run_id))
+
+def render_graph_command(args: argparse.Namespace) -> None:
+    from graph import render_graph
+    render_graph(force=args.force)
+
+def export_command(args: argparse.Namespace) -> None:
+    from utils.results import export_results
+    fmt = args.format or ("json" if args.output.endswith(".json") else "csv")
+    count = export_results(args.output, fmt, stage=args.stage, ad_ids=merge_ids(args.export_ads))
+    print(f"[📤] Exported {count} {args.stage} results to {args.output}")
+
+def watch_command(args: argparse.Namespace) -> None:
+    import watcher
+    service = watcher.Watcher(
+        filters=args.filters,
+        interval=args.interval or watcher.WATCH_INTERVAL_SECONDS,
+        workers=args.workers or watcher.WATCH_WORKERS,
+        batch_size=args.batch_size or watcher.WATCH_BATCH_SIZE,
+    )
+    service.run(port=None if args.no_http else args.port or watcher.WATCH_PORT)
+
+def worker_command(args: argparse.Namespace) -> None:
+    import worker
+    worker.run_workers(args.processes or worker.WORKER_PROCESSES)
+
+def queue_server_command(args: argparse.Namespace) -> None:
+    from utils.jobs import SqliteJobQueue, serve_job_queue
+    try:
+        server = serve_job_queue(SqliteJobQueue(), args.host, args.port)
+    except ValueError as e:
+        raise SystemExit(f"[❌] {e}")
+    print(f"[📬] Job queue on http://{args.host}:{server.server_port} (workers: JOB_QUEUE_URL=http://<this host>:{server.server_port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[🛑] Stopping queue server.")
+
+def storage_command(args: argparse.Namespace) -> None:
+    from utils.storage import get_storage_manager, print_storage_report
+    if args.evict:
+        get_storage_manager().enforce()
+    print_storage_report()
+
+def creatives_command(args: argparse.Namespace) -> None:
+    from utils.creatives import print_creative_groups
+    print_creative_groups()
+
+def jobs_command(args: argparse.Namespace) -> None:
+    from utils.jobs import get_job_queue
+    counts = get_job_queue().stats()
+    print(f"[📬] Jobs: {', '.join(f'{status}: {n}' for status, n in sorted(counts.items())) or 'none'}")
+
+def import_legacy_command(args: argparse.Namespace) -> None:
+    from nodes.get_ads import load_stored_ads
+    from nodes.get_video_urls import get_ad_video_id
+    from utils.results import get_result_store, import_legacy
+    from utils.settings import DATA_DIR
+    written = import_legacy(args.data_dir or DATA_DIR)
+    print(f"[📥] Imported {sum(written.values())} results ({', '.join(f'{stage}: {n}' for stage, n in written.items())})")
+    # Link the imported videos to the ads in the local ad store
+    links = [(ad["id"], f"video_{get_ad_video_id(ad)}") for ad in load_stored_ads() if get_ad_video_id(ad)]
+    get_result_store().link_ads(links)
+    print(f"[🔗] Linked {len(links)} ads to their videos")
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the CLI; every subcommand names its function with set_defaults(func=...)."""
+    parser = argparse.ArgumentParser(description="Analyze Facebook video ads.")
+    parser.add_argument("--plan", action="store_true", help="Show which stages would run for each video, then exit")
+    parser.add_argument("--profile", action="store_true", help="Profile the Extract Frames stage with cProfile")
+    add_filter_arguments(parser)
+    parser.set_defaults(func=run_command, command=None)
+    commands = parser.add_subparsers(dest="command")
+
+    resume = commands.add_parser("resume", help="Continue an interrupted run from its last checkpoint")
+    resume.add_argument("run_id")
+    resume.set_defaults(func=resume_command)
+
+    commands.add_parser("runs", help="List recent runs").set_defaults(func=runs_command)
+
+    trace = commands.add_parser("trace", help="Summarize the performance trace of a run")
+    trace.add_argument("run_id")
+    trace.set_defaults(func=trace_command)
+
+    render = commands.add_parser("render-graph", help="Save the graph structure as Mermaid source and a PNG")
+    render.add_argument("--force", action="store_true", help="Redraw the PNG even if the topology is unchanged")
+    render.set_defaults(func=render_graph_command)
+
+    export = commands.add_parser("export", help="Write stored results to CSV or JSON")
+    export.add_argument("output", help="File to write, e.g. ads.csv")
+    export.add_argument("--format", choices=["csv", "json"], help="Defaults to the output file's extension")
+    export.add_argument("--stage", default="analyze_ad",
+                        choices=["transcribe", "analyze_transcription", "analyze_frames", "analyze_ad"],
+                        help="Which results to export (default: the final analyses)")
+    export.add_argument("--ad-ids", dest="export_ads", action="append", type=id_list, metavar="ID", help="Only results of these ads")
+    export.set_defaults(func=export_command)
+
+    watch = commands.add_parser("watch", help="Keep running and analyze new or changed ads as they appear")
+    watch.add_argument("--interval", type=float, help="Seconds between polls of the ad account (default: WATCH_INTERVAL_SECONDS or 300)")
+    watch.add_argument("--workers", type=int, help="Videos analyzed in parallel (default: WATCH_WORKERS or 4)")
+    watch.add_argument("--batch-size", type=int, help="Most ads per graph run (default: WATCH_BATCH_SIZE or 20)")
+    watch.add_argument("--port", type=int, help="Port for /webhook and /metrics on localhost (default: WATCH_PORT or 8780)")
+    watch.add_argument("--no-http", action="store_true", help="Poll only; no webhook or metrics endpoint")
+    watch.set_defaults(func=watch_command)
+
+    worker = commands.add_parser("worker", help="Run video jobs of graph runs in queue execution (AD_EXECUTION=queue)")
+    worker.add_argument("--processes", type=int, help="Worker processes on this host (default: WORKER_PROCESSES or the CPU count)")
+    worker.set_defaults(func=worker_command)
+
+    queue_server = commands.add_parser("queue-server", help="Serve the job queue to workers on other hosts")
+    queue_server.add_argument("--host", default="127.0.0.1", help="Interface to listen on; 0.0.0.0 for other hosts, which requires JOB_QUEUE_TOKEN (default: 127.0.0.1)")
+    queue_server.add_argument("--port", type=int, default=8790, help="Port (default: 8790)")
+    queue_server.set_defaults(func=queue_server_command)
+
+    storage = commands.add_parser("storage", help="Show disk usage by stage")
+    storage.add_argument("--evict", action="store_true", help="Evict media past the STORAGE_QUOTA_*_MB quotas first")
+    storage.set_defaults(func=storage_command)
+
+    commands.add_parser("creatives", help="List creatives uploaded under several video ids").set_defaults(func=creatives_command)
+    commands.add_parser("jobs", help="Count the jobs on the job queue by status").set_defaults(func=jobs_command)
+
+    legacy = commands.add_parser("import-legacy", help="Load per-video result files from before the result store")
+    legacy.add_argument("--data-dir", help="Directory holding transcriptions/, ad_analysis/ etc. (default: the data directory)")
+    legacy.set_defaults(func=import_legacy_command)
+    return parser
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+    args.filters = filters_from_args(args)
+
+    if args.filters and args.command not in (None, "watch"):
+        parser.error(f"ad filters only apply to new runs, --plan and `watch`, not to `{args.command}`")
+    if args.command == "watch" and "max_ads" in args.filters:
+        parser.error("--max-ads does not apply to `watch`")
+
+    if args.plan:
+        from graph import plan_ad_analysis
+        plan_ad_analysis(filters=args.filters)
+        return
+    args.func(args)
 
 if __name__ == "__main__":
-    run_ad_analysis_graph()
+    main()
@@ -0,0 +1,68 @@
+"""
+Latency and failure injection shared by the mock servers.
+"""
+import argparse
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+class Faults:
+    """
+    Decides, per request, how long to stall and whether to fail.
+
+    Args:
+        latency_ms (float): Base response latency.
+        jitter_ms (float): Uniform extra latency on top of the base.
+        error_rate (float): Share of requests answered with a 500.
+        rate_limit_rate (float): Share of requests answered with a 429.
+        retry_after_ms (int): retry-after-ms sent with every 429.
+        seed (int, optional): Seed for reproducible runs.
+    """
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 rate_limit_rate: float = 0, retry_after_ms: int = 200, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {"requests": 0, "429": 0, "500": 0}
+
+    def inject(self) -> Optional[int]:
+        """Sleeps for the configured latency; returns 429 or 500 to fail the request, else None."""
+        with self.lock:
+            delay = (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+            roll = self.random.random()
+            self.counts["requests"] += 1
+            status = None
+            if roll < self.rate_limit_rate:
+                status = 429
+            elif roll < self.rate_limit_rate + self.error_rate:
+                status = 500
+            if status:
+                self.counts[str(status)] += 1
+        if delay:
+            time.sleep(delay)
+        return status
+
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser, prefix: str = "") -> None:
+        """Adds --{prefix}latency-ms, --{prefix}jitter-ms, --{prefix}error-rate and --{prefix}rate-limit-rate."""
+        parser.add_argument(f"--{prefix}latency-ms", type=float, default=0, help="Base response latency")
+        parser.add_argument(f"--{prefix}jitter-ms", type=float, default=0, help="Extra uniform random latency")
+        parser.add_argument(f"--{prefix}error-rate", type=float, default=0, help="Share of requests failing with 500")
+        parser.add_argument(f"--{prefix}rate-limit-rate", type=float, default=0, help="Share of requests failing with 429")
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, prefix: str = "", seed: Optional[int] = None) -> "Faults":
+        attr = prefix.replace("-", "_")
+        return cls(
+            latency_ms=getattr(args, f"{attr}latency_ms"),
+            jitter_ms=getattr(args, f"{attr}jitter_ms"),
+            error_rate=getattr(args, f"{attr}error_rate"),
+            rate_limit_rate=getattr(args, f"{attr}rate_limit_rate"),
+            seed=seed,
+        )
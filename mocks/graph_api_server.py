@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Meta Graph API endpoints the pipeline uses: the paged
+/act_{id}/ads edge (with `filtering`), multi-ID and single video
+source lookups, and a CDN that serves the MP4 files (with Range support).
+Latency, 500s and 429s can be injected into the API, and the CDN can be
+throttled.
+
+Usage:
+    python -m mocks.graph_api_server --ads 200 --videos 50 [--port 8766] [--latency-ms 150]
+
+Then point the pipeline at it:
+    FB_GRAPH_API_URL=http://127.0.0.1:8766/v19.0 FB_AD_ACCOUNT_ID=bench FB_ACCESS_TOKEN=test python main.py
+"""
+import argparse
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+from mocks.faults import Faults
+
+API_VERSION = "v19.0"
+
+class FakeGraphAPI:
+    """
+    Serves `ads` (dicts shaped like ads.json) and `videos` (video_id -> MP4 path).
+    `bytes_per_sec` throttles every CDN response (0 = unlimited), and with
+    `drop_after_bytes` every CDN response closes the connection after that
+    many bytes of its body, short of its Content-Length (0 = never).
+    """
+
+    def __init__(self, ads: list, videos: Dict[str, Path], faults: Optional[Faults] = None, bytes_per_sec: int = 0):
+        self.ads = sorted(ads, key=lambda ad: ad.get("updated_time", ""))
+        self.videos = videos
+        self.faults = faults or Faults()
+        self.bytes_per_sec = bytes_per_sec
+        self.drop_after_bytes = 0
+        self.base_url = ""
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def ads_page(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """One page of the /ads edge. The cursor is the offset into the filtered ads."""
+        ads = self.ads
+        for condition in json.loads(params.get("filtering", "[]")):
+            ads = [ad for ad in ads if matches_condition(ad, condition)]
+
+        limit = int(params.get("limit", 25))
+        offset = int(params.get("after", 0))
+        page = {"data": ads[offset:offset + limit]}
+        if offset + limit < len(ads):
+            next_params = {**params, "after": str(offset + limit)}
+            page["paging"] = {
+                "cursors": {"before": str(offset), "after": str(offset + limit)},
+                "next": f"{self.base_url}/{API_VERSION}/{params['_path']}?{urlencode({k: v for k, v in next_params.items() if k != '_path'})}",
+            }
+        return page
+
+    def video_info(self, video_id: str) -> Optional[Dict[str, Any]]:
+        if video_id not in self.videos:
+            return None
+        return {
+            "id": video_id,
+            "source": f"{self.base_url}/cdn/{video_id}.mp4?oh=signed",
+            "permalink_url": f"/bench/videos/{video_id}/",
+        }
+
+def parse_graph_time(value: Optional[str]) -> int:
+    return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp()) if value else 0
+
+def matches_condition(ad: Dict[str, Any], condition: Dict[str, Any]) -> bool:
+    """Evaluates one `filtering` condition, e.g. {"field": "campaign.id", "operator": "IN", "value": [...]}."""
+    value = ad
+    for part in condition["field"].split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    if condition["field"].endswith("_time"):
+        value = parse_graph_time(value)
+
+    operator, expected = condition["operator"], condition["value"]
+    if operator == "IN":
+        return value in expected
+    if operator == "NOT_IN":
+        return value not in expected
+    if operator == "EQUAL":
+        return value == expected
+    if operator == "GREATER_THAN":
+        return value > int(expected)
+    if operator == "LESS_THAN":
+        return value < int(expected)
+    raise ValueError(f"Unsupported filtering operator: {operator}")
+
+def graph_error(message: str, code: int = 100) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": "GraphMethodException", "code": code}}
+
+def make_handler(state: FakeGraphAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.startswith("/cdn/"):
+                self.send_video(url.path)
+                return
+
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status = state.faults.inject()
+            if status == 429:
+                state.count("429")
+                self.send_json(graph_error("(#17) User request limit reached", code=17), 429, {"Retry-After": "1"})
+                return
+            if status == 500:
+                state.count("500")
+                self.send_json(graph_error("An unexpected error has occurred. Please retry your request later.", code=2), 500)
+                return
+            if not params.get("access_token"):
+                self.send_json(graph_error("An access token is required to request this resource.", code=104), 400)
+                return
+
+            path = url.path.removeprefix(f"/{API_VERSION}").strip("/")
+            if re.fullmatch(r"act_[^/]+/ads", path):
+                state.count("ads")
+                self.send_json(state.ads_page({**params, "_path": path}))
+            elif path == "" and "ids" in params:
+                state.count("video_ids")
+                ids = params["ids"].split(",")
+                infos = {video_id: state.video_info(video_id) for video_id in ids}
+                missing = [video_id for video_id, info in infos.items() if info is None]
+                if missing:
+                    # One bad ID fails the whole multi-ID request, like the real API
+                    self.send_json(graph_error(f"(#803) Some of the aliases you requested do not exist: {','.join(missing)}", 803), 404)
+                else:
+                    self.send_json(infos)
+            elif re.fullmatch(r"\d+", path):
+                state.count("video")
+                info = state.video_info(path)
+                if info:
+                    self.send_json(info)
+                else:
+                    self.send_json(graph_error(f"Unsupported get request. Object with ID '{path}' does not exist", 100), 400)
+            else:
+                self.send_json(graph_error(f"Unknown path components: /{path}", 2500), 400)
+
+        def send_video(self, path: str) -> None:
+            state.count("cdn")
+            video_path = state.videos.get(Path(path).stem)
+            if not video_path:
+                self.send_json({"error": "not found"}, 404)
+                return
+
+            data = video_path.read_bytes()
+            start = 0
+            match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1))
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+
+            end = min(len(data), start + state.drop_after_bytes) if state.drop_after_bytes else len(data)
+            chunk = 64 * 1024
+            for offset in range(start, end, chunk):
+                self.wfile.write(data[offset:min(offset + chunk, end)])
+                if state.bytes_per_sec:
+                    time.sleep(chunk / state.bytes_per_sec)
+            if end < len(data):
+                self.close_connection = True
+
+    return Handler
+
+def serve(state: FakeGraphAPI, port: int = 8766) -> ThreadingHTTPServer:
+    """Starts the fake Graph API in a background thread and returns it; `server.state` holds `state`."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    state.base_url = f"http://127.0.0.1:{server.server_port}"
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    from benchmarks.scenarios import build_scenario
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--ads", type=int, default=50, help="Number of synthetic ads")
+    parser.add_argument("--videos", type=int, default=20, help="Number of distinct videos shared by the ads")
+    parser.add_argument("--seconds", type=float, default=8, help="Length of every synthetic video")
+    parser.add_argument("--bytes-per-sec", type=int, default=0, help="CDN throttle (0 = unlimited)")
+    Faults.add_arguments(parser)
+    args = parser.parse_args()
+
+    scenario = build_scenario(Path(tempfile.mkdtemp(prefix="graph_api_")), args.ads, args.videos, args.seconds)
+    state = FakeGraphAPI(scenario.ads, scenario.videos, Faults.from_args(args), args.bytes_per_sec)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    state.base_url = f"http://127.0.0.1:{args.port}"
+    print(f"[🧪] Fake Graph API on {state.base_url}/{API_VERSION} ({len(scenario.ads)} ads, {len(scenario.videos)} videos)")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Local stand-in for the OpenAI endpoints the pipeline uses: chat completions
+(text and vision), audio transcriptions, files and batches. Answers are canned
+but shaped like the prompts expect, so the whole graph runs offline. Latency,
+500s and 429s (with retry-after-ms) can be injected.
+
+Usage:
+    python -m mocks.openai_server [--port 8765] [--batch-delay 2] [--latency-ms 300] [--rate-limit-rate 0.05]
+
+Then point the pipeline at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python main.py
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from mocks.faults import Faults
+
+FAKE_TRANSCRIPT = "السلام علیکم، آج ہی آرڈر کریں اور پیسے واپس کی گارنٹی حاصل کریں"
+
+FAKE_ANSWERS = {
+    "hook": "Money-back guarantee in the first line",
+    "tone": "confident",
+    "power_phrases": "agar pasand na aaye to paise wapas",
+    "visual": "standing explaining",
+    "selling_techniques": ["Urgency", "Risk reversal"],
+}
+
+def fake_from_schema(schema: Dict[str, Any], name: str = "") -> Any:
+    """Fills a JSON schema with canned values (FAKE_ANSWERS where the property name matches)."""
+    if name in FAKE_ANSWERS:
+        return FAKE_ANSWERS[name]
+    if schema.get("type") == "object":
+        return {key: fake_from_schema(sub, key) for key, sub in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        return [fake_from_schema(schema.get("items", {}))]
+    return {"integer": 0, "number": 0, "boolean": False}.get(schema.get("type"), "...")
+
+class PrefixCache:
+    """
+    Mimics provider prompt caching: prompts of at least MIN_TOKENS tokens get
+    their longest previously seen prefix, in STEP_TOKENS increments, reported
+    as cached_tokens. Tokens are counted as 4 characters, like the usage.
+    """
+
+    MIN_TOKENS = 1024
+    STEP_TOKENS = 128
+
+    def __init__(self):
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def cached_tokens(self, text: str) -> int:
+        step = self.STEP_TOKENS * 4
+        if len(text) < self.MIN_TOKENS * 4:
+            return 0
+
+        digest = hashlib.sha256()
+        prefixes = []
+        for end in range(step, len(text) + 1, step):
+            digest.update(text[end - step:end].encode("utf-8"))
+            prefixes.append(digest.copy().hexdigest())
+
+        with self.lock:
+            hits = 0
+            for prefix in prefixes:
+                if prefix not in self.seen:
+                    break
+                hits += 1
+            self.seen.update(prefixes)
+        cached = hits * self.STEP_TOKENS
+        return cached if cached >= self.MIN_TOKENS else 0
+
+def fake_chat_completion(body: Dict[str, Any], prefix_cache: Optional[PrefixCache] = None) -> Dict[str, Any]:
+    """Builds a chat.completion answer that matches what the calling node parses."""
+    text = json.dumps(body.get("messages", []), ensure_ascii=False)
+    response_format = (body.get("response_format") or {}).get("type")
+
+    if response_format == "json_schema":
+        content = json.dumps(fake_from_schema(body["response_format"]["json_schema"]["schema"]), ensure_ascii=False)
+    elif response_format == "json_object":
+        content = json.dumps({name: "standing explaining" for name in sorted(set(re.findall(r"frame_\d+\.jpg", text)))})
+    elif "power_phrases" in text:
+        content = json.dumps({key: FAKE_ANSWERS[key] for key in ("hook", "tone", "power_phrases", "visual")})
+    elif "image_url" in text:
+        content = "standing explaining"
+    else:
+        content = "\n".join(f"- {t}" for t in FAKE_ANSWERS["selling_techniques"])
+
+    prompt_tokens = len(text) // 4
+    completion_tokens = len(content) // 4
+    cached_tokens = prefix_cache.cached_tokens(text) if prefix_cache else 0
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                  "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+    }
+
+class FakeOpenAI:
+    """
+    In-memory files, batches and prompt prefix cache. Batches complete
+    `batch_delay` seconds after creation. Every request goes through `faults` first.
+    """
+
+    def __init__(self, batch_delay: float, faults: Optional[Faults] = None):
+        self.batch_delay = batch_delay
+        self.faults = faults or Faults()
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.prefix_cache = PrefixCache()
+        self.lock = threading.Lock()
+
+    def add_file(self, filename: str, content: bytes, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        meta = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        lines = [line for line in self.files[body["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": body["endpoint"], "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"], "status": "validating", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None, "metadata": body.get("metadata"),
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        return batch
+
+    def retrieve_batch(self, batch_id: str) -> Dict[str, Any]:
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch["status"] in ("validating", "in_progress"):
+                elapsed = time.time() - batch["created_at"]
+                if elapsed >= self.batch_delay:
+                    self._complete(batch)
+                else:
+                    batch["status"] = "in_progress"
+            return batch
+
+    def _complete(self, batch: Dict[str, Any]) -> None:
+        output = []
+        for line in self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_chat_completion(request["body"], self.prefix_cache)},
+                "error": None,
+            }, ensure_ascii=False))
+
+        content = ("\n".join(output) + "\n").encode("utf-8")
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = {"meta": {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                                        "filename": "batch_output.jsonl", "purpose": "batch_output", "status": "processed"},
+                               "content": content}
+        batch.update({"status": "completed", "output_file_id": file_id, "completed_at": int(time.time())})
+        batch["request_counts"]["completed"] = len(output)
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Returns form fields; file parts map to (filename, bytes)."""
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True)
+        fields[name] = (filename, payload) if filename else payload.decode("utf-8")
+    return fields
+
+def make_handler(state: FakeOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def injected_failure(self) -> bool:
+            """Applies the configured latency and answers with an injected 429 or 500 if one is drawn."""
+            status = state.faults.inject()
+            if status == 429:
+                body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode()
+                self.send_response(429)
+                self.send_header("retry-after-ms", str(state.faults.retry_after_ms))
+            elif status == 500:
+                body = json.dumps({"error": {"message": "The server had an error while processing your request.", "type": "server_error"}}).encode()
+                self.send_response(500)
+            else:
+                return False
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return True
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            body = self.read_body()
+            if self.injected_failure():
+                return
+
+            if path.endswith("/chat/completions"):
+                self.send_json(fake_chat_completion(json.loads(body), state.prefix_cache))
+            elif path.endswith("/audio/transcriptions"):
+                self.send_json({"text": FAKE_TRANSCRIPT})
+            elif path.endswith("/files"):
+                fields = parse_multipart(self.headers["Content-Type"], body)
+                filename, content = fields["file"]
+                self.send_json(state.add_file(filename, content, fields.get("purpose", "batch")))
+            elif path.endswith("/batches"):
+                self.send_json(state.create_batch(json.loads(body)))
+            else:
+                self.send_json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if self.injected_failure():
+                return
+            match = re.search(r"/batches/([^/]+)$", path)
+            if match and match.group(1) in state.batches:
+                self.send_json(state.retrieve_batch(match.group(1)))
+                return
+
+            match = re.search(r"/files/([^/]+)/content$", path)
+            if match and match.group(1) in state.files:
+                content = state.files[match.group(1)]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+
+            self.send_json({"error": {"message": f"Not found: {path}"}}, 404)
+
+    return Handler
+
+def serve(port: int = 8765, batch_delay: float = 2.0, faults: Optional[Faults] = None) -> ThreadingHTTPServer:
+    """Starts the fake server in a background thread and returns it; `server.state` holds the FakeOpenAI."""
+    state = FakeOpenAI(batch_delay, faults)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="Seconds before a batch completes")
+    Faults.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(FakeOpenAI(args.batch_delay, Faults.from_args(args))))
+    print(f"[🧪] Fake OpenAI server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,33 @@
-from openai import OpenAI
-from pathlib import Path
-from dotenv import load_dotenv
-import os
+import asyncio
 import json
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from utils.cache import cache_key, get_result_cache
+from utils.deps import check_stage, get_dependency_tracker, split_fresh
+from utils.openai_batch import batch_mode, run_chat_batch
+from utils.openai_client import achat, chat
+from utils.results import get_result_store, read_result
+from utils.tokens import TRANSCRIPT_TOKEN_BUDGET, VISUAL_SUMMARY_TOKEN_BUDGET, fit_to_budget
 
-# Load API Key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+MODEL = "gpt-4o"
+TEMPERATURE = 0.4
 
-# Directories
-ROOT_DIR = Path(__file__).resolve().parent.parent
-TRANSCRIPTION_DIR = ROOT_DIR / "transcription_analysis"
-FRAME_ANALYSIS_DIR = ROOT_DIR / "frame_analysis"
-AD_ANALYSIS_DIR = ROOT_DIR / "ad_analysis"
-AD_ANALYSIS_DIR.mkdir(parents=True, exist_ok=True)
-
-# Prompt template
+# Prompt: the static instructions go first (as the system message) and the
+# per-ad insights last, so every call shares a cacheable prefix
 AD_ANALYSIS_PROMPT = (
-    "STEP 1: Analyze the ad insights below.\n\n"
-    "Ad Transcript Summary: {transcription}\n"
-    "Visual Summary: {visual_summary}\n\n"
-    "Now answer these clearly:\n"
+    "STEP 1: Analyze the ad insights you are given: a summary of the ad transcript and a summary of its visuals.\n\n"
+    "Then answer these clearly:\n"
     "1. What is the **main hook line or pattern** used in this ad? Why did it work?\n"
     "2. What is the **tone** of the ad (e.g., emotional, confident, hype)?\n"
     "3. What **power phrases or emotional angles** stood out?\n"
     "4. What **gestures, expressions, or camera angles or visual thing** were impactful?\n\n"
     "Important: If you include any Urdu phrases, always write them in **Roman Urdu** (Urdu written in English script like 'agar pasand na aaye to paise wapas') instead of using Urdu script. Do NOT use Urdu alphabet or Nastaliq script.\n\n"
     "Please reply in only the following JSON format:\n"
-    '{{\n  "hook":"...",\n  "tone":"...",\n  "power_phrases":"...",\n  "visual":"..."\n}}'
+    '{\n  "hook":"...",\n  "tone":"...",\n  "power_phrases":"...",\n  "visual":"..."\n}'
 )
 
+AD_INSIGHTS_TEMPLATE = "Ad Transcript Summary: {transcription}\nVisual Summary: {visual_summary}"
+
 def clean_json_string(text: str) -> str:
     # Remove leading/trailing whitespace and code block markers
     text = text.strip().removeprefix("```json").removesuffix("```").strip()
@@ -46,64 +42,172 @@ def clean_json_string(text: str) -> str:
 
     return text
 
-def analyze_combined_ad(transcription: str, visual_summary: str) -> Dict[str, str]:
-    prompt = AD_ANALYSIS_PROMPT.format(
+def build_ad_request(transcription: str, visual_summary: str) -> Dict[str, Any]:
+    """Returns the chat completion request for the final analysis of one ad."""
+    insights = AD_INSIGHTS_TEMPLATE.format(
         transcription=transcription,
         visual_summary=visual_summary
     )
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": AD_ANALYSIS_PROMPT},
+            {"role": "user", "content": insights}
+        ],
+        "temperature": TEMPERATURE,
+    }
+
+def parse_ad_response(response) -> Dict[str, str]:
+    raw_text = response.choices[0].message.content or ""
+    try:
+        return json.loads(raw_text)
+    except json.JSONDecodeError:
+        print("[⚠️] Raw OpenAI response not valid JSON. Attempting cleanup...")
+        cleaned = clean_json_string(raw_text)
+        return json.loads(cleaned)
+
+def analyze_combined_ad(transcription: str, visual_summary: str) -> Dict[str, str]:
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4
-        )
-        raw_text = response.choices[0].message.content or ""
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            print("[⚠️] Raw OpenAI response not valid JSON. Attempting cleanup...")
-            cleaned = clean_json_string(raw_text)
-            return json.loads(cleaned)
+        return parse_ad_response(chat(**build_ad_request(transcription, visual_summary)))
     except Exception as e:
         print(f"[❌] Final ad analysis error: {e}")
         return {}
 
-def final_ad_analysis(state: Dict[str, Any]) -> Dict[str, Any]:
-    transcription_results = state.get("transcription_analysis", [])
-    frame_results = state.get("frame_analysis", [])
-    if not transcription_results or not frame_results:
-        print("[⚠️] Missing inputs — skipping ad analysis.")
-        return {"final_ad_analysis": []}
+async def aanalyze_combined_ad(transcription: str, visual_summary: str) -> Dict[str, str]:
+    """Async variant of analyze_combined_ad."""
+    try:
+        return parse_ad_response(await achat(**build_ad_request(transcription, visual_summary)))
+    except Exception as e:
+        print(f"[❌] Final ad analysis error: {e}")
+        return {}
+
+def analyze_ads_in_batch(jobs: list) -> list[Dict[str, str]]:
+    """Sends the cache misses among `jobs` as one Batch API job; returns one result per job."""
+    requests = {job["key"]: build_ad_request(job["transcript"], job["visual"]) for job in jobs if not job["result"]}
+    responses = run_chat_batch("analyze_ad", requests)
+
+    results = []
+    for job in jobs:
+        result = job["result"]
+        response = responses.get(job["key"])
+        if not result and response:
+            try:
+                result = parse_ad_response(response)
+            except Exception as e:
+                print(f"[❌] Final ad analysis error: {e}")
+        results.append(result or {})
+    return results
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the two analyses that determines the final analysis."""
+    return {"model": MODEL, "prompt": AD_ANALYSIS_PROMPT + AD_INSIGHTS_TEMPLATE, "temperature": TEMPERATURE,
+            "transcript_budget": TRANSCRIPT_TOKEN_BUDGET, "visual_budget": VISUAL_SUMMARY_TOKEN_BUDGET}
+
+def recorded_entries(handles: list) -> list:
+    """Rebuilds final_ad_analysis entries from the handles of up-to-date final analyses."""
+    return [{"video": handle["id"], "final_analysis": read_result(handle)} for handle in handles]
+
+def prepare_ad_jobs(state: Dict[str, Any]) -> tuple:
+    """
+    Joins transcript and frame analyses by video id. Videos whose recorded
+    final analysis is up to date are returned as final_ad_analysis entries;
+    the rest are read and looked up in the result cache.
 
-    combined_results = []
+    Returns:
+        tuple: (entries of up-to-date videos, job dicts to run)
+    """
+    frames_by_video = {item["id"]: item for item in state.get("frame_analysis", [])}
+    cache = get_result_cache()
+    jobs = []
+    stale = []
 
-    for transcript in transcription_results:
-        video_name = Path(transcript.get("file", "")).stem
-        transcript_text = transcript.get("analysis", "")
-        if not video_name or not transcript_text:
+    for transcript in state.get("transcription_analysis", []):
+        video_name = transcript.get("id")
+        matching_frame = frames_by_video.get(video_name)
+        if not video_name or not matching_frame:
             continue
 
-        matching_frame = next(
-            (item for item in frame_results if Path(item.get("video", "")).stem == video_name),
-            None
-        )
-        if not matching_frame:
+        fingerprint, fresh = check_stage(video_name, "analyze_ad", stage_params(), [transcript, matching_frame])
+        if fresh:
+            print(f"[⏩] Up to date: {video_name} final analysis")
+            jobs.append({"id": video_name, "fresh": fresh})
             continue
+        stale.append((video_name, fingerprint, transcript, matching_frame))
 
-        visual_text = " | ".join(matching_frame.get("analysis", {}).values())
-        print(f"[🧠] Running final analysis for: {video_name}")
-        result = analyze_combined_ad(transcript_text, visual_text)
+    # Both analyses of every stale video in one indexed join; handles recorded
+    # before the result store existed point at files instead
+    stored = [video_name for video_name, _, transcript, frame in stale if "stage" in transcript and "stage" in frame]
+    joined = get_result_store().join(stored, ["analyze_transcription", "analyze_frames"])
+
+    for video_name, fingerprint, transcript, matching_frame in stale:
+        inputs = joined.get(video_name) or {"analyze_transcription": read_result(transcript), "analyze_frames": read_result(matching_frame)}
+        transcript_text, frame_analysis = inputs["analyze_transcription"], inputs["analyze_frames"]
+        if not transcript_text:
+            continue
+
+        transcript_text = fit_to_budget(transcript_text, TRANSCRIPT_TOKEN_BUDGET, MODEL, "transcript summary")
+        visual_text = fit_to_budget(" | ".join(frame_analysis.values()), VISUAL_SUMMARY_TOKEN_BUDGET, MODEL, "visual summary")
+
+        key = cache_key("analyze_ad", MODEL, AD_ANALYSIS_PROMPT + AD_INSIGHTS_TEMPLATE, {"temperature": TEMPERATURE}, [transcript_text, visual_text])
+        result = cache.get(key, "analyze_ad")
 
         if result:
-            output_path = AD_ANALYSIS_DIR / f"{video_name}_final.json"
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
-            print(f"[✅] Saved: {output_path.name}")
-            combined_results.append({
-                "video": video_name,
-                "final_analysis": result
-            })
+            print(f"[⏩] Skipping {video_name} (final analysis cached)")
         else:
-            print(f"[❌] Could not generate summary for {video_name}")
+            print(f"[🧠] Running final analysis for: {video_name}")
+        jobs.append({"id": video_name, "fingerprint": fingerprint, "transcript": transcript_text, "visual": visual_text, "key": key, "result": result})
+
+    fresh, jobs = split_fresh(jobs)
+    return recorded_entries(fresh), jobs
+
+def finish_ad_job(job: Dict[str, Any], result: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Caches and stores one final analysis; returns its final_ad_analysis entry."""
+    video_name = job["id"]
+    if not result:
+        print(f"[❌] Could not generate summary for {video_name}")
+        return None
+    if not job["result"]:
+        get_result_cache().put(job["key"], "analyze_ad", result)
+
+    handle, written = get_result_store().put(video_name, "analyze_ad", result)
+    if written:
+        print(f"[✅] Saved final analysis: {video_name}")
+    get_dependency_tracker().record(video_name, "analyze_ad", job["fingerprint"], [handle])
+    return {
+        "video": video_name,
+        "final_analysis": result
+    }
+
+def final_ad_analysis(state: Dict[str, Any]) -> Dict[str, Any]:
+    if not state.get("transcription_analysis") or not state.get("frame_analysis"):
+        print("[⚠️] Missing inputs — skipping ad analysis.")
+        return {"final_ad_analysis": []}
+
+    fresh, jobs = prepare_ad_jobs(state)
+    if batch_mode():
+        results = analyze_ads_in_batch(jobs)
+    else:
+        results = [job["result"] or analyze_combined_ad(job["transcript"], job["visual"]) for job in jobs]
+
+    with get_result_store().transaction():
+        entries = [finish_ad_job(job, result) for job, result in zip(jobs, results)]
+    return {"final_ad_analysis": fresh + [e for e in entries if e]}
+
+async def afinal_ad_analysis(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of final_ad_analysis; videos are analyzed concurrently."""
+    if batch_mode():
+        return await asyncio.to_thread(final_ad_analysis, state)
+
+    if not state.get("transcription_analysis") or not state.get("frame_analysis"):
+        print("[⚠️] Missing inputs — skipping ad analysis.")
+        return {"final_ad_analysis": []}
+
+    fresh, jobs = prepare_ad_jobs(state)
+
+    async def run(job):
+        return job["result"] or await aanalyze_combined_ad(job["transcript"], job["visual"])
 
-    return {"final_ad_analysis": combined_results}
+    results = await asyncio.gather(*(run(job) for job in jobs))
+    with get_result_store().transaction():
+        entries = [finish_ad_job(job, result) for job, result in zip(jobs, results)]
+    return {"final_ad_analysis": fresh + [e for e in entries if e]}
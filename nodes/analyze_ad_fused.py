@@ -0,0 +1,265 @@
+import asyncio
+import json
+from typing import Dict, Any, Optional
+from utils.cache import cache_key, get_result_cache
+from utils.deps import check_stage, get_dependency_tracker
+from utils.openai_batch import batch_mode, run_chat_batch
+from utils.openai_client import achat, chat
+from utils.results import get_result_store, read_result
+from utils.tokens import TRANSCRIPT_TOKEN_BUDGET, VISUAL_SUMMARY_TOKEN_BUDGET, fit_to_budget
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0.4
+
+# Keys of the final analysis, as stored for the analyze_ad stage
+FINAL_FIELDS = ("hook", "tone", "power_phrases", "visual")
+
+# Structured output schema: the four final-analysis fields plus the selling
+# techniques the staged mode gets from a separate transcript-analysis call
+AD_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "hook": {"type": "string"},
+        "tone": {"type": "string"},
+        "power_phrases": {"type": "string"},
+        "visual": {"type": "string"},
+        "selling_techniques": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": [*FINAL_FIELDS, "selling_techniques"],
+    "additionalProperties": False,
+}
+
+# The instructions are the system message and the ad comes last in the user
+# message, so every call shares a cacheable prefix
+FUSED_AD_ANALYSIS_PROMPT = (
+    "You are a marketing strategist reviewing a Pakistani Urdu video ad. You are given the full Urdu transcript "
+    "and a short label for each sampled frame.\n\n"
+    "Answer the following:\n"
+    "- hook: What is the **main hook line or pattern** used in this ad? Why did it work?\n"
+    "- tone: What is the **tone** of the ad (e.g., emotional, confident, hype)?\n"
+    "- power_phrases: What **power phrases or emotional angles** stood out?\n"
+    "- visual: What **gestures, expressions, or camera angles or visual thing** were impactful?\n"
+    "- selling_techniques: Short English keywords for the selling techniques actually used in the transcript, such as "
+    "emotional storytelling, social proof, urgency, risk reversal, direct address to the viewer, or comparison with competitors.\n\n"
+    "Important: If you include any Urdu phrases, always write them in **Roman Urdu** (Urdu written in English script like "
+    "'agar pasand na aaye to paise wapas') instead of using Urdu script. Do NOT use Urdu alphabet or Nastaliq script."
+)
+
+FUSED_INPUT_TEMPLATE = "Transcript:\n{transcript}\n\nFrame labels:\n{frame_labels}"
+
+class AdAnalysisValidationError(ValueError):
+    """Raised when a structured ad analysis does not match AD_ANALYSIS_SCHEMA."""
+
+def validate_ad_analysis(result: Any) -> Dict[str, Any]:
+    """Checks a decoded response against AD_ANALYSIS_SCHEMA and returns it."""
+    if not isinstance(result, dict):
+        raise AdAnalysisValidationError(f"expected an object, got {type(result).__name__}")
+    missing = [field for field in AD_ANALYSIS_SCHEMA["required"] if field not in result]
+    if missing:
+        raise AdAnalysisValidationError(f"missing fields: {', '.join(missing)}")
+    for field in FINAL_FIELDS:
+        if not isinstance(result[field], str) or not result[field].strip():
+            raise AdAnalysisValidationError(f"'{field}' must be a non-empty string")
+    techniques = result["selling_techniques"]
+    if not isinstance(techniques, list) or not all(isinstance(t, str) for t in techniques):
+        raise AdAnalysisValidationError("'selling_techniques' must be a list of strings")
+    return result
+
+def build_fused_request(transcript: str, frame_labels: str) -> Dict[str, Any]:
+    """Returns the single structured-output request for one ad."""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": FUSED_AD_ANALYSIS_PROMPT},
+            {"role": "user", "content": FUSED_INPUT_TEMPLATE.format(transcript=transcript, frame_labels=frame_labels)}
+        ],
+        "temperature": TEMPERATURE,
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": "ad_analysis", "strict": True, "schema": AD_ANALYSIS_SCHEMA},
+        },
+    }
+
+def parse_fused_response(response) -> Dict[str, Any]:
+    """Decodes and validates a structured response; raises on refusals and schema mismatches."""
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise AdAnalysisValidationError(f"model refused: {message.refusal}")
+    try:
+        return validate_ad_analysis(json.loads(message.content or ""))
+    except json.JSONDecodeError as e:
+        raise AdAnalysisValidationError(f"response is not JSON: {e}") from e
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the transcript and frame labels that determines the analysis."""
+    return {"model": MODEL, "prompt": FUSED_AD_ANALYSIS_PROMPT + FUSED_INPUT_TEMPLATE, "temperature": TEMPERATURE,
+            "schema": AD_ANALYSIS_SCHEMA, "transcript_budget": TRANSCRIPT_TOKEN_BUDGET, "visual_budget": VISUAL_SUMMARY_TOKEN_BUDGET}
+
+def recorded_update(handles: list) -> Dict[str, Any]:
+    """Rebuilds a video's state update from its up-to-date (transcript analysis, final analysis) handles."""
+    analysis_handle, final_handle = handles
+    return {
+        "transcription_analysis": [analysis_handle],
+        "final_ad_analysis": [{"video": final_handle["id"], "final_analysis": read_result(final_handle)}],
+    }
+
+def prepare_fused_jobs(state: Dict[str, Any]) -> tuple:
+    """
+    Joins raw transcripts and frame analyses by video id. Videos whose recorded
+    analysis is up to date, or whose transcript is empty, come back as state
+    updates; the rest are read and looked up in the result cache.
+
+    Returns:
+        tuple: (updates of up-to-date and empty videos, job dicts to run)
+    """
+    frames_by_video = {item["id"]: item for item in state.get("frame_analysis", [])}
+    cache = get_result_cache()
+    fresh = []
+    jobs = []
+    stale = []
+
+    for transcript in state.get("transcriptions", []):
+        video_name = transcript.get("id")
+        matching_frame = frames_by_video.get(video_name)
+        if not video_name or not matching_frame:
+            continue
+
+        fingerprint, recorded = check_stage(video_name, "analyze_ad", stage_params(), [transcript, matching_frame])
+        if recorded:
+            print(f"[⏩] Up to date: {video_name} fused analysis")
+            fresh.append(recorded_update(recorded))
+            continue
+        stale.append((video_name, fingerprint, transcript, matching_frame))
+
+    # Transcript and frame labels of every stale video in one indexed join;
+    # handles recorded before the result store existed point at files instead
+    stored = [video_name for video_name, _, transcript, frame in stale if "stage" in transcript and "stage" in frame]
+    joined = get_result_store().join(stored, ["transcribe", "analyze_frames"])
+
+    for video_name, fingerprint, transcript, matching_frame in stale:
+        inputs = joined.get(video_name) or {"transcribe": read_result(transcript), "analyze_frames": read_result(matching_frame)}
+        transcript_text, frame_labels = inputs["transcribe"].strip(), inputs["analyze_frames"]
+        if not transcript_text:
+            print(f"[❌] Could not generate summary for {video_name}: empty transcript")
+            fresh.append({"errors": [{"stage": "analyze_ad", "video_id": video_name, "error": "empty transcript"}]})
+            continue
+
+        transcript_text = fit_to_budget(transcript_text, TRANSCRIPT_TOKEN_BUDGET, MODEL, "transcript")
+        labels_text = "\n".join(f"{name}: {label}" for name, label in frame_labels.items()) or "(no frames)"
+        labels_text = fit_to_budget(labels_text, VISUAL_SUMMARY_TOKEN_BUDGET, MODEL, "frame labels")
+
+        key = cache_key("analyze_ad_fused", MODEL, FUSED_AD_ANALYSIS_PROMPT + FUSED_INPUT_TEMPLATE,
+                        {"temperature": TEMPERATURE, "schema": AD_ANALYSIS_SCHEMA}, [transcript_text, labels_text])
+        result = cache.get(key, "analyze_ad_fused")
+
+        if result:
+            print(f"[⏩] Skipping {video_name} (fused analysis cached)")
+        else:
+            print(f"[🧠] Running fused analysis for: {video_name}")
+        jobs.append({"id": video_name, "fingerprint": fingerprint, "transcript": transcript_text, "frames": labels_text, "key": key, "result": result})
+
+    return fresh, jobs
+
+def finish_fused_job(job: Dict[str, Any], result: Optional[Dict[str, Any]], error: Optional[str]) -> Dict[str, Any]:
+    """
+    Caches one validated analysis and stores both the transcript analysis and
+    the final analysis. Returns the state update for that video.
+    """
+    video_name = job["id"]
+    if not result:
+        print(f"[❌] Could not generate summary for {video_name}: {error}")
+        return {"errors": [{"stage": "analyze_ad", "video_id": video_name, "error": error}]}
+    if not job["result"]:
+        get_result_cache().put(job["key"], "analyze_ad_fused", result)
+
+    store = get_result_store()
+    analysis_handle, written = store.put(video_name, "analyze_transcription", "\n".join(f"- {t}" for t in result["selling_techniques"]))
+    if written:
+        print(f"[✅] Saved analysis: {video_name}")
+
+    final = {field: result[field] for field in FINAL_FIELDS}
+    final_handle, written = store.put(video_name, "analyze_ad", final)
+    if written:
+        print(f"[✅] Saved final analysis: {video_name}")
+
+    get_dependency_tracker().record(video_name, "analyze_ad", job["fingerprint"], [analysis_handle, final_handle])
+    return {
+        "transcription_analysis": [analysis_handle],
+        "final_ad_analysis": [{"video": video_name, "final_analysis": final}],
+    }
+
+def merge_updates(updates: list) -> Dict[str, Any]:
+    merged = {"transcription_analysis": [], "final_ad_analysis": [], "errors": []}
+    for update in updates:
+        for key, value in update.items():
+            merged[key].extend(value)
+    if not merged["errors"]:
+        del merged["errors"]
+    return merged
+
+def analyze_fused(job: Dict[str, Any]) -> tuple:
+    try:
+        return parse_fused_response(chat(**build_fused_request(job["transcript"], job["frames"]))), None
+    except Exception as e:
+        return None, str(e)
+
+async def aanalyze_fused(job: Dict[str, Any]) -> tuple:
+    try:
+        return parse_fused_response(await achat(**build_fused_request(job["transcript"], job["frames"]))), None
+    except Exception as e:
+        return None, str(e)
+
+def analyze_fused_in_batch(jobs: list) -> list:
+    """Sends the cache misses among `jobs` as one Batch API job; returns (result, error) per job."""
+    requests = {job["key"]: build_fused_request(job["transcript"], job["frames"]) for job in jobs if not job["result"]}
+    responses = run_chat_batch("analyze_ad_fused", requests)
+
+    outcomes = []
+    for job in jobs:
+        if job["result"]:
+            outcomes.append((job["result"], None))
+        elif responses.get(job["key"]) is None:
+            outcomes.append((None, "batch request failed"))
+        else:
+            try:
+                outcomes.append((parse_fused_response(responses[job["key"]]), None))
+            except Exception as e:
+                outcomes.append((None, str(e)))
+    return outcomes
+
+def fused_ad_analysis(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    LangGraph-compatible node that analyzes each ad in one structured-output
+    request from the raw transcript and the frame labels, replacing the
+    separate transcript-analysis and final-analysis calls.
+    """
+    if not state.get("transcriptions") or not state.get("frame_analysis"):
+        print("[⚠️] Missing inputs — skipping ad analysis.")
+        return {"final_ad_analysis": []}
+
+    fresh, jobs = prepare_fused_jobs(state)
+    if batch_mode():
+        outcomes = analyze_fused_in_batch(jobs)
+    else:
+        outcomes = [(job["result"], None) if job["result"] else analyze_fused(job) for job in jobs]
+
+    with get_result_store().transaction():
+        return merge_updates(fresh + [finish_fused_job(job, *outcome) for job, outcome in zip(jobs, outcomes)])
+
+async def afused_ad_analysis(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of fused_ad_analysis; videos are analyzed concurrently."""
+    if batch_mode():
+        return await asyncio.to_thread(fused_ad_analysis, state)
+
+    if not state.get("transcriptions") or not state.get("frame_analysis"):
+        print("[⚠️] Missing inputs — skipping ad analysis.")
+        return {"final_ad_analysis": []}
+
+    fresh, jobs = prepare_fused_jobs(state)
+
+    async def run(job):
+        return (job["result"], None) if job["result"] else await aanalyze_fused(job)
+
+    outcomes = await asyncio.gather(*(run(job) for job in jobs))
+    with get_result_store().transaction():
+        return merge_updates(fresh + [finish_fused_job(job, *outcome) for job, outcome in zip(jobs, outcomes)])
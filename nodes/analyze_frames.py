@@ -1,20 +1,42 @@
-from openai import OpenAI
 from pathlib import Path
+import asyncio
 import base64
 import json
+import math
 import os
-from dotenv import load_dotenv
-from typing import Dict, Any
-
-# Load API Key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import cv2
+from typing import Dict, Any, Optional
+from utils.cache import cache_key, get_result_cache
+from utils.creatives import reuse_result
+from utils.deps import check_stage, get_dependency_tracker, split_fresh
+from utils.openai_batch import batch_mode, run_chat_batch
+from utils.openai_client import achat, chat
+from utils.results import get_result_store
+from utils.settings import DATA_DIR
+from utils.storage import get_storage_manager
 
 # Define directories
-ROOT_DIR = Path(__file__).resolve().parent.parent
-FRAMES_DIR = ROOT_DIR / "extracted_frames"
-ANALYSIS_DIR = ROOT_DIR / "frame_analysis"
-ANALYSIS_DIR.mkdir(parents=True, exist_ok=True)
+FRAMES_DIR = DATA_DIR / "extracted_frames"
+
+MODEL = "gpt-4o"
+MAX_TOKENS = 50
+
+# "batch" sends all frames of a video in one request, "single" one request per frame
+FRAME_ANALYSIS_MODE = os.getenv("FRAME_ANALYSIS_MODE", "batch")
+
+# Vision detail per frame: "auto" picks "high" only for frames with dense edges
+# (text overlays, product close-ups), "low" or "high" force one level
+FRAME_DETAIL = os.getenv("FRAME_DETAIL", "auto")
+HIGH_DETAIL_EDGE_DENSITY = float(os.getenv("FRAME_HIGH_DETAIL_EDGE_DENSITY", "0.08"))
+
+# Vision input limits: low detail is a single 512px tile; high detail is scaled
+# to fit 2048x2048 and then to 768px on the short side before tiling
+LOW_DETAIL_SIDE = 512
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_IMAGE_TOKENS = 85
+TILE_TOKENS = 170
 
 # Prompt
 ANALYSIS_PROMPT = (
@@ -36,6 +58,137 @@ def encode_image_to_base64(image_path: Path) -> str:
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
+BATCH_ANALYSIS_PROMPT = (
+    ANALYSIS_PROMPT + " "
+    "You will receive several frames from the same ad, each preceded by its file name. "
+    "Answer for every frame and reply only with a JSON object mapping each file name to its answer, "
+    'e.g. {"frame_1.jpg": "standing explaining", "frame_2.jpg": "red background"}.'
+)
+
+def choose_detail(image) -> str:
+    """Picks the vision detail level for a decoded frame."""
+    if FRAME_DETAIL in ("low", "high"):
+        return FRAME_DETAIL
+    small = cv2.resize(image, (LOW_DETAIL_SIDE, LOW_DETAIL_SIDE), interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), 100, 200)
+    return "high" if (edges > 0).mean() > HIGH_DETAIL_EDGE_DENSITY else "low"
+
+def fit_to_detail(image, detail: str):
+    """Downscales a frame to the largest size the vision model uses at `detail`."""
+    height, width = image.shape[:2]
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_SIDE / max(height, width))
+    else:
+        scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(height, width), HIGH_DETAIL_SHORT_SIDE / min(height, width))
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+def estimate_image_tokens(width: int, height: int, detail: str) -> int:
+    if detail == "low":
+        return BASE_IMAGE_TOKENS
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_IMAGE_TOKENS + TILE_TOKENS * tiles
+
+def prepare_frame(image_path: Path) -> Dict[str, Any]:
+    """
+    Downscales a frame to its vision budget and returns
+    {"name", "b64", "detail", "tokens"} ready to be sent.
+    """
+    image = cv2.imread(str(image_path))
+    detail = choose_detail(image)
+    image = fit_to_detail(image, detail)
+    ret, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    height, width = image.shape[:2]
+    return {
+        "name": image_path.name,
+        "b64": base64.b64encode(buffer.tobytes()).decode("utf-8"),
+        "detail": detail,
+        "tokens": estimate_image_tokens(width, height, detail),
+    }
+
+def prepare_batch(frame_paths: list[Path]) -> Optional[list]:
+    """Prepares all `frame_paths` for one batched request, or returns None if a frame cannot be read."""
+    try:
+        return [prepare_frame(p) for p in frame_paths]
+    except (cv2.error, AttributeError) as e:
+        print(f"[❌] Could not prepare frames for batched analysis: {e}")
+        return None
+
+def log_batch(prepared: list) -> None:
+    image_tokens = sum(frame["tokens"] for frame in prepared)
+    details = ", ".join(f"{frame['name']}={frame['detail']}" for frame in prepared)
+    print(f"[🧠] Analyzing {len(prepared)} frames in one request (~{image_tokens} image tokens; {details})")
+
+def build_batch_request(prepared: list) -> Dict[str, Any]:
+    """Returns the single chat completion request covering all `prepared` frames."""
+    content = [{"type": "text", "text": BATCH_ANALYSIS_PROMPT}]
+    for frame in prepared:
+        content.append({"type": "text", "text": frame["name"]})
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{frame['b64']}", "detail": frame["detail"]}
+        })
+
+    return {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": content}],
+        "response_format": {"type": "json_object"},
+        "max_tokens": MAX_TOKENS * len(prepared) + 20,
+    }
+
+def parse_batch_answers(response, frame_paths: list[Path]) -> Dict[str, str]:
+    """Keeps the answers of a batched response that belong to `frame_paths`."""
+    answers = json.loads(response.choices[0].message.content or "{}")
+    names = {p.name for p in frame_paths}
+    return {name: str(answer).strip() for name, answer in answers.items() if name in names}
+
+def analyze_frames_batch(frame_paths: list[Path]) -> Dict[str, str]:
+    """
+    Analyzes all frames of one video in a single GPT-4o request.
+
+    Returns:
+        dict: frame file name -> answer, for the frames the model answered.
+    """
+    prepared = prepare_batch(frame_paths)
+    if prepared is None:
+        return {}
+    log_batch(prepared)
+    try:
+        return parse_batch_answers(chat(**build_batch_request(prepared)), frame_paths)
+    except Exception as e:
+        print(f"[❌] Batched frame analysis failed: {e}")
+        return {}
+
+async def aanalyze_frames_batch(frame_paths: list[Path]) -> Dict[str, str]:
+    """Async variant of analyze_frames_batch."""
+    prepared = await asyncio.to_thread(prepare_batch, frame_paths)
+    if prepared is None:
+        return {}
+    log_batch(prepared)
+    try:
+        return parse_batch_answers(await achat(**build_batch_request(prepared)), frame_paths)
+    except Exception as e:
+        print(f"[❌] Batched frame analysis failed: {e}")
+        return {}
+
+def build_frame_request(image_path: Path) -> Dict[str, Any]:
+    """Returns the chat completion request for a single frame."""
+    image_b64 = encode_image_to_base64(image_path)
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": ANALYSIS_PROMPT},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
+                ]
+            }
+        ],
+        "max_tokens": MAX_TOKENS,
+    }
+
 def analyze_frame(image_path: Path) -> str:
     """
     Analyzes a single frame using GPT-4o and returns the analysis result.
@@ -46,79 +199,299 @@ def analyze_frame(image_path: Path) -> str:
     Returns:
         str: Analysis result for the image.
     """
-    image_b64 = encode_image_to_base64(image_path)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": ANALYSIS_PROMPT},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
-                    ]
-                }
-            ],
-            max_tokens=50
-        )
+        response = chat(**build_frame_request(image_path))
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"[❌] Error analyzing {image_path.name}: {e}")
         return "Error"
 
-def analyze_all_frames(state: Dict[str, Any]) -> Dict[str, Any]:
+async def aanalyze_frame(image_path: Path) -> str:
+    """Async variant of analyze_frame."""
+    try:
+        response = await achat(**build_frame_request(image_path))
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"[❌] Error analyzing {image_path.name}: {e}")
+        return "Error"
+
+def frame_cache_key(frame: Dict[str, Any]) -> str:
+    return cache_key("analyze_frame", MODEL, ANALYSIS_PROMPT, {"max_tokens": MAX_TOKENS}, [frame["sha256"]])
+
+def store_frame_answer(key: str, result: str) -> str:
+    """Caches a single-frame answer unless it failed ("Error")."""
+    if result != "Error":
+        get_result_cache().put(key, "analyze_frame", result)
+    return result
+
+def analyze_frame_cached(frame: Dict[str, Any]) -> str:
     """
-    LangGraph-compatible node to analyze all frames in extracted_frames/
-    and skip videos that already have frame analysis.
+    Analyzes a frame handle, reusing the cached result for identical image bytes.
+    Failed analyses ("Error") are not cached.
     """
-    frame_analysis_results = []
+    key = frame_cache_key(frame)
+    result = get_result_cache().get(key, "analyze_frame")
+    if result is None:
+        result = store_frame_answer(key, analyze_frame(Path(frame["path"])))
+    return result
 
-    downloaded_videos = state.get("downloaded_videos", [])
-    if not downloaded_videos:
-        print("[⚠️] No video files found in state. Skipping frame analysis.")
-        state["frame_analysis"] = []
-        return state
+async def aanalyze_frame_cached(frame: Dict[str, Any]) -> str:
+    """Async variant of analyze_frame_cached."""
+    key = frame_cache_key(frame)
+    result = get_result_cache().get(key, "analyze_frame")
+    if result is None:
+        result = store_frame_answer(key, await aanalyze_frame(Path(frame["path"])))
+    return result
 
-    video_folders = [Path(v).stem for v in downloaded_videos]
+def lookup_batch_answers(frames: list) -> tuple:
+    """
+    Returns (answers, keys, pending): cached answers by frame name, the batch
+    cache key of every frame, and the frames still to be sent.
+    """
+    cache = get_result_cache()
+    answers = {}
+    keys = {}
 
-    for folder_name in video_folders:
-        video_folder_path = FRAMES_DIR / folder_name
-        output_path = ANALYSIS_DIR / f"{folder_name}_analysis.json"
+    for frame in frames:
+        name = Path(frame["path"]).name
+        keys[name] = cache_key("analyze_frame_batch", MODEL, BATCH_ANALYSIS_PROMPT, {"detail": FRAME_DETAIL}, [frame["sha256"]])
+        cached = cache.get(keys[name], "analyze_frame")
+        if cached is not None:
+            answers[name] = cached
 
-        # ✅ Skip if analysis file already exists
-        if output_path.exists():
-            print(f"[⏩] Skipping {folder_name} — already analyzed.")
-            with open(output_path, "r", encoding="utf-8") as f:
-                existing_analysis = json.load(f)
-            frame_analysis_results.append({
-                "video": folder_name,
-                "analysis": existing_analysis
-            })
-            continue
+    pending = [frame for frame in frames if Path(frame["path"]).name not in answers]
+    return answers, keys, pending
 
-        if not video_folder_path.exists():
-            print(f"[⚠️] Folder not found for {folder_name}: {video_folder_path}")
+def store_batch_answers(answers: Dict[str, str], keys: Dict[str, str], batch_answers: Dict[str, str]) -> list:
+    """Merges and caches batched answers; returns the names the batch missed."""
+    cache = get_result_cache()
+    missed = []
+    for name, key in keys.items():
+        if name in answers:
             continue
+        if name in batch_answers:
+            answers[name] = batch_answers[name]
+            cache.put(key, "analyze_frame", answers[name])
+        else:
+            missed.append(name)
+    return missed
+
+def analyze_video_frames(frames: list) -> Dict[str, str]:
+    """
+    Analyzes the frame handles of one video in batch mode.
+
+    Frames already answered for the same image bytes come from the cache; the
+    rest go out in one request. Frames the batched answer misses fall back to
+    one request each.
+
+    Returns:
+        dict: frame file name -> answer, in frame order.
+    """
+    answers, keys, pending = lookup_batch_answers(frames)
+    if pending:
+        batch_answers = analyze_frames_batch([Path(frame["path"]) for frame in pending])
+        missed = store_batch_answers(answers, keys, batch_answers)
+        for frame in pending:
+            if Path(frame["path"]).name in missed:
+                answers[Path(frame["path"]).name] = analyze_frame_cached(frame)
+
+    return {Path(frame["path"]).name: answers[Path(frame["path"]).name] for frame in frames}
+
+async def aanalyze_video_frames(frames: list) -> Dict[str, str]:
+    """Async variant of analyze_video_frames; fallback single-frame requests run concurrently."""
+    answers, keys, pending = lookup_batch_answers(frames)
+    if pending:
+        batch_answers = await aanalyze_frames_batch([Path(frame["path"]) for frame in pending])
+        missed = store_batch_answers(answers, keys, batch_answers)
+        fallback = [frame for frame in pending if Path(frame["path"]).name in missed]
+        results = await asyncio.gather(*(aanalyze_frame_cached(frame) for frame in fallback))
+        for frame, result in zip(fallback, results):
+            answers[Path(frame["path"]).name] = result
+
+    return {Path(frame["path"]).name: answers[Path(frame["path"]).name] for frame in frames}
+
+def analyze_single_frames_in_batch(frames: list) -> Dict[str, str]:
+    """
+    Analyzes frame handles one request per frame through a Batch API job,
+    reusing cached answers. Returns frame path -> answer.
+    """
+    cache = get_result_cache()
+    answers = {}
+    keys = {}
+    requests = {}
+
+    for frame in frames:
+        keys[frame["path"]] = key = frame_cache_key(frame)
+        cached = cache.get(key, "analyze_frame")
+        if cached is not None:
+            answers[frame["path"]] = cached
+        elif key not in requests:
+            requests[key] = build_frame_request(Path(frame["path"]))
+
+    responses = run_chat_batch("analyze_frame", requests)
+    for frame in frames:
+        if frame["path"] not in answers:
+            response = responses.get(keys[frame["path"]])
+            result = response.choices[0].message.content.strip() if response else "Error"
+            answers[frame["path"]] = store_frame_answer(keys[frame["path"]], result)
+    return answers
+
+def analyze_frames_in_batch(extracted_frames: list) -> list[Dict[str, str]]:
+    """
+    Analyzes the frames of every video through the Batch API: one multi-image
+    request per video in "batch" mode, then one request per frame for the
+    frames those answers missed (or for all frames in "single" mode).
+
+    Returns:
+        list[dict]: frame file name -> answer, one dict per video.
+    """
+    lookups = []
+    fallback = []
 
-        print(f"[🎞️] Analyzing frames for: {folder_name}")
-        analysis = {}
+    if FRAME_ANALYSIS_MODE == "batch":
+        lookups = [lookup_batch_answers(item.get("frames", [])) for item in extracted_frames]
+        requests = {}
+        for item, (_, _, pending) in zip(extracted_frames, lookups):
+            prepared = prepare_batch([Path(frame["path"]) for frame in pending]) if pending else None
+            if prepared:
+                requests[item["id"]] = build_batch_request(prepared)
 
-        for frame_path in sorted(video_folder_path.glob("*.jpg")):
-            print(f"[🧠] Analyzing: {frame_path.name}")
-            result = analyze_frame(frame_path)
-            analysis[frame_path.name] = result
+        responses = run_chat_batch("analyze_frames", requests)
+        for item, (answers, keys, pending) in zip(extracted_frames, lookups):
+            if not pending:
+                continue
+            batch_answers = {}
+            if responses.get(item["id"]):
+                try:
+                    batch_answers = parse_batch_answers(responses[item["id"]], [Path(frame["path"]) for frame in pending])
+                except Exception as e:
+                    print(f"[❌] Batched frame analysis failed for {item['id']}: {e}")
+            missed = store_batch_answers(answers, keys, batch_answers)
+            fallback.extend(frame for frame in pending if Path(frame["path"]).name in missed)
+    else:
+        lookups = [({}, {}, []) for _ in extracted_frames]
+        fallback = [frame for item in extracted_frames for frame in item.get("frames", [])]
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(analysis, f, indent=2, ensure_ascii=False)
+    single_answers = analyze_single_frames_in_batch(fallback) if fallback else {}
 
-        print(f"[✅] Saved: {output_path.name}")
-        frame_analysis_results.append({
-            "video": folder_name,
-            "analysis": analysis
+    analyses = []
+    for item, (answers, _, _) in zip(extracted_frames, lookups):
+        frames = item.get("frames", [])
+        analyses.append({
+            Path(frame["path"]).name: answers.get(Path(frame["path"]).name) or single_answers[frame["path"]]
+            for frame in frames
         })
+    return analyses
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the frames that determines a video's frame analysis."""
+    return {
+        "model": MODEL,
+        "mode": FRAME_ANALYSIS_MODE,
+        "detail": FRAME_DETAIL,
+        "high_detail_edge_density": HIGH_DETAIL_EDGE_DENSITY,
+        "prompt": BATCH_ANALYSIS_PROMPT if FRAME_ANALYSIS_MODE == "batch" else ANALYSIS_PROMPT,
+        "max_tokens": MAX_TOKENS,
+    }
+
+def prepare_frame_jobs(extracted_frames: list) -> tuple:
+    """
+    Returns (handles of up-to-date analyses, videos to analyze), each video
+    carrying the fingerprint its analysis will be recorded under and the
+    analysis of an earlier copy of its creative under "reused", if any.
+    """
+    jobs = []
+    for item in extracted_frames:
+        fingerprint, fresh = check_stage(item["id"], "analyze_frames", stage_params(), item.get("frames", []))
+        if fresh:
+            print(f"[⏩] Up to date: {item['id']} frame analysis")
+        jobs.append({**item, "fingerprint": fingerprint, "fresh": fresh, "reused": None if fresh else reuse_result(item["id"], "analyze_frames")})
+    return split_fresh(jobs)
+
+def save_frame_analysis(job: Dict[str, Any], analysis: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    Stores the frame analysis of a video, records it for the video and returns
+    its handle. An analysis with failed frames ("Error") is neither stored nor
+    recorded, so the next run retries it; returns None then.
+    """
+    failed = [name for name, answer in analysis.items() if answer == "Error"]
+    if failed:
+        print(f"[⚠️] {job['id']}: {len(failed)} of {len(analysis)} frames failed; frame analysis not saved.")
+        return None
+    handle, written = get_result_store().put(job["id"], "analyze_frames", analysis)
+    if written:
+        print(f"[✅] Saved frame analysis: {job['id']}")
+    get_dependency_tracker().record(job["id"], "analyze_frames", job["fingerprint"], [handle])
+    get_storage_manager().touch("frames", job["id"])
+    return handle
+
+def frame_analysis_update(fresh: list, jobs: list, handles: list) -> Dict[str, Any]:
+    """State update with the up-to-date and saved handles; videos whose analysis failed go under "errors"."""
+    update = {"frame_analysis": fresh + [handle for handle in handles if handle is not None]}
+    failed = [job["id"] for job, handle in zip(jobs, handles) if handle is None]
+    if failed:
+        update["errors"] = [f"{video}: frame analysis failed; it is retried on the next run" for video in failed]
+    return update
+
+def analyze_all_frames(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    LangGraph-compatible node to analyze the frames in state["extracted_frames"]
+    and skip videos whose recorded frame analysis is up to date.
+    """
+    extracted_frames = state.get("extracted_frames", [])
+    if not extracted_frames:
+        print("[⚠️] No extracted frames found in state. Skipping frame analysis.")
+        return {"frame_analysis": []}
+
+    frame_analysis_results, jobs = prepare_frame_jobs(extracted_frames)
+
+    if batch_mode():
+        answered = iter(analyze_frames_in_batch([job for job in jobs if not job["reused"]]))
+        analyses = [job["reused"] or next(answered) for job in jobs]
+        with get_result_store().transaction():
+            handles = [save_frame_analysis(job, analysis) for job, analysis in zip(jobs, analyses)]
+        return frame_analysis_update(frame_analysis_results, jobs, handles)
+
+    handles = []
+    for job in jobs:
+        if job["reused"]:
+            handles.append(save_frame_analysis(job, job["reused"]))
+            continue
+        print(f"[🎞️] Analyzing frames for: {job['id']}")
+        frames = job.get("frames", [])
+
+        if FRAME_ANALYSIS_MODE == "batch":
+            analysis = analyze_video_frames(frames)
+        else:
+            analysis = {Path(frame["path"]).name: analyze_frame_cached(frame) for frame in frames}
+
+        handles.append(save_frame_analysis(job, analysis))
+
+    return frame_analysis_update(frame_analysis_results, jobs, handles)
+
+async def aanalyze_all_frames(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of analyze_all_frames; videos are analyzed concurrently."""
+    if batch_mode():
+        return await asyncio.to_thread(analyze_all_frames, state)
 
-    state["frame_analysis"] = frame_analysis_results
-    return state
+    extracted_frames = state.get("extracted_frames", [])
+    if not extracted_frames:
+        print("[⚠️] No extracted frames found in state. Skipping frame analysis.")
+        return {"frame_analysis": []}
 
+    fresh, jobs = prepare_frame_jobs(extracted_frames)
 
+    async def run(job):
+        if job["reused"]:
+            return job["reused"]
+        print(f"[🎞️] Analyzing frames for: {job['id']}")
+        frames = job.get("frames", [])
+        if FRAME_ANALYSIS_MODE == "batch":
+            return await aanalyze_video_frames(frames)
+        results = await asyncio.gather(*(aanalyze_frame_cached(frame) for frame in frames))
+        return {Path(frame["path"]).name: result for frame, result in zip(frames, results)}
 
+    analyses = await asyncio.gather(*(run(job) for job in jobs))
+    with get_result_store().transaction():
+        handles = [save_frame_analysis(job, analysis) for job, analysis in zip(jobs, analyses)]
+    return frame_analysis_update(fresh, jobs, handles)
@@ -1,25 +1,18 @@
-from dotenv import load_dotenv
-from openai import OpenAI
-from pathlib import Path
-import os
-from typing import Dict, Any
-
-# Load API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Resolve project directories
-ROOT_DIR = Path(__file__).resolve().parent.parent
-TRANSCRIPT_DIR = ROOT_DIR / "transcriptions"
-ANALYSIS_DIR = ROOT_DIR / "transcription_analysis"
-ANALYSIS_DIR.mkdir(parents=True, exist_ok=True)
-
-def analyze_transcript_text(text: str) -> str:
-    """
-    Sends transcription text to GPT for structured analysis (e.g. tone, hook, CTA).
-    Returns a clean bullet list string.
-    """
-    prompt = f"""
+import asyncio
+from typing import Dict, Any, Optional
+from utils.cache import cache_key, get_result_cache
+from utils.deps import check_stage, get_dependency_tracker, split_fresh
+from utils.openai_batch import batch_mode, run_chat_batch
+from utils.openai_client import achat, chat
+from utils.results import get_result_store, read_result
+from utils.tokens import TRANSCRIPT_TOKEN_BUDGET, fit_to_budget
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0.5
+
+# Prompt template. The system prompt and the instructions are the same for
+# every call and the transcript comes last, so providers can cache the prefix.
+TRANSCRIPT_ANALYSIS_PROMPT = """
 Aap aik marketing strategist hain jo aik ad ki Urdu transcript ka jaiza le rahe hain. Aapko yeh batana hai ke is ad mein kon kon se selling techniques use hui hain. Jaise ke:
 
 - Emotional kahani sunana
@@ -35,65 +28,135 @@ Transcript:
 {text}
 """
 
-    system_prompt = "You are a helpful assistant that gives only keywords as a return, in English, with one point per line using dashes. Do not include markdown or JSON."
+SYSTEM_PROMPT = "You are a helpful assistant that gives only keywords as a return, in English, with one point per line using dashes. Do not include markdown or JSON."
 
+def build_transcript_request(text: str) -> Dict[str, Any]:
+    """Returns the chat completion request for one transcript."""
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": TRANSCRIPT_ANALYSIS_PROMPT.format(text=text)}
+        ],
+        "temperature": TEMPERATURE,
+    }
+
+def analyze_transcript_text(text: str) -> str:
+    """
+    Sends transcription text to GPT for structured analysis (e.g. tone, hook, CTA).
+    Returns a clean bullet list string.
+    """
+    try:
+        response = chat(**build_transcript_request(text))
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"❌ Error analyzing transcription: {e}")
+        return None
+
+async def aanalyze_transcript_text(text: str) -> str:
+    """Async variant of analyze_transcript_text."""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5
-        )
+        response = await achat(**build_transcript_request(text))
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"❌ Error analyzing transcription: {e}")
         return None
 
+def analyze_transcripts_in_batch(jobs: list) -> list[Optional[str]]:
+    """Sends the cache misses among `jobs` as one Batch API job; returns one analysis per job."""
+    requests = {job["key"]: build_transcript_request(job["text"]) for job in jobs if not job["analysis"]}
+    responses = run_chat_batch("analyze_transcription", requests)
+
+    analyses = []
+    for job in jobs:
+        response = responses.get(job["key"])
+        analyses.append(job["analysis"] or (response.choices[0].message.content.strip() if response else None))
+    return analyses
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the transcript that determines its analysis."""
+    return {"model": MODEL, "prompt": SYSTEM_PROMPT + TRANSCRIPT_ANALYSIS_PROMPT, "temperature": TEMPERATURE,
+            "transcript_budget": TRANSCRIPT_TOKEN_BUDGET}
+
+def prepare_transcription(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Checks whether the recorded analysis of a transcript is up to date, and
+    otherwise reads the transcript and looks it up in the result cache.
+    Returns None for unusable items.
+    """
+    video_name = item.get("id")
+    fingerprint, fresh = check_stage(video_name, "analyze_transcription", stage_params(), [item])
+    if fresh:
+        print(f"[⏩] Up to date: {video_name} transcript analysis")
+        return {"id": video_name, "fresh": fresh}
+
+    text = (read_result(item) or "").strip() if video_name else ""
+
+    if not video_name or not text:
+        print(f"[⚠️] Missing data in item: {item}")
+        return None
+
+    # The cache key covers the text actually sent, so a larger budget only misses for long transcripts
+    text = fit_to_budget(text, TRANSCRIPT_TOKEN_BUDGET, MODEL, "transcript")
+    key = cache_key("analyze_transcription", MODEL, SYSTEM_PROMPT + TRANSCRIPT_ANALYSIS_PROMPT, {"temperature": TEMPERATURE}, [text])
+    cached = get_result_cache().get(key, "analyze_transcription")
+    if cached:
+        print(f"[⏩] Skipping {video_name} (already analyzed)")
+    else:
+        print(f"[🧠] Analyzing transcription: {video_name}")
+    return {"id": video_name, "fingerprint": fingerprint, "text": text, "key": key, "analysis": cached}
+
+def finish_transcription(job: Dict[str, Any], analysis_text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Caches and stores one analysis; returns its handle."""
+    if not analysis_text:
+        return None
+    if not job["analysis"]:
+        get_result_cache().put(job["key"], "analyze_transcription", analysis_text)
+
+    handle, written = get_result_store().put(job["id"], "analyze_transcription", analysis_text)
+    if written:
+        print(f"[✅] Saved analysis: {job['id']}")
+    get_dependency_tracker().record(job["id"], "analyze_transcription", job["fingerprint"], [handle])
+    return handle
+
 def analyze_all_transcriptions(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     LangGraph-compatible node that analyzes each transcription in state["transcriptions"]
-    and saves analysis as plain .txt file (one per transcription).
+    and stores the analyses in the result store (one per transcription).
     """
-    results = []
     transcriptions = state.get("transcriptions", [])
 
     if not transcriptions:
         print("[⚠️] No transcriptions found in state. Skipping analysis.")
-        state["transcription_analysis"] = []
-        return state
-
-    for item in transcriptions:
-        filename = item.get("file")
-        text = item.get("text")
-
-        if not filename or not text:
-            print(f"[⚠️] Missing data in item: {item}")
-            continue
-
-        analysis_path = ANALYSIS_DIR / f"{Path(filename).stem}_analysis.txt"
-        if analysis_path.exists():
-            print(f"[⏩] Skipping {filename} (already analyzed)")
-            with open(analysis_path, "r", encoding="utf-8") as f:
-                analysis = f.read()
-            results.append({
-                "file": filename,
-                "analysis": analysis
-            })
-            continue
-
-        print(f"[🧠] Analyzing transcription: {filename}")
-        analysis_text = analyze_transcript_text(text)
-
-        if analysis_text:
-            with open(analysis_path, "w", encoding="utf-8") as f:
-                f.write(analysis_text)
-            print(f"[✅] Saved analysis: {analysis_path}")
-            results.append({
-                "file": filename,
-                "analysis": analysis_text
-            })
-
-    state["transcription_analysis"] = results
-    return state
+        return {"transcription_analysis": []}
+
+    fresh, jobs = split_fresh([job for job in map(prepare_transcription, transcriptions) if job])
+    if batch_mode():
+        analyses = analyze_transcripts_in_batch(jobs)
+    else:
+        analyses = [job["analysis"] or analyze_transcript_text(job["text"]) for job in jobs]
+
+    with get_result_store().transaction():
+        handles = [finish_transcription(job, text) for job, text in zip(jobs, analyses)]
+    return {"transcription_analysis": fresh + [h for h in handles if h]}
+
+async def aanalyze_all_transcriptions(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of analyze_all_transcriptions; cache misses are sent concurrently."""
+    if batch_mode():
+        return await asyncio.to_thread(analyze_all_transcriptions, state)
+
+    transcriptions = state.get("transcriptions", [])
+
+    if not transcriptions:
+        print("[⚠️] No transcriptions found in state. Skipping analysis.")
+        return {"transcription_analysis": []}
+
+    fresh, jobs = split_fresh([job for job in map(prepare_transcription, transcriptions) if job])
+
+    async def run(job):
+        return job["analysis"] or await aanalyze_transcript_text(job["text"])
+
+    analyses = await asyncio.gather(*(run(job) for job in jobs))
+    with get_result_store().transaction():
+        handles = [finish_transcription(job, text) for job, text in zip(jobs, analyses)]
+    return {"transcription_analysis": fresh + [h for h in handles if h]}
@@ -1,64 +1,99 @@
-import os
-import requests
 from pathlib import Path
 from typing import Dict, Any
+from nodes.get_video_urls import resolve_video_sources
+from utils.artifacts import make_artifact
+from utils.creatives import CREATIVE_DEDUP, get_creative_index
+from utils.deps import check_stage, get_dependency_tracker
+from utils.downloader import get_download_manager, DownloadError
+from utils.settings import DATA_DIR
+from utils.storage import get_storage_manager
 
-# Temp directory to store downloaded videos
-TMP_DIR = Path("tmp_videos")
+# Temp directory to store downloaded videos (shared with extract_frames.py)
+TMP_DIR = DATA_DIR / "tmp_videos"
 TMP_DIR.mkdir(exist_ok=True)
 
-def is_valid_mp4(file_path: Path) -> bool:
-    """Check if the file exists and is a non-zero MP4 file."""
-    return file_path.exists() and file_path.stat().st_size > 0 and file_path.suffix == ".mp4"
-
 def download_videos(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Downloads Facebook ad videos only if not already cached.
-    
+    Downloads Facebook ad videos concurrently, skipping videos whose recorded
+    download is unchanged on disk or that already have a verified local copy.
+    Interrupted downloads resume from their .part file. The videos are pinned
+    against eviction for the rest of the run and filed in the creative index.
+
     Args:
         state (dict): LangGraph state, must include 'video_urls'.
 
     Returns:
-        dict: Updated state with 'video_paths'.
+        dict: State update with artifact handles under 'downloaded_videos'.
     """
     video_list = state.get("video_urls", [])
-    saved_paths = []
 
     if not video_list:
         print("[⚠️] No video URLs in state. Skipping download.")
-        state["video_paths"] = []
-        return state
+        return {"downloaded_videos": []}
 
+    jobs = {}
+    fingerprints = {}
+    saved_videos = []
+    storage = get_storage_manager()
+    storage.pin([f"video_{video['video_id']}" for video in video_list if video.get("video_id")])
     for video in video_list:
         video_id = video.get("video_id")
         source_url = video.get("source")
 
-        if not video_id or not source_url:
-            print(f"[SKIP] Missing data: video_id={video_id}, source_url={source_url}")
+        if not video_id or video_id in jobs or video_id in fingerprints:
             continue
 
-        filename = TMP_DIR / f"video_{video_id}.mp4"
+        # An evicted video that a stage needs again is downloaded again; local
+        # entries were not resolved, so its source is looked up here
+        if storage.restore_if_needed(f"video_{video_id}") and not source_url:
+            source_url = resolve_video_sources([video_id]).get(video_id, {}).get("source")
 
-        # --- Skip if already downloaded ---
-        if is_valid_mp4(filename):
-            print(f"[✅] Cached: {filename}")
-            saved_paths.append(str(filename))
+        # Facebook video IDs do not change content, so an unchanged local copy
+        # (or an evicted one nothing needs again) is up to date
+        fingerprint, fresh = check_stage(f"video_{video_id}", "download", {}, [])
+        fingerprints[video_id] = fingerprint
+        if fresh:
+            print(f"[⏩] Up to date: video_{video_id}.mp4")
+            saved_videos.extend(fresh)
             continue
 
-        # --- Download if not cached ---
-        try:
-            response = requests.get(source_url, stream=True, timeout=20)
-            response.raise_for_status()
+        if not source_url:
+            print(f"[SKIP] Missing data: video_id={video_id}, source_url={source_url}")
+            continue
+
+        # Several ads can share the same creative video
+        jobs.setdefault(video_id, (source_url, TMP_DIR / f"video_{video_id}.mp4"))
+
+    errors = []
+    results = get_download_manager().fetch_all(list(jobs.values()))
+    tracker = get_dependency_tracker()
+
+    for video_id, result in zip(jobs, results):
+        if isinstance(result, DownloadError):
+            print(f"[❌] Failed to download video_id={video_id}: {result}")
+            errors.append(str(result))
+            continue
 
-            with open(filename, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        filename = Path(result["path"])
+        print(f"[✅] Cached: {filename}" if result["cached"] else f"[💾] Downloaded: {filename}")
+        handle = make_artifact(filename, sha256=result["sha256"])
+        tracker.record(handle["id"], "download", fingerprints[video_id], [handle])
+        storage.touch("videos", handle["id"])
+        saved_videos.append(handle)
 
-            print(f"[💾] Downloaded: {filename}")
-            saved_paths.append(str(filename))
+    # Fingerprint new videos (and ones from before the index) so re-uploads
+    # of a known creative reuse its transcript and frame analysis
+    if CREATIVE_DEDUP:
+        index = get_creative_index()
+        for handle in saved_videos:
+            if Path(handle["path"]).exists():
+                canonical = index.add(handle["id"], Path(handle["path"]), handle["sha256"])
+                if canonical and canonical != handle["id"]:
+                    print(f"[🧬] {handle['id']} is a copy of creative {canonical}")
 
-        except requests.exceptions.RequestException as e:
-            print(f"[❌] Failed to download video_id={video_id}: {e}")
+    storage.enforce()
 
-    state["downloaded_videos"] = saved_paths
-    return state
+    update = {"downloaded_videos": saved_videos}
+    if errors:
+        update["errors"] = errors
+    return update
@@ -1,85 +1,229 @@
 import cv2
-import base64
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from utils.artifacts import make_artifact
+from utils.deps import check_stage, get_dependency_tracker
+from utils.keyframes import select_keyframes
+from utils.settings import DATA_DIR
+from utils.storage import get_storage_manager
+from utils.tracing import map_in_context
 
 # Define paths
-ROOT_DIR = Path(__file__).resolve().parent.parent
-VIDEO_DIR = ROOT_DIR / "tmp_videos"
-FRAMES_DIR = ROOT_DIR / "extracted_frames"
+VIDEO_DIR = DATA_DIR / "tmp_videos"
+FRAMES_DIR = DATA_DIR / "extracted_frames"
 FRAMES_DIR.mkdir(parents=True, exist_ok=True)
 
-def convert_frame_to_base64(frame):
-    """Converts an OpenCV frame to Base64-encoded string."""
-    ret, buffer = cv2.imencode('.jpg', frame)
-    if not ret:
-        return None
-    return base64.b64encode(buffer).decode('utf-8')
-
-def extract_evenly_distributed_frames_from_video(video_path: Path, max_frames: int = 5) -> list[str]:
+# Longest side of saved frames in pixels (0 keeps the source resolution)
+FRAME_MAX_SIDE = int(os.getenv("FRAME_MAX_SIDE", "0"))
+JPEG_QUALITY = int(os.getenv("FRAME_JPEG_QUALITY", "95"))
+
+# Decode forward with grab() while the next sampled frame is at most this many
+# frames away; seek for larger gaps (a seek decodes from the previous keyframe)
+SEEK_THRESHOLD = int(os.getenv("FRAME_SEEK_THRESHOLD", "120"))
+
+# Frame selection: "keyframes" samples FRAME_CANDIDATES frames and keeps up to
+# FRAME_BUDGET distinct shots; "even" keeps FRAME_BUDGET evenly spaced frames
+FRAME_SELECTION = os.getenv("FRAME_SELECTION", "keyframes")
+FRAME_BUDGET = int(os.getenv("FRAME_BUDGET", "5"))
+FRAME_CANDIDATES = int(os.getenv("FRAME_CANDIDATES", "20"))
+
+# Two frames count as different shots if their dHashes differ by at least this
+# many of 64 bits or their HSV histograms by at least this total variation
+# distance (0-1); dHash alone cannot tell shots apart that differ in colour
+FRAME_SIMILARITY_THRESHOLD = int(os.getenv("FRAME_SIMILARITY_THRESHOLD", "10"))
+FRAME_COLOR_THRESHOLD = float(os.getenv("FRAME_COLOR_THRESHOLD", "0.3"))
+
+# Worker threads used when several videos are extracted in one call (batch
+# mode; per-video runs already extract their videos concurrently). OpenCV
+# releases the GIL while it decodes, resizes and encodes, and threads are
+# safe to start from the graph's worker threads, where forking is not.
+EXTRACT_WORKERS = int(os.getenv("FRAME_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+def resize_frame(frame, max_side: int):
+    """Downscales a frame so its longest side is at most `max_side` pixels."""
+    height, width = frame.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return frame
+    scale = max_side / max(height, width)
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+def read_frames_at(capture, indices: list):
     """
-    Extracts up to `max_frames` evenly distributed frames from a video.
-    Returns a list of Base64-encoded JPEG images.
+    Yields (index, frame) for the sorted frame `indices` in one forward pass.
+
+    Frames between targets are skipped with grab(), which demuxes and decodes
+    without the color conversion of retrieve(). Gaps larger than SEEK_THRESHOLD
+    are crossed with a seek instead.
     """
-    capture = cv2.VideoCapture(str(video_path))
-    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    position = 0
+    for index in indices:
+        if index - position > SEEK_THRESHOLD:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
 
-    if total_frames == 0:
-        print(f"[⚠️] No frames in video: {video_path.name}")
-        return []
+        while position < index:
+            if not capture.grab():
+                return
+            position += 1
 
-    step = max(1, total_frames // max_frames)
-    base64_frames = []
+        ret, frame = capture.read()
+        position += 1
+        if ret:
+            yield index, frame
 
-    output_dir = FRAMES_DIR / video_path.stem
+def save_frames(frames: list, output_dir: Path) -> list[Path]:
+    """JPEG-encodes each frame once and writes frame_1.jpg, frame_2.jpg, ..."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    frame_paths = []
+    for frame in frames:
+        ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ret:
+            continue
+        frame_path = output_dir / f"frame_{len(frame_paths) + 1}.jpg"
+        frame_path.write_bytes(buffer.tobytes())
+        frame_paths.append(frame_path)
+    return frame_paths
+
+def evenly_spaced_indices(total_frames: int, count: int) -> list[int]:
+    step = max(1, total_frames // count)
+    return list(range(0, total_frames, step))[:count]
+
+def extract_evenly_distributed_frames_from_video(
+    video_path: Path,
+    max_frames: int = FRAME_BUDGET,
+    max_side: int = FRAME_MAX_SIDE,
+    frames_dir: Optional[Path] = None,
+) -> list[Path]:
+    """
+    Extracts up to `max_frames` evenly distributed frames from a video into
+    `frames_dir`/<video> (FRAMES_DIR by default).
+    Returns the paths of the saved JPEG frames.
+    """
+    output_dir = (frames_dir or FRAMES_DIR) / video_path.stem
 
     if output_dir.exists() and any(output_dir.glob("*.jpg")):
         print(f"[✔️] Frames already extracted for {video_path.name}, skipping.")
-        return []
-
-    output_dir.mkdir(parents=True, exist_ok=True)
+        return sorted(output_dir.glob("*.jpg"))
 
-    for i in range(0, total_frames, step):
-        capture.set(cv2.CAP_PROP_POS_FRAMES, i)
-        ret, frame = capture.read()
-
-        if ret:
-            frame_path = output_dir / f"frame_{len(base64_frames) + 1}.jpg"
-            cv2.imwrite(str(frame_path), frame)
-
-            frame_b64 = convert_frame_to_base64(frame)
-            base64_frames.append(frame_b64)
-
-        if len(base64_frames) >= max_frames:
-            break
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        if total_frames <= 0:
+            print(f"[⚠️] No frames in video: {video_path.name}")
+            return []
+
+        indices = evenly_spaced_indices(total_frames, max_frames)
+        frames = [resize_frame(frame, max_side) for _, frame in read_frames_at(capture, indices)]
+        return save_frames(frames, output_dir)
+    finally:
+        capture.release()
+
+def extract_keyframes_from_video(
+    video_path: Path,
+    budget: int = FRAME_BUDGET,
+    candidates: int = FRAME_CANDIDATES,
+    min_distance: int = FRAME_SIMILARITY_THRESHOLD,
+    min_color_distance: float = FRAME_COLOR_THRESHOLD,
+    max_side: int = FRAME_MAX_SIDE,
+    frames_dir: Optional[Path] = None,
+) -> list[Path]:
+    """
+    Samples `candidates` evenly spaced frames and saves up to `budget` of them,
+    preferring scene changes and dropping near-duplicates (see utils.keyframes).
+    Static videos end up with fewer frames, and so fewer vision calls.
+    Frames go to `frames_dir`/<video> (FRAMES_DIR by default).
+    Returns the paths of the saved JPEG frames.
+    """
+    output_dir = (frames_dir or FRAMES_DIR) / video_path.stem
 
-    capture.release()
-    return base64_frames
+    if output_dir.exists() and any(output_dir.glob("*.jpg")):
+        print(f"[✔️] Frames already extracted for {video_path.name}, skipping.")
+        return sorted(output_dir.glob("*.jpg"))
 
-def extract_all_videos_as_base64_frames(state: Dict[str, Any]) -> Dict[str, Any]:
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        if total_frames <= 0:
+            print(f"[⚠️] No frames in video: {video_path.name}")
+            return []
+
+        indices = evenly_spaced_indices(total_frames, max(candidates, budget))
+        frames = [resize_frame(frame, max_side) for _, frame in read_frames_at(capture, indices)]
+    finally:
+        capture.release()
+
+    selected = select_keyframes(frames, budget, min_distance, min_color_distance)
+    print(f"[🎯] {video_path.name}: kept {len(selected)} of {len(frames)} candidate frames.")
+    return save_frames([frames[i] for i in selected], output_dir)
+
+def extract_frames_from_video(video_path: Path) -> list[Path]:
+    """Extracts frames with the configured FRAME_SELECTION strategy."""
+    if FRAME_SELECTION == "even":
+        return extract_evenly_distributed_frames_from_video(video_path)
+    return extract_keyframes_from_video(video_path)
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the video that determines the extracted frames."""
+    return {
+        "selection": FRAME_SELECTION,
+        "budget": FRAME_BUDGET,
+        "candidates": FRAME_CANDIDATES,
+        "similarity_threshold": FRAME_SIMILARITY_THRESHOLD,
+        "color_threshold": FRAME_COLOR_THRESHOLD,
+        "max_side": FRAME_MAX_SIDE,
+        "jpeg_quality": JPEG_QUALITY,
+    }
+
+def extract_all_video_frames(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    LangGraph-compatible node to extract frames from all videos in tmp_videos directory
-    and return the frames as Base64-encoded strings.
+    LangGraph-compatible node to extract frames from all downloaded videos.
+    Videos whose recorded frames are up to date are skipped; stale frames are
+    removed and extracted again. Several videos are extracted on parallel
+    worker threads.
+    Returns handles to the saved JPEGs (not the image bytes) under "extracted_frames".
     """
     results = []
-    video_paths = state.get("downloaded_videos", [])
+    videos = state.get("downloaded_videos", [])
 
-    if not video_paths:
+    if not videos:
         print("[⚠️] No video paths found in state. Skipping frame extraction.")
-        state["extracted_frames"] = []
-        return state
-
-    for video_file in video_paths:
-        video_file = Path(video_file)
-
+        return {"extracted_frames": []}
+
+    fingerprints = {}
+    video_files = []
+    for video in videos:
+        video_file = Path(video["path"])
+        fingerprints[video_file.stem], fresh = check_stage(video_file.stem, "extract_frames", stage_params(), [video])
+        if fresh:
+            print(f"[⏩] Up to date: {video_file.stem} frames")
+            results.append({"id": video_file.stem, "frames": fresh})
+            continue
+
+        shutil.rmtree(FRAMES_DIR / video_file.stem, ignore_errors=True)
         print(f"[📽️] Extracting frames from {video_file.name}")
-        frames_b64 = extract_evenly_distributed_frames_from_video(video_file)
-
-        if frames_b64:
-            results.append({
-                "video": video_file.name,
-                "frames": frames_b64
-            })
-
-    state["extracted_frames"] = results
-    return state
+        video_files.append(video_file)
+
+    if len(video_files) > 1 and EXTRACT_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=min(EXTRACT_WORKERS, len(video_files))) as pool:
+            all_frame_paths = map_in_context(pool, extract_frames_from_video, video_files)
+    else:
+        all_frame_paths = [extract_frames_from_video(f) for f in video_files]
+
+    tracker = get_dependency_tracker()
+    storage = get_storage_manager()
+    for video_file, frame_paths in zip(video_files, all_frame_paths):
+        if frame_paths:
+            frames = [make_artifact(p, artifact_id=f"{video_file.stem}/{p.name}") for p in frame_paths]
+            tracker.record(video_file.stem, "extract_frames", fingerprints[video_file.stem], frames)
+            storage.touch("frames", video_file.stem)
+            storage.touch("videos", video_file.stem)
+            storage.release_source(video_file.stem)
+            results.append({"id": video_file.stem, "frames": frames})
+
+    storage.enforce()
+    return {"extracted_frames": results}
@@ -1,65 +1,281 @@
 import os
-from dotenv import load_dotenv
-import requests
+import hashlib
 import json
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+import requests
+from nodes.get_video_urls import get_ad_video_id
+from utils.graph_api import graph_paginate
+from utils.settings import DATA_DIR, load_settings
 
-load_dotenv()
+load_settings()
 
-ACCESS_TOKEN = os.getenv("FB_ACCESS_TOKEN")
 AD_ACCOUNT_ID = os.getenv("FB_AD_ACCOUNT_ID")
 
+# Page size for the /ads edge and whether to ignore the stored high-water mark
+PAGE_LIMIT = int(os.getenv("FB_ADS_PAGE_LIMIT", "100"))
+FULL_SYNC = os.getenv("FB_ADS_FULL_SYNC", "0") == "1"
+
+# Re-fetch a small window before the high-water mark so edits made in the same
+# second as the last sync are not missed (unchanged ads are not rewritten)
+HWM_OVERLAP_SECONDS = 60
+
+# Local ad store: one JSON file per ad plus the sync high-water marks
+ADS_STORE_DIR = DATA_DIR / "ads_store"
+ADS_STORE_DIR.mkdir(parents=True, exist_ok=True)
+SYNC_STATE_PATH = ADS_STORE_DIR / "_sync_state.json"
+
+AD_FIELDS = [
+    "id",
+    "name",
+    "ad_active_time",
+    "adlabels",
+    "campaign{id,name}",
+    "adset{id,name,targeting}",
+    "creative{id,video_id,effective_object_story_id,object_story_spec}",
+    "status",
+    "effective_status",
+    "created_time",
+    "updated_time"
+]
+
+def parse_graph_time(value: str) -> int:
+    """Converts a Graph API timestamp (e.g. 2024-05-01T10:00:00+0000) to a unix timestamp."""
+    return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp())
+
+# ---- Filters ----
+# A run can be narrowed to some campaigns, ad sets or ads, to ads that are
+# running, to a creation window and to at most `max_ads` ads:
+#   {"campaign_ids": [...], "adset_ids": [...], "ad_ids": [...], "active_only": True,
+#    "created_since": <unix ts>, "created_before": <unix ts>, "max_ads": 20}
+# Everything but max_ads is pushed down into the /ads `filtering` parameter,
+# so ads outside the filters are never fetched, downloaded or analyzed.
+
+def build_filtering(filters: Dict[str, Any], since: Optional[int] = None) -> list:
+    """Returns the Graph API `filtering` conditions for `filters` and the updated_time high-water mark."""
+    conditions = []
+    if since is not None:
+        conditions.append({"field": "updated_time", "operator": "GREATER_THAN", "value": since})
+    for key, field in (("campaign_ids", "campaign.id"), ("adset_ids", "adset.id"), ("ad_ids", "id")):
+        if filters.get(key):
+            conditions.append({"field": field, "operator": "IN", "value": list(filters[key])})
+    if filters.get("active_only"):
+        conditions.append({"field": "effective_status", "operator": "IN", "value": ["ACTIVE"]})
+    if filters.get("created_since") is not None:
+        conditions.append({"field": "created_time", "operator": "GREATER_THAN", "value": filters["created_since"] - 1})
+    if filters.get("created_before") is not None:
+        conditions.append({"field": "created_time", "operator": "LESS_THAN", "value": filters["created_before"]})
+    return conditions
+
+def matches_filters(ad: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Applies `filters` (except max_ads) to a stored ad, the same way the Graph API does."""
+    if filters.get("campaign_ids") and ad.get("campaign", {}).get("id") not in filters["campaign_ids"]:
+        return False
+    if filters.get("adset_ids") and ad.get("adset", {}).get("id") not in filters["adset_ids"]:
+        return False
+    if filters.get("ad_ids") and ad.get("id") not in filters["ad_ids"]:
+        return False
+    if filters.get("active_only") and ad.get("effective_status", ad.get("status")) != "ACTIVE":
+        return False
+    since, before = filters.get("created_since"), filters.get("created_before")
+    if since is not None or before is not None:
+        if not ad.get("created_time"):
+            return False
+        created = parse_graph_time(ad["created_time"])
+        if (since is not None and created < since) or (before is not None and created >= before):
+            return False
+    return True
+
+def describe_filters(filters: Dict[str, Any]) -> str:
+    """One-line summary of `filters` for the run log."""
+    parts = []
+    for key, label in (("campaign_ids", "campaigns"), ("adset_ids", "ad sets"), ("ad_ids", "ads")):
+        if filters.get(key):
+            parts.append(f"{label} {', '.join(filters[key])}")
+    if filters.get("active_only"):
+        parts.append("active only")
+    for key, label in (("created_since", "created since"), ("created_before", "created before")):
+        if filters.get(key) is not None:
+            parts.append(f"{label} {datetime.fromtimestamp(filters[key], timezone.utc).strftime('%Y-%m-%d')}")
+    if filters.get("max_ads"):
+        parts.append(f"at most {filters['max_ads']} ads")
+    return "; ".join(parts) or "all ads"
+
+def sync_scope(filters: Dict[str, Any]) -> str:
+    """
+    Key of the high-water mark for a filtered sync. A sync only sees the ads
+    inside its filters, so each filter set keeps its own mark. The requested
+    fields are part of the key, so adding a field re-fetches every ad once.
+    """
+    scope = {key: value for key, value in filters.items() if key != "max_ads"}
+    payload = json.dumps({"filters": scope, "fields": AD_FIELDS}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def load_sync_state() -> Dict[str, Any]:
+    if SYNC_STATE_PATH.exists():
+        with open(SYNC_STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_sync_state(sync_state: Dict[str, Any]) -> None:
+    tmp_path = SYNC_STATE_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sync_state, f, indent=2)
+    os.replace(tmp_path, SYNC_STATE_PATH)
+
+def store_ad(ad: Dict[str, Any]) -> bool:
+    """
+    Writes an ad to the local store if it is new or changed.
+
+    Returns:
+        bool: True if the ad was written.
+    """
+    ad_path = ADS_STORE_DIR / f"{ad['id']}.json"
+    if ad_path.exists():
+        with open(ad_path, "r", encoding="utf-8") as f:
+            # Compares the whole ad, not just updated_time, so newly requested fields get stored
+            if json.load(f) == ad:
+                return False
+
+    tmp_path = ad_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ad, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, ad_path)
+    return True
+
+def load_stored_ads(filters: Optional[Dict[str, Any]] = None) -> list:
+    """
+    Returns the stored ads inside `filters`. With max_ads, only the most
+    recently updated ones are returned.
+    """
+    filters = filters or {}
+    if filters.get("ad_ids"):
+        ad_paths = [ADS_STORE_DIR / f"{ad_id}.json" for ad_id in sorted(filters["ad_ids"])]
+    else:
+        ad_paths = sorted(ADS_STORE_DIR.glob("*.json"))
+
+    ads = []
+    for ad_path in ad_paths:
+        if ad_path.name.startswith("_") or not ad_path.exists():
+            continue
+        with open(ad_path, "r", encoding="utf-8") as f:
+            ad = json.load(f)
+        if matches_filters(ad, filters):
+            ads.append(ad)
+
+    if filters.get("max_ads"):
+        ads = sorted(ads, key=lambda ad: ad.get("updated_time", ""), reverse=True)[:filters["max_ads"]]
+    return ads
+
+def sync_ads(since: Optional[int] = None, page_limit: int = PAGE_LIMIT, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Pages through /act_{id}/ads and stores new or changed ads.
+
+    Args:
+        since (int, optional): Only fetch ads with updated_time after this unix timestamp.
+        page_limit (int): Number of ads requested per page.
+        filters (dict, optional): Filters pushed down into the request; with
+            max_ads, paging stops once that many ads were fetched.
+
+    Returns:
+        dict: {"fetched", "written", "changed", "high_water_mark", "truncated"} for
+            this sync, "changed" being the ids of the new or changed ads.
+    """
+    filters = filters or {}
+    max_ads = filters.get("max_ads")
+    params = {
+        "fields": ",".join(AD_FIELDS),
+        "limit": min(page_limit, max_ads) if max_ads else page_limit
+    }
+    conditions = build_filtering(filters, since)
+    if conditions:
+        params["filtering"] = json.dumps(conditions)
+
+    fetched = 0
+    changed = []
+    high_water_mark = since
+    truncated = False
+
+    for page in graph_paginate(f"act_{AD_ACCOUNT_ID}/ads", params):
+        for ad in page:
+            fetched += 1
+            if store_ad(ad):
+                changed.append(ad["id"])
+            if ad.get("updated_time"):
+                updated = parse_graph_time(ad["updated_time"])
+                high_water_mark = max(high_water_mark or 0, updated)
+        if max_ads and fetched >= max_ads:
+            truncated = True
+            break
+
+    return {"fetched": fetched, "written": len(changed), "changed": changed, "high_water_mark": high_water_mark, "truncated": truncated}
+
+def sync_incrementally(filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Syncs the ads inside `filters` that changed since the scope's high-water
+    mark and advances the mark.
+
+    Returns:
+        dict: The sync_ads result.
+    """
+    scope = sync_scope(filters)
+    unfiltered_scope = sync_scope({})
+    sync_state = load_sync_state()
+    scopes = sync_state.get("scopes", {})
+
+    # Everything an unfiltered sync saw is stored, so its mark bounds every scope
+    marks = [scopes.get(key, {}).get("high_water_mark") for key in (scope, unfiltered_scope)]
+    hwm = None if FULL_SYNC else max((mark for mark in marks if mark), default=None)
+    since = hwm - HWM_OVERLAP_SECONDS if hwm else None
+
+    result = sync_ads(since=since, filters=filters)
+    # The overlap window must not move the mark back when nothing new was fetched
+    mark = max(result["high_water_mark"] or 0, hwm or 0)
+    # A sync cut short by max_ads has not seen every ad up to its mark
+    if mark and not result["truncated"]:
+        scope_filters = {key: value for key, value in filters.items() if key != "max_ads"}
+        scopes[scope] = {"high_water_mark": mark, "filters": scope_filters}
+        save_sync_state({"scopes": scopes})
+
+    mode = "incremental" if since else "full"
+    print(f"[📥] {mode.capitalize()} sync: fetched {result['fetched']} ads, {result['written']} new or changed.")
+    return result
+
+def ad_record(ad: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the slim record of a stored ad that goes into the graph state; the payload stays in the ad store."""
+    return {"id": ad["id"], "video_id": get_ad_video_id(ad)}
+
 def get_facebook_ads(state: dict) -> dict:
     """
-    Fetch Facebook Ads data from Graph API and store it in the graph state.
+    Incrementally sync Facebook Ads from the Graph API into the local ad store
+    and put a slim record ({"id", "video_id"}) of every stored ad inside the
+    run's filters into the graph state.
 
     Args:
-        state (dict): The current state of the graph.
+        state (dict): The current state of the graph; "filters" narrows the
+            run and "skip_sync" uses the local store as is (the watcher syncs
+            before it starts a run).
 
     Returns:
-        dict: Updated graph state including raw ad data.
+        dict: State update with the ad records under "ads".
     """
     try:
-        url = f"https://graph.facebook.com/v19.0/act_{AD_ACCOUNT_ID}/ads"
-        params = {
-            "access_token": ACCESS_TOKEN,
-            "fields": ",".join([
-                "id",
-                "name",
-                "ad_active_time",
-                "adlabels",
-                "campaign{id,name}",
-                "adset{id,name,targeting}",
-                "creative{id,video_id,effective_object_story_id,object_story_spec}",
-                "status"
-            ])
-        }
-
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-
-        data = response.json()
-        ads_data = data.get("data", [])
-
-        # Save to file for debugging
-        with open("ads.json", "w") as f:
-            json.dump(ads_data, f, indent=2)
-
-        print(f"[📥] Retrieved {len(ads_data)} ads from Meta.")
-
-        # Update state - store the ads in a list (this will be accumulated in the graph state)
-        if "ads" in state:
-            state["ads"].extend(ads_data)  # Accumulate the ads into the list
+        filters = state.get("filters") or {}
+        if filters:
+            print(f"[🔎] Filters: {describe_filters(filters)}")
+        if state.get("skip_sync"):
+            print("[⏩] Ads already synced — using the local store.")
         else:
-            state["ads"] = ads_data  # Initialize the list with the first set of ads
+            sync_incrementally(filters)
 
-        return state
+        ads_data = load_stored_ads(filters)
+        print(f"[📦] {len(ads_data)} ads in local store{' match the filters' if filters else ''}.")
+        return {"ads": [ad_record(ad) for ad in ads_data]}
 
     except requests.exceptions.RequestException as e:
         print(f"[❌] Request to Facebook Ads API failed: {e}")
-        state["error"] = str(e)
-        return state
+        return {"ads": [], "errors": [str(e)]}
 
     except Exception as e:
         print(f"[❌] Unexpected error occurred: {e}")
-        state["error"] = str(e)
-        return state
+        return {"ads": [], "errors": [str(e)]}
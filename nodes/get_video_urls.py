@@ -1,76 +1,157 @@
 import requests
 import os
-from dotenv import load_dotenv
-from nodes.get_ads import get_facebook_ads  # This should now return state with "ads" key
+import json
+import time
+from typing import Dict, Any
+from utils.deps import get_dependency_tracker, stage_fingerprint
+from utils.graph_api import graph_get
+from utils.results import get_result_store
+from utils.settings import DATA_DIR
 
-load_dotenv()
+# The Graph API accepts at most 50 IDs per multi-ID lookup
+IDS_PER_REQUEST = 50
 
-ACCESS_TOKEN = os.getenv("FB_ACCESS_TOKEN")
+# Resolved source URLs are signed and expire, so they are only cached briefly
+SOURCE_CACHE_TTL = int(os.getenv("FB_VIDEO_SOURCE_TTL", "900"))
+
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+SOURCE_CACHE_PATH = CACHE_DIR / "video_sources.json"
+
+def get_ad_video_id(ad: Dict[str, Any]) -> str:
+    return (
+        ad.get("creative", {})
+        .get("object_story_spec", {})
+        .get("video_data", {})
+        .get("video_id")
+    )
+
+def load_source_cache() -> Dict[str, Any]:
+    """Loads cached video sources, dropping entries older than SOURCE_CACHE_TTL."""
+    if not SOURCE_CACHE_PATH.exists():
+        return {}
+    with open(SOURCE_CACHE_PATH, "r", encoding="utf-8") as f:
+        cache = json.load(f)
+    now = time.time()
+    return {vid: entry for vid, entry in cache.items() if now - entry.get("fetched_at", 0) < SOURCE_CACHE_TTL}
+
+def save_source_cache(cache: Dict[str, Any]) -> None:
+    tmp_path = SOURCE_CACHE_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, SOURCE_CACHE_PATH)
+
+def resolve_video_sources(video_ids: list) -> Dict[str, Dict[str, Any]]:
+    """
+    Resolves source and permalink URLs for many videos with multi-ID lookups
+    (`?ids=a,b,c`), IDS_PER_REQUEST at a time.
+
+    If a lookup fails (one bad ID fails the whole request), the IDs of that
+    chunk are resolved one by one so the others still succeed.
+
+    Returns:
+        dict: video_id -> {"source", "permalink_url"} or {"error"}.
+    """
+    resolved = {}
+    fields = "source,permalink_url"
+
+    for start in range(0, len(video_ids), IDS_PER_REQUEST):
+        chunk = video_ids[start:start + IDS_PER_REQUEST]
+        try:
+            data = graph_get("", {"ids": ",".join(chunk), "fields": fields})
+            for video_id in chunk:
+                info = data.get(video_id, {})
+                resolved[video_id] = {
+                    "source": info.get("source"),
+                    "permalink_url": info.get("permalink_url")
+                }
+        except requests.exceptions.RequestException as e:
+            print(f"[WARN] Multi-ID lookup failed ({e}), resolving {len(chunk)} videos individually.")
+            for video_id in chunk:
+                try:
+                    info = graph_get(video_id, {"fields": fields})
+                    resolved[video_id] = {
+                        "source": info.get("source"),
+                        "permalink_url": info.get("permalink_url")
+                    }
+                except requests.exceptions.RequestException as e:
+                    print(f"[WARN] Failed for video_id {video_id}: {e}")
+                    resolved[video_id] = {"error": str(e)}
+
+    return resolved
 
 def get_video_urls_from_ads(state: dict) -> dict:
     """
     Extracts video URLs for each ad with a video creative.
 
+    Video IDs are deduplicated across ads, resolved in bulk and cached for
+    SOURCE_CACHE_TTL seconds. Videos already downloaded and unchanged on disk
+    are not resolved at all; their entries carry "local": True instead of a source.
+
     Args:
-        state (dict): Current LangGraph state, should include "ads".
+        state (dict): Current LangGraph state, should include "ads" (ad records
+            {"id", "video_id"}, see nodes/get_ads.py).
 
     Returns:
-        dict: Updated state with video URL info.
+        dict: State update with video URL info under "video_urls".
     """
     try:
         ads = state.get("ads", [])
         if not ads:
             print("[⚠️] No ads found in state. Cannot extract video URLs.")
-            state["video_urls"] = []
-            return state
-
-        video_urls = []
+            return {"video_urls": []}
 
+        ad_videos = []
         for ad in ads:
-            creative = ad.get("creative", {})
-            video_id = (
-                creative
-                .get("object_story_spec", {})
-                .get("video_data", {})
-                .get("video_id")
-            )
-
+            video_id = ad.get("video_id")
             if not video_id:
                 print(f"[SKIP] No video ID found for ad_id {ad.get('id')}")
                 continue
+            ad_videos.append((ad.get("id"), video_id))
 
-            video_url = f"https://graph.facebook.com/v19.0/{video_id}"
-            params = {
-                "access_token": ACCESS_TOKEN,
-                "fields": "source,permalink_url"
-            }
-
-            try:
-                response = requests.get(video_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                video_info = {
-                    "ad_id": ad.get("id"),
-                    "video_id": video_id,
-                    "source": data.get("source"),
-                    "permalink_url": data.get("permalink_url")
-                }
+        unique_ids = list(dict.fromkeys(video_id for _, video_id in ad_videos))
+        tracker = get_dependency_tracker()
+        download_fingerprint = stage_fingerprint("download", {}, [])
+        local = {
+            video_id for video_id in unique_ids
+            if tracker.lookup(f"video_{video_id}", "download", download_fingerprint, count=False) is not None
+        }
+        cache = load_source_cache()
+        missing = [video_id for video_id in unique_ids if video_id not in cache and video_id not in local]
 
-                video_urls.append(video_info)
+        if missing:
+            now = time.time()
+            for video_id, info in resolve_video_sources(missing).items():
+                if info.get("source"):
+                    cache[video_id] = {**info, "fetched_at": now}
+                else:
+                    cache[video_id] = info
+            save_source_cache({vid: entry for vid, entry in cache.items() if "fetched_at" in entry})
 
-            except requests.exceptions.RequestException as e:
-                print(f"[WARN] Failed for video_id {video_id}: {e}")
-                video_urls.append({
-                    "video_id": video_id,
-                    "error": str(e)
-                })
+        # Exports and queries of the result store are by ad as well as by video
+        get_result_store().link_ads([(ad_id, f"video_{video_id}") for ad_id, video_id in ad_videos])
+
+        print(f"[🔗] {len(unique_ids)} unique videos across {len(ad_videos)} ads "
+              f"({len(local)} downloaded, {len(unique_ids) - len(missing) - len(local)} cached, {len(missing)} resolved).")
+
+        video_urls = []
+        for ad_id, video_id in ad_videos:
+            if video_id in local:
+                video_urls.append({"ad_id": ad_id, "video_id": video_id, "source": None, "local": True})
+                continue
+            info = cache.get(video_id, {})
+            if "error" in info:
+                video_urls.append({"ad_id": ad_id, "video_id": video_id, "error": info["error"]})
+                continue
+            video_urls.append({
+                "ad_id": ad_id,
+                "video_id": video_id,
+                "source": info.get("source"),
+                "permalink_url": info.get("permalink_url")
+            })
 
-        print(f"[🔗] Found video URLs for {len(video_urls)} ads.")
-        state["video_urls"] = video_urls
-        return state
+        return {"video_urls": video_urls}
 
     except Exception as e:
         print(f"[❌] Unexpected error in get_video_urls_from_ads: {e}")
-        state["error"] = str(e)
-        return state
+        return {"video_urls": [], "errors": [str(e)]}
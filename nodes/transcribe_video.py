@@ -1,69 +1,190 @@
-from dotenv import load_dotenv
-from openai import OpenAI
+import asyncio
 from pathlib import Path
 import os
-from typing import Dict, Any
-
-# Load API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
+from utils.audio import AUDIO_PARAMS, WHISPER_MAX_BYTES, cleanup_audio, ffmpeg_available, media_seconds, prepare_audio_chunks
+from utils.cache import cache_key, get_result_cache
+from utils.creatives import reuse_result
+from utils.deps import check_stage, get_dependency_tracker, split_fresh
+from utils.openai_client import atranscribe, transcribe
+from utils.results import get_result_store
+from utils.settings import DATA_DIR
+from utils.storage import get_storage_manager
+from utils.tracing import annotate, map_in_context
 
 # Resolve the root directory (project root where .env is)
-ROOT_DIR = Path(__file__).resolve().parent.parent
-VIDEO_DIR = ROOT_DIR / "tmp_videos"
-TRANSCRIPT_DIR = ROOT_DIR / "transcriptions"
-TRANSCRIPT_DIR.mkdir(parents=True, exist_ok=True)
+VIDEO_DIR = DATA_DIR / "tmp_videos"
+AUDIO_DIR = DATA_DIR / "tmp_audio"
+
+# Concurrent Whisper requests for the chunks of one long video
+CHUNK_WORKERS = int(os.getenv("TRANSCRIBE_CHUNK_WORKERS", "4"))
+
+WHISPER_MODEL = "whisper-1"
+WHISPER_LANGUAGE = "ur"
+WHISPER_PROMPT = "This is a Pakistani Urdu advertisement. You may find words like Oud-al-abraj, outlet, purchase, online etc. Transcribe the spoken content in Urdu script."
+
+def transcribe_file(media_path: Path) -> str:
+    """Uploads one audio or video file to Whisper and returns the text."""
+    with open(media_path, "rb") as f, annotate(audio_seconds=media_seconds(media_path)):
+        response = transcribe(
+            model=WHISPER_MODEL,
+            file=f,
+            language=WHISPER_LANGUAGE,
+            prompt=WHISPER_PROMPT
+        )
+    return response.text.strip()
+
+async def atranscribe_file(media_path: Path) -> str:
+    """Async variant of transcribe_file."""
+    data = await asyncio.to_thread(media_path.read_bytes)
+    seconds = await asyncio.to_thread(media_seconds, media_path)
+    with annotate(audio_seconds=seconds):
+        response = await atranscribe(
+            model=WHISPER_MODEL,
+            file=(media_path.name, data),
+            language=WHISPER_LANGUAGE,
+            prompt=WHISPER_PROMPT
+        )
+    return response.text.strip()
+
+def prepare_upload(video_path: Path) -> Optional[list[Path]]:
+    """
+    Returns the files to upload for `video_path`: compact audio chunks when
+    ffmpeg is available, otherwise the video itself (None if it is too large).
+    """
+    if not ffmpeg_available():
+        if video_path.stat().st_size > WHISPER_MAX_BYTES:
+            print(f"❌ {video_path.name} is over the 25 MB Whisper limit and ffmpeg is not installed.")
+            return None
+        return [video_path]
+
+    chunks = prepare_audio_chunks(video_path, AUDIO_DIR)
+    upload_bytes = sum(chunk.stat().st_size for chunk in chunks)
+    print(f"[🔉] {video_path.name}: uploading {upload_bytes / 1024:.0f} KB of audio in {len(chunks)} chunk(s) "
+          f"instead of {video_path.stat().st_size / 1024:.0f} KB of video")
+    return chunks
 
-def transcribe_video(video_path: Path) -> str:
+def transcribe_video(video_path: Path) -> Optional[str]:
     """
     Transcribes an Urdu video using Whisper and returns the transcription text.
+
+    With ffmpeg available only compact, silence-trimmed audio is uploaded; long
+    audio is split on silence and the chunks are transcribed concurrently and
+    joined in order. Without ffmpeg the video itself is uploaded.
     """
     try:
-        with open(video_path, "rb") as f:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=f,
-                language="ur",
-                prompt="This is a Pakistani Urdu advertisement. You may find words like Oud-al-abraj, outlet, purchase, online etc. Transcribe the spoken content in Urdu script."
-            )
-        return response.text.strip()
+        uploads = prepare_upload(video_path)
+        if not uploads:
+            return None
+        if len(uploads) == 1:
+            return transcribe_file(uploads[0])
+
+        with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(uploads))) as pool:
+            texts = map_in_context(pool, transcribe_file, uploads)
+        return " ".join(text for text in texts if text)
     except Exception as e:
         print(f"❌ Failed to transcribe {video_path.name}: {e}")
         return None
+    finally:
+        cleanup_audio(video_path, AUDIO_DIR)
+
+async def atranscribe_video(video_path: Path) -> Optional[str]:
+    """Async variant of transcribe_video; ffmpeg runs in a worker thread."""
+    try:
+        uploads = await asyncio.to_thread(prepare_upload, video_path)
+        if not uploads:
+            return None
+
+        texts = await asyncio.gather(*(atranscribe_file(upload) for upload in uploads))
+        return " ".join(text for text in texts if text)
+    except Exception as e:
+        print(f"❌ Failed to transcribe {video_path.name}: {e}")
+        return None
+    finally:
+        await asyncio.to_thread(cleanup_audio, video_path, AUDIO_DIR)
+
+def stage_params() -> Dict[str, Any]:
+    """Everything besides the video that determines the transcript."""
+    audio_params = AUDIO_PARAMS if ffmpeg_available() else {"audio": "original"}
+    return {"model": WHISPER_MODEL, "prompt": WHISPER_PROMPT, "language": WHISPER_LANGUAGE, **audio_params}
+
+def prepare_transcript(video: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Checks whether the recorded transcript of one downloaded video is up to
+    date, and otherwise looks it up in the result cache.
+    """
+    video_file = Path(video["path"])
+    fingerprint, fresh = check_stage(video["id"], "transcribe", stage_params(), [video])
+    if fresh:
+        print(f"[⏩] Up to date: {video_file.stem} transcript")
+        return {"video": video_file, "fingerprint": fingerprint, "fresh": fresh}
+
+    audio_params = AUDIO_PARAMS if ffmpeg_available() else {"audio": "original"}
+    key = cache_key("transcribe", WHISPER_MODEL, WHISPER_PROMPT, {"language": WHISPER_LANGUAGE, **audio_params}, [video["sha256"]])
+    cached = get_result_cache().get(key, "transcribe")
+    text = cached or reuse_result(video["id"], "transcribe")
+
+    if text:
+        print(f"[⏩] Skipping {video_file.name} (already transcribed)")
+    else:
+        print(f"[🎙️] Transcribing: {video_file.name}")
+    return {"video": video_file, "fingerprint": fingerprint, "fresh": None, "key": key, "text": text, "cached": bool(cached)}
+
+def finish_transcript(job: Dict[str, Any], text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Caches and saves one transcript (reused ones too, under this video's content key); returns its handle."""
+    if not text:
+        return None
+    if not job["cached"]:
+        get_result_cache().put(job["key"], "transcribe", text)
+
+    video_name = job["video"].stem
+    handle, written = get_result_store().put(video_name, "transcribe", text)
+    if written:
+        print(f"[✅] Saved transcript: {video_name}")
+    get_dependency_tracker().record(video_name, "transcribe", job["fingerprint"], [handle])
+    storage = get_storage_manager()
+    storage.touch("videos", video_name)
+    storage.release_source(video_name)
+    return handle
 
 def transcribe_all_videos(state: Dict[str, Any]) -> Dict[str, Any]:
     """
-    LangGraph-compatible node to transcribe all videos and update the state with results.
+    LangGraph-compatible node to transcribe all videos.
+    Returns handles to the stored transcripts under "transcriptions".
     """
-    results = []
-    video_paths = state.get("downloaded_videos", [])
+    videos = state.get("downloaded_videos", [])
 
-    if not video_paths:
+    if not videos:
         print("[⚠️] No video paths found in state. Skipping transcription.")
-        state["transcriptions"] = []
-        return state
-
-    for video_file in video_paths:
-        video_file = Path(video_file)
-        transcript_path = TRANSCRIPT_DIR / f"{video_file.stem}.txt"
-
-        if transcript_path.exists():
-            print(f"[⏩] Skipping {video_file.name} (already transcribed)")
-            with open(transcript_path, "r", encoding="utf-8") as f:
-                results.append({
-                    "file": video_file.name,
-                    "text": f.read().strip()
-                })
+        return {"transcriptions": []}
+
+    results = []
+    for job in map(prepare_transcript, videos):
+        if job["fresh"]:
+            results.extend(job["fresh"])
             continue
+        handle = finish_transcript(job, job["text"] or transcribe_video(job["video"]))
+        if handle:
+            results.append(handle)
 
-        print(f"[🎙️] Transcribing: {video_file.name}")
-        text = transcribe_video(video_file)
+    return {"transcriptions": results}
+
+async def atranscribe_all_videos(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of transcribe_all_videos; videos are transcribed concurrently."""
+    videos = state.get("downloaded_videos", [])
+
+    if not videos:
+        print("[⚠️] No video paths found in state. Skipping transcription.")
+        return {"transcriptions": []}
+
+    jobs = [prepare_transcript(video) for video in videos]
+    fresh, jobs = split_fresh(jobs)
 
-        if text:
-            with open(transcript_path, "w", encoding="utf-8") as f:
-                f.write(text)
-            print(f"[✅] Saved: {transcript_path}")
-            results.append({"file": video_file.name, "text": text})
+    async def run(job):
+        return job["text"] or await atranscribe_video(job["video"])
 
-    state["transcriptions"] = results
-    return state
+    texts = await asyncio.gather(*(run(job) for job in jobs))
+    with get_result_store().transaction():
+        handles = [finish_transcript(job, text) for job, text in zip(jobs, texts)]
+    return {"transcriptions": fresh + [h for h in handles if h]}
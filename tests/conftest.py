@@ -0,0 +1,10 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Modules create their databases under the data directory at import time;
+# keep them out of the checkout
+if "AD_ANALYZER_DATA_DIR" not in os.environ:
+    os.environ["AD_ANALYZER_DATA_DIR"] = tempfile.mkdtemp(prefix="ad_analyzer_tests_")
+    atexit.register(shutil.rmtree, os.environ["AD_ANALYZER_DATA_DIR"], ignore_errors=True)
@@ -0,0 +1,88 @@
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+import utils.creatives as creatives
+from utils.creatives import CreativeIndex, reuse_result, same_creative, visual_fingerprint
+from utils.results import ResultStore
+
+VOICEOVER = bytes(range(64))
+OTHER_VOICEOVER = bytes(255 - b for b in VOICEOVER)
+
+def make_video(path, fps: int, seed: int = 0, seconds: int = 2):
+    """Writes `seconds` of random blocks that change every half second, at `fps`."""
+    rng = np.random.default_rng(seed)
+    shots = [cv2.resize(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8), (320, 180), interpolation=cv2.INTER_NEAREST)
+             for _ in range(seconds * 2)]
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (320, 180))
+    for i in range(seconds * fps):
+        writer.write(shots[i * 2 // fps])
+    writer.release()
+    return path
+
+def fingerprint(path, audio):
+    duration, frames, colours = visual_fingerprint(path)
+    return {"duration": duration, "frames": frames, "colours": colours, "audio": audio}
+
+@pytest.fixture
+def videos(tmp_path):
+    # One creative encoded twice at different frame rates, and another creative
+    return (make_video(tmp_path / "original.mp4", fps=30),
+            make_video(tmp_path / "reupload.mp4", fps=25),
+            make_video(tmp_path / "other.mp4", fps=30, seed=1))
+
+def test_same_creative_needs_the_same_footage_and_soundtrack(videos):
+    original, reupload, other = videos
+    assert same_creative(fingerprint(original, VOICEOVER), fingerprint(reupload, VOICEOVER))
+    assert not same_creative(fingerprint(original, VOICEOVER), fingerprint(other, VOICEOVER))
+    assert not same_creative(fingerprint(original, VOICEOVER), fingerprint(reupload, OTHER_VOICEOVER))
+    assert not same_creative(fingerprint(original, VOICEOVER), fingerprint(reupload, None))
+    # Without audio fingerprints (no ffmpeg) the footage decides
+    assert same_creative(fingerprint(original, None), fingerprint(reupload, None))
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = CreativeIndex(tmp_path / "creatives.sqlite")
+    store = ResultStore(tmp_path / "results.sqlite")
+    store.put("original", "transcribe", "the original voiceover")
+    store.put("original", "analyze_frames", {"frame_1.jpg": "a perfume bottle"})
+    monkeypatch.setattr(creatives, "CREATIVE_DEDUP", True)
+    monkeypatch.setattr(creatives, "_index", index)
+    monkeypatch.setattr(creatives, "get_result_store", lambda: store)
+    monkeypatch.setattr(creatives, "media_plan", lambda video: {"transcribe": "up to date", "analyze_frames": "up to date"})
+    return index
+
+def add(index, monkeypatch, video, path, audio, sha256=None):
+    monkeypatch.setattr(creatives, "audio_fingerprint", lambda _: audio)
+    return index.add(video, path, sha256 or video)
+
+def test_matching_soundtracks_share_the_transcript(videos, index, monkeypatch):
+    original, reupload, _ = videos
+    add(index, monkeypatch, "original", original, VOICEOVER)
+    assert add(index, monkeypatch, "reupload", reupload, VOICEOVER) == "original"
+    assert reuse_result("reupload", "transcribe") == "the original voiceover"
+    assert reuse_result("reupload", "analyze_frames") == {"frame_1.jpg": "a perfume bottle"}
+
+def test_a_visual_only_match_shares_frame_analysis_but_not_the_transcript(videos, index, monkeypatch):
+    original, reupload, _ = videos
+    # Without ffmpeg neither video has an audio fingerprint
+    add(index, monkeypatch, "original", original, None)
+    assert add(index, monkeypatch, "reupload", reupload, None) == "original"
+    assert reuse_result("reupload", "transcribe") is None
+    assert reuse_result("reupload", "analyze_frames") == {"frame_1.jpg": "a perfume bottle"}
+
+def test_a_different_voiceover_is_another_creative(videos, index, monkeypatch):
+    original, reupload, _ = videos
+    add(index, monkeypatch, "original", original, VOICEOVER)
+    assert add(index, monkeypatch, "reupload", reupload, OTHER_VOICEOVER) == "reupload"
+    assert reuse_result("reupload", "transcribe") is None
+    assert reuse_result("reupload", "analyze_frames") is None
+
+def test_identical_files_share_the_transcript_without_audio_fingerprints(videos, index, monkeypatch, tmp_path):
+    original, _, _ = videos
+    copy = shutil.copy(original, tmp_path / "copy.mp4")
+    add(index, monkeypatch, "original", original, None, sha256="same")
+    assert add(index, monkeypatch, "copy", copy, None, sha256="same") == "original"
+    assert reuse_result("copy", "transcribe") == "the original voiceover"
@@ -0,0 +1,64 @@
+import hashlib
+import random
+
+import pytest
+
+import utils.downloader as downloader
+from mocks.graph_api_server import FakeGraphAPI, serve
+from utils.downloader import DownloadError, DownloadManager, part_path
+
+# Just enough of an MP4 to pass the header check
+DATA = b"\x00\x00\x00\x20ftypisom" + random.Random(0).randbytes(300_000)
+
+@pytest.fixture
+def cdn(tmp_path):
+    source = tmp_path / "source.mp4"
+    source.write_bytes(DATA)
+    server = serve(FakeGraphAPI([], {"123": source}), port=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def video_url(cdn) -> str:
+    return f"{cdn.state.base_url}/cdn/123.mp4"
+
+def test_a_verified_download_is_not_fetched_again(cdn, tmp_path):
+    manager = DownloadManager(max_workers=2)
+    dest = tmp_path / "videos" / "123.mp4"
+    dest.parent.mkdir()
+
+    result = manager.fetch(video_url(cdn), dest)
+    assert not result["cached"]
+    assert result["size"] == len(DATA) and result["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert dest.read_bytes() == DATA and not part_path(dest).exists()
+
+    assert manager.fetch(video_url(cdn), dest)["cached"]
+    assert cdn.state.counts["cdn"] == 1
+
+def test_an_interrupted_download_resumes_from_its_part_file(cdn, tmp_path):
+    dest = tmp_path / "123.mp4"
+    # A marker byte only the .part has shows the prefix was kept, not downloaded again
+    prefix = bytearray(DATA[:100_000])
+    prefix[50_000] ^= 0xFF
+    part_path(dest).write_bytes(prefix)
+
+    result = DownloadManager(max_workers=2).fetch(video_url(cdn), dest)
+    assert dest.read_bytes() == bytes(prefix) + DATA[100_000:]
+    assert result["sha256"] == hashlib.sha256(dest.read_bytes()).hexdigest()
+    assert cdn.state.counts["cdn"] == 1
+
+def test_a_short_body_fails_and_keeps_its_part_file(cdn, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_ATTEMPTS", 1)
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+    manager = DownloadManager(max_workers=2)
+    dest = tmp_path / "123.mp4"
+
+    cdn.state.drop_after_bytes = 100_000
+    with pytest.raises(DownloadError):
+        manager.fetch(video_url(cdn), dest)
+    assert not dest.exists()
+    assert 0 < part_path(dest).stat().st_size < len(DATA)
+
+    cdn.state.drop_after_bytes = 0
+    result = manager.fetch(video_url(cdn), dest)
+    assert dest.read_bytes() == DATA and result["sha256"] == hashlib.sha256(DATA).hexdigest()
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+import requests
+
+import utils.jobs as jobs
+from utils.jobs import HttpJobQueue, SqliteJobQueue, serve_job_queue
+
+@pytest.fixture
+def queue(tmp_path):
+    return SqliteJobQueue(tmp_path / "jobs.sqlite")
+
+def test_a_job_is_leased_to_one_worker(queue):
+    assert queue.enqueue("videos", "a", {"n": 1})
+    assert not queue.enqueue("videos", "a", {"n": 2})
+
+    job = queue.lease("videos", "w1")
+    assert job["id"] == "a" and job["payload"] == {"n": 1} and job["attempts"] == 1
+    assert queue.lease("videos", "w2") is None
+    assert queue.heartbeat("a", job["token"])
+    assert not queue.heartbeat("a", "stale")
+
+def test_an_expired_lease_is_handed_out_again_until_max_attempts(queue):
+    queue.enqueue("videos", "a", {}, max_attempts=2)
+    first = queue.lease("videos", "w1", lease_seconds=-1)
+    second = queue.lease("videos", "w2", lease_seconds=-1)
+    assert second["attempts"] == 2 and second["token"] != first["token"]
+    assert not queue.heartbeat("a", first["token"])
+
+    assert queue.lease("videos", "w3") is None
+    assert queue.get("a")["status"] == "failed"
+
+def test_failed_attempts_back_off_then_fail_for_good(queue, monkeypatch):
+    queue.enqueue("videos", "a", {}, max_attempts=2)
+    job = queue.lease("videos", "w1")
+    assert queue.fail("a", job["token"], "boom") == "queued"
+    assert queue.lease("videos", "w1") is None
+
+    monkeypatch.setattr(jobs, "RETRY_BASE_SECONDS", 0)
+    queue.enqueue("videos", "b", {}, max_attempts=2)
+    job = queue.lease("videos", "w1")
+    assert queue.fail("b", job["token"], "boom") == "queued"
+    job = queue.lease("videos", "w1")
+    assert job["id"] == "b" and job["attempts"] == 2
+    assert queue.fail("b", job["token"], "boom") == "failed"
+    assert queue.fail("b", job["token"], "boom") is None
+
+def test_complete_keeps_the_first_result(queue):
+    queue.enqueue("videos", "a", {})
+    first = queue.lease("videos", "w1", lease_seconds=-1)
+    second = queue.lease("videos", "w2")
+    # The worker that lost its lease still finished the work
+    assert queue.complete("a", first["token"], {"by": "w1"})
+    assert not queue.complete("a", second["token"], {"by": "w2"})
+    assert queue.get("a")["status"] == "done"
+    assert queue.get("a")["result"] == {"by": "w1"}
+
+def test_release_requeues_without_using_an_attempt(queue):
+    queue.enqueue("videos", "a", {}, max_attempts=1)
+    job = queue.lease("videos", "w1")
+    assert queue.release("a", job["token"])
+    assert not queue.release("a", job["token"])
+
+    job = queue.lease("videos", "w2")
+    assert job["id"] == "a" and job["attempts"] == 1
+
+def test_reserve_waits_once_a_shared_limit_is_used_up(queue):
+    assert queue.reserve("openai", tokens=100, rpm=2, tpm=1000) == 0
+    assert queue.reserve("openai", tokens=100, rpm=2, tpm=1000) == 0
+    # One request over a 2 per minute budget waits about half a minute
+    assert 29 < queue.reserve("openai", tokens=100, rpm=2, tpm=1000) <= 30
+
+def test_settle_returns_unused_tokens(queue):
+    assert queue.reserve("openai", tokens=1000, rpm=100, tpm=1000) == 0
+    assert queue.reserve("openai", tokens=500, rpm=100, tpm=1000) > 29
+    queue.settle("openai", 1000)
+    assert queue.reserve("openai", tokens=400, rpm=100, tpm=1000) == 0
+
+def test_queue_server_requires_its_token(queue):
+    server = serve_job_queue(queue, port=0, token="secret")
+    try:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+        with pytest.raises(requests.HTTPError):
+            HttpJobQueue(url, token="wrong").enqueue("videos", "a", {})
+        client = HttpJobQueue(url, token="secret")
+        assert client.enqueue("videos", "a", {})
+        job = client.lease("videos", "w1")
+        assert client.release("a", job["token"])
+        assert client.stats("videos") == {"queued": 1}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_queue_server_refuses_public_interfaces_without_a_token(queue):
+    with pytest.raises(ValueError):
+        serve_job_queue(queue, host="0.0.0.0", port=0, token="")
@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+
+from utils.keyframes import dhash, hamming_matrix, select_keyframes
+
+def shot(colour, x: int = 100):
+    """A 320x180 frame of one colour with the same white rectangle."""
+    frame = np.empty((180, 320, 3), np.uint8)
+    frame[:] = colour
+    cv2.rectangle(frame, (x, 60), (x + 60, 120), (255, 255, 255), -1)
+    return frame
+
+def test_colour_only_scene_changes_are_kept():
+    frames = [shot((0, 0, 200)), shot((0, 200, 0)), shot((200, 0, 0)), shot((0, 200, 200))]
+    # The shots only differ in colour, which dHash does not see
+    assert not hamming_matrix(dhash(frames)).any()
+    assert select_keyframes(frames, budget=5, min_distance=10, min_color_distance=0.3) == [0, 1, 2, 3]
+
+def test_near_duplicates_are_dropped():
+    frames = [shot((0, 0, 200), x) for x in (100, 102, 104)] + [shot((200, 0, 0))]
+    assert select_keyframes(frames, budget=5, min_distance=10, min_color_distance=0.3) == [0, 3]
+
+def test_budget_caps_the_selection():
+    frames = [shot(colour) for colour in ((0, 0, 200), (0, 200, 0), (200, 0, 0), (0, 200, 200))]
+    assert len(select_keyframes(frames, budget=2, min_distance=10, min_color_distance=0.3)) == 2
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import utils.storage as storage
+from utils.storage import StorageManager
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "VIDEO_DIR", tmp_path / "tmp_videos")
+    monkeypatch.setattr(storage, "FRAMES_DIR", tmp_path / "extracted_frames")
+    storage.VIDEO_DIR.mkdir()
+    return StorageManager(tmp_path / "storage.sqlite")
+
+def add_videos(manager, videos: list, size: int = 1000) -> None:
+    """Writes one video file per id, least recently used first."""
+    for age, video in enumerate(reversed(videos)):
+        path = storage.VIDEO_DIR / f"{video}.mp4"
+        path.write_bytes(b"x" * size)
+        manager.touch("videos", video)
+        manager.conn.execute("UPDATE artifacts SET last_access = last_access - ? WHERE video = ?", (age + 1, video))
+
+def plan_with(pending: set):
+    """media_plan where the stages of videos in `pending` have not run yet."""
+    def media_plan(video):
+        status = "new" if video in pending else "up to date"
+        return {"download": "up to date", "transcribe": status, "extract_frames": status, "analyze_frames": status}
+    return media_plan
+
+def test_enforce_evicts_least_recently_used_final_videos(manager, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_QUOTAS", {"videos": 3500})
+    monkeypatch.setattr(storage, "media_plan", plan_with({"b"}))
+    add_videos(manager, ["a", "b", "c", "d", "e"])
+    manager.pin(["a"])
+
+    assert manager.enforce() == {"videos": 2000}
+    # a is pinned and b not transcribed yet; c and d make room, e is not needed
+    remaining = sorted(path.stem for path in storage.VIDEO_DIR.glob("*.mp4"))
+    assert remaining == ["a", "b", "e"]
+    assert manager.is_evicted(storage.VIDEO_DIR / "c.mp4")
+    assert not manager.is_evicted(storage.VIDEO_DIR / "b.mp4")
+
+def test_enforce_leaves_entries_it_cannot_evict_over_quota(manager, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_QUOTAS", {"videos": 500})
+    monkeypatch.setattr(storage, "media_plan", plan_with({"b"}))
+    add_videos(manager, ["a", "b"])
+    manager.pin(["a"])
+
+    assert manager.enforce() == {"videos": 0}
+    assert len(list(storage.VIDEO_DIR.glob("*.mp4"))) == 2
+
+    manager.unpin_all()
+    assert manager.enforce() == {"videos": 1000}
+    assert [path.stem for path in storage.VIDEO_DIR.glob("*.mp4")] == ["b"]
+
+def test_pins_of_dead_processes_do_not_count(manager, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_QUOTAS", {"videos": 500})
+    monkeypatch.setattr(storage, "media_plan", plan_with(set()))
+    monkeypatch.setattr(storage, "process_alive", lambda pid: pid == os.getpid())
+    add_videos(manager, ["a"])
+    manager.conn.execute("INSERT INTO pins (video, pid) VALUES ('a', ?)", (os.getpid() + 1,))
+
+    assert manager.enforce() == {"videos": 1000}
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+# Fail loudly once a single state entry (an ad record, URL or artifact handle)
+# grows past this many bytes. The state grows with the number of ads, so the
+# bound is per entry: a payload put into the state trips it at any scale.
+MAX_STATE_ITEM_BYTES = int(os.getenv("MAX_STATE_ITEM_BYTES", str(8 * 1024)))
+
+class StateTooLargeError(RuntimeError):
+    """Raised when a state entry grows past MAX_STATE_ITEM_BYTES."""
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_artifact(path: Path, artifact_id: Optional[str] = None, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Builds a lightweight handle for a file produced by a node.
+
+    Args:
+        path (Path): Location of the artifact on disk.
+        artifact_id (str, optional): Identifier used to join artifacts across stages.
+            Defaults to the file stem (e.g. "video_123").
+        sha256 (str, optional): Precomputed digest, to avoid re-reading large files.
+
+    Returns:
+        dict: {"id", "path", "sha256", "size"}
+    """
+    path = Path(path)
+    return {
+        "id": artifact_id or path.stem,
+        "path": str(path),
+        "sha256": sha256 or file_sha256(path),
+        "size": path.stat().st_size,
+    }
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """
+    Writes text to `path` unless the file already holds exactly that content,
+    so unchanged results keep their mtime. Returns True if the file was written.
+    """
+    path = Path(path)
+    if path.exists() and path.read_text(encoding="utf-8") == content:
+        return False
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    os.replace(tmp_path, path)
+    return True
+
+def state_size(value: Any) -> int:
+    """Approximates the serialized size of a state value in bytes."""
+    return len(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+
+def check_state_size(state: Dict[str, Any], label: str, limit: int = MAX_STATE_ITEM_BYTES) -> int:
+    """
+    Raises StateTooLargeError if any entry of the state (an item of a list
+    key, or a scalar key) serializes to more than `limit` bytes.
+
+    Returns:
+        int: The size of the largest entry in bytes.
+    """
+    largest = 0
+    for key, value in state.items():
+        for item in (value if isinstance(value, list) else [value]):
+            size = state_size(item)
+            if size > limit:
+                raise StateTooLargeError(
+                    f"{label}: an entry of \"{key}\" is {size:,} bytes, over the {limit:,} byte limit. "
+                    "Nodes should pass artifact handles, not payloads."
+                )
+            largest = max(largest, size)
+    return largest
@@ -0,0 +1,156 @@
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+# Audio pre-processing for Whisper uploads: mono 16 kHz Opus with leading and
+# trailing silence trimmed, split on silence into chunks of at most MAX_CHUNK_SECONDS
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+SILENCE_THRESHOLD_DB = int(os.getenv("AUDIO_SILENCE_DB", "-40"))
+MIN_SILENCE_SECONDS = float(os.getenv("AUDIO_MIN_SILENCE_SECONDS", "0.4"))
+MAX_CHUNK_SECONDS = float(os.getenv("AUDIO_MAX_CHUNK_SECONDS", "600"))
+
+# Whisper API upload limit
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+
+# Parameters that change the uploaded audio, for cache keys
+AUDIO_PARAMS = {
+    "codec": "libopus",
+    "bitrate": AUDIO_BITRATE,
+    "sample_rate": AUDIO_SAMPLE_RATE,
+    "silence_db": SILENCE_THRESHOLD_DB,
+    "max_chunk_seconds": MAX_CHUNK_SECONDS,
+}
+
+class AudioError(RuntimeError):
+    """Raised when ffmpeg fails to prepare audio."""
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BINARY) is not None
+
+def run_ffmpeg(args: list) -> str:
+    """Runs ffmpeg and returns its stderr (where it logs), raising AudioError on failure."""
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-y", *args],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise AudioError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "ffmpeg failed")
+    return result.stderr
+
+def extract_audio(video_path: Path, output_path: Path) -> Path:
+    """
+    Extracts the audio track as mono 16 kHz Opus, trimming leading and trailing
+    silence (the second silenceremove runs on the reversed stream).
+    """
+    trim = f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB:start_silence=0.1"
+    run_ffmpeg([
+        "-i", str(video_path),
+        "-vn",
+        "-ac", "1",
+        "-ar", str(AUDIO_SAMPLE_RATE),
+        "-af", f"{trim},areverse,{trim},areverse",
+        "-c:a", "libopus",
+        "-b:a", AUDIO_BITRATE,
+        str(output_path),
+    ])
+    return output_path
+
+def detect_silences(audio_path: Path) -> tuple:
+    """
+    Returns (duration in seconds, [(silence_start, silence_end), ...]).
+    """
+    log = run_ffmpeg([
+        "-i", str(audio_path),
+        "-af", f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:d={MIN_SILENCE_SECONDS}",
+        "-f", "null", "-",
+    ])
+    duration = 0.0
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", log)
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    starts = [float(x) for x in re.findall(r"silence_start: (-?\d+(?:\.\d+)?)", log)]
+    ends = [float(x) for x in re.findall(r"silence_end: (\d+(?:\.\d+)?)", log)]
+    return duration, list(zip(starts, ends))
+
+def plan_chunks(duration: float, silences: list, max_chunk: float = MAX_CHUNK_SECONDS) -> list:
+    """
+    Splits [0, duration] into (start, end) spans of at most `max_chunk` seconds,
+    cutting in the middle of the last silence of each span when there is one in
+    its second half, so words are not split across chunks.
+    """
+    cut_points = [(start + end) / 2 for start, end in silences]
+    chunks = []
+    start = 0.0
+    while duration - start > max_chunk:
+        limit = start + max_chunk
+        candidates = [p for p in cut_points if start + max_chunk / 2 < p <= limit]
+        end = candidates[-1] if candidates else limit
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, duration))
+    return chunks
+
+def cut_chunk(audio_path: Path, start: float, end: float, output_path: Path) -> Path:
+    run_ffmpeg([
+        "-ss", f"{start:.3f}",
+        "-to", f"{end:.3f}",
+        "-i", str(audio_path),
+        "-c", "copy",
+        str(output_path),
+    ])
+    return output_path
+
+def prepare_audio_chunks(video_path: Path, audio_dir: Path, max_chunk: Optional[float] = None) -> list[Path]:
+    """
+    Extracts compact audio for `video_path` into `audio_dir` and splits it on
+    silence when it is longer than `max_chunk` seconds.
+
+    Returns:
+        list[Path]: Audio files to transcribe, in playback order.
+    """
+    max_chunk = max_chunk or MAX_CHUNK_SECONDS
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    audio_path = extract_audio(video_path, audio_dir / f"{video_path.stem}.ogg")
+
+    duration, silences = detect_silences(audio_path)
+    if duration <= max_chunk and audio_path.stat().st_size <= WHISPER_MAX_BYTES:
+        return [audio_path]
+
+    chunk_dir = audio_dir / video_path.stem
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    return [
+        cut_chunk(audio_path, start, end, chunk_dir / f"chunk_{i:03d}.ogg")
+        for i, (start, end) in enumerate(plan_chunks(duration, silences, max_chunk))
+    ]
+
+def cleanup_audio(video_path: Path, audio_dir: Path) -> None:
+    """Deletes the audio and chunks prepare_audio_chunks wrote for `video_path`."""
+    (audio_dir / f"{video_path.stem}.ogg").unlink(missing_ok=True)
+    shutil.rmtree(audio_dir / video_path.stem, ignore_errors=True)
+
+def media_seconds(media_path: Path) -> Optional[float]:
+    """
+    Estimates the playback length of a Whisper upload, for cost tracking:
+    Opus audio from its target bitrate, video files from frame count and fps.
+    """
+    if media_path.suffix == ".ogg":
+        bitrate = float(AUDIO_BITRATE.rstrip("kK")) * 1000
+        return media_path.stat().st_size * 8 / bitrate
+
+    import cv2
+
+    capture = cv2.VideoCapture(str(media_path))
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        capture.release()
+    return frames / fps if fps > 0 and frames > 0 else None
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+from utils.settings import DATA_DIR
+from utils.tracing import record_cache
+
+# Cache location and eviction bounds
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DB_PATH = CACHE_DIR / "results.sqlite"
+
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_MAX_AGE_DAYS = float(os.getenv("RESULT_CACHE_MAX_AGE_DAYS", "90"))
+
+# Evict after this many writes rather than on every put
+EVICT_EVERY = 100
+
+def cache_key(stage: str, model: str, prompt: str, params: Dict[str, Any], inputs: list) -> str:
+    """
+    Builds a content-addressed key from everything that determines a result:
+    the stage, model, prompt template, call parameters and the input content.
+
+    Args:
+        inputs (list): Input text, raw bytes, or digests of large inputs (e.g. a video's sha256).
+    """
+    digest = hashlib.sha256()
+    header = json.dumps(
+        {"stage": stage, "model": model, "prompt": prompt, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    digest.update(header.encode("utf-8"))
+    for item in inputs:
+        data = item if isinstance(item, bytes) else str(item).encode("utf-8")
+        # Length-prefix every input so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Stores LLM and Whisper results by content-addressed key in SQLite.
+
+    The `entries` table is the manifest: key, stage, size, creation and last
+    access time, and the JSON-encoded value. Per-stage hit/miss counters are
+    kept in `stats`. Entries older than `max_age_days` are dropped first, then
+    the least recently used entries until the total size fits `max_bytes`.
+    """
+
+    def __init__(self, db_path: Path = CACHE_DB_PATH, max_bytes: int = CACHE_MAX_BYTES, max_age_days: float = CACHE_MAX_AGE_DAYS):
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.session_stats: Dict[str, Dict[str, int]] = {}
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+            CREATE TABLE IF NOT EXISTS stats (
+                stage TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+    def _count(self, stage: str, hit: bool) -> None:
+        column = "hits" if hit else "misses"
+        counters = self.session_stats.setdefault(stage, {"hits": 0, "misses": 0})
+        counters[column] += 1
+        self.conn.execute(
+            f"INSERT INTO stats (stage, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(stage) DO UPDATE SET {column} = {column} + 1",
+            (stage,),
+        )
+
+    def get(self, key: str, stage: str) -> Optional[Any]:
+        """Returns the cached value for `key`, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and time.time() - row[1] > self.max_age_seconds:
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row:
+                self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._count(stage, hit=row is not None)
+        record_cache(stage, hit=row is not None)
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, stage: str, value: Any) -> None:
+        """Stores a JSON-serializable value under `key`."""
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, stage, size, created_at, last_access, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stage, len(encoded.encode("utf-8")), now, now, encoded),
+            )
+            self.writes += 1
+            if self.writes % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self) -> int:
+        removed = self.conn.execute(
+            "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+        ).rowcount
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self.conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+            victims = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            removed += len(victims)
+        return removed
+
+    def evict(self) -> int:
+        """Applies the age and size bounds now. Returns the number of entries removed."""
+        with self.lock:
+            return self._evict()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns all-time {stage: {"hits", "misses", "entries", "bytes"}}.
+        Counters for the current process only are in `session_stats`.
+        """
+        with self.lock:
+            result = {
+                stage: {"hits": hits, "misses": misses, "entries": 0, "bytes": 0}
+                for stage, hits, misses in self.conn.execute("SELECT stage, hits, misses FROM stats")
+            }
+            for stage, entries, size in self.conn.execute(
+                "SELECT stage, COUNT(*), SUM(size) FROM entries GROUP BY stage"
+            ):
+                result.setdefault(stage, {"hits": 0, "misses": 0})
+                result[stage].update({"entries": entries, "bytes": size})
+        return result
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    """Returns the process-wide result cache shared by all nodes."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
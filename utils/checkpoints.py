@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, Optional
+from rich import print
+from utils.settings import DATA_DIR
+
+# Graph checkpoints and the run registry share one SQLite file
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+CHECKPOINT_DB_PATH = CACHE_DIR / "checkpoints.sqlite"
+
+def new_run_id() -> str:
+    """Returns a sortable, human-readable run id, e.g. 20250101-120000-1a2b3c."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def open_checkpointer(db_path: Path = CHECKPOINT_DB_PATH):
+    """Context manager yielding a SQLite checkpointer for graph.invoke()."""
+    # Imported here: it loads langchain_core, which listing runs does not need
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    return SqliteSaver.from_conn_string(str(db_path))
+
+def open_async_checkpointer(db_path: Path = CHECKPOINT_DB_PATH):
+    """Async context manager yielding a SQLite checkpointer for graph.ainvoke()."""
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    return AsyncSqliteSaver.from_conn_string(str(db_path))
+
+class RunRegistry:
+    """
+    Records every graph run with the options it was started with, so that a
+    resumed run rebuilds the same graph shape its checkpoints belong to.
+    The run id doubles as the LangGraph thread id.
+    """
+
+    def __init__(self, db_path: Path = CHECKPOINT_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                per_video INTEGER NOT NULL,
+                fused INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+
+    def start(self, run_id: str, per_video: bool, fused: bool) -> None:
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO runs (run_id, per_video, fused, status, started_at) VALUES (?, ?, ?, 'running', ?)",
+                (run_id, int(per_video), int(fused), time.time()),
+            )
+
+    def set_status(self, run_id: str, status: str) -> None:
+        """Marks a run as "running", "completed" or "failed"."""
+        finished_at = None if status == "running" else time.time()
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?", (status, finished_at, run_id))
+
+    def delete(self, run_id: str) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT run_id, per_video, fused, status, started_at, finished_at FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def recent(self, limit: int = 20) -> list:
+        """Returns the latest runs, newest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT run_id, per_video, fused, status, started_at, finished_at FROM runs ORDER BY started_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row: tuple) -> Dict[str, Any]:
+        run_id, per_video, fused, status, started_at, finished_at = row
+        return {"run_id": run_id, "per_video": bool(per_video), "fused": bool(fused), "status": status,
+                "started_at": started_at, "finished_at": finished_at}
+
+_registry: Optional[RunRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_run_registry() -> RunRegistry:
+    """Returns the process-wide run registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RunRegistry()
+        return _registry
+
+def delete_run(run_id: str) -> None:
+    """Deletes the checkpoints and the registry entry of a run; it can no longer be resumed."""
+    with open_checkpointer() as checkpointer:
+        checkpointer.delete_thread(run_id)
+    get_run_registry().delete(run_id)
+
+def list_runs(limit: int = 20) -> None:
+    """Prints the most recent runs with their status."""
+    runs = get_run_registry().recent(limit)
+    if not runs:
+        print("[⚠️] No runs recorded yet.")
+        return
+    for run in runs:
+        mode = ("per-video" if run["per_video"] else "staged barriers") + (", fused" if run["fused"] else "")
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started_at"]))
+        print(f"  {run['run_id']}  {run['status']:<9}  started {started}  ({mode})")
@@ -0,0 +1,274 @@
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+import numpy as np
+from rich import print
+from utils.audio import FFMPEG_BINARY, ffmpeg_available
+from utils.results import get_result_store
+from utils.settings import DATA_DIR, load_settings
+from utils.storage import media_plan
+
+load_settings()
+
+# Reuse the transcript and frame analysis of an earlier copy of the same creative
+CREATIVE_DEDUP = os.getenv("CREATIVE_DEDUP", "1") == "1"
+
+# Frames sampled at evenly spaced timestamps for the visual fingerprint
+FINGERPRINT_FRAMES = 16
+
+# Stages whose results depend on the soundtrack: a copy only reuses them if
+# its audio fingerprint matches (or the files are identical), since the same
+# footage is often cut with another voiceover. Stages after them hit the
+# content-keyed result cache on their own.
+AUDIO_STAGES = {"transcribe"}
+
+# Two videos are one creative when their durations are this close, their
+# sampled frames typically (the median over frames, so a sample that lands
+# on the other side of a cut does not count) differ by at most this many of
+# 64 dHash bits and by at most this many levels in their 4x4 colour
+# thumbnails (dHash ignores colour), and (if both have sound) at most this
+# share of their audio bits differ
+MAX_DURATION_DELTA_SECONDS = float(os.getenv("CREATIVE_MAX_DURATION_DELTA", "1.0"))
+MAX_FRAME_DISTANCE = float(os.getenv("CREATIVE_MAX_FRAME_DISTANCE", "8"))
+MAX_COLOUR_DISTANCE = float(os.getenv("CREATIVE_MAX_COLOUR_DISTANCE", "12"))
+MAX_AUDIO_BIT_ERRORS = float(os.getenv("CREATIVE_MAX_AUDIO_BIT_ERRORS", "0.2"))
+
+# Audio fingerprint: mono 8 kHz, one 16-bit word per 0.5 s window comparing
+# the energy of 17 log-spaced bands between neighbouring bands and windows
+AUDIO_RATE = 8000
+AUDIO_WINDOW = 4096
+AUDIO_BANDS = np.geomspace(300, 3000, 18)
+
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+CREATIVES_DB_PATH = CACHE_DIR / "creatives.sqlite"
+
+def visual_fingerprint(video_path: Path) -> Optional[tuple]:
+    """
+    Returns (duration in seconds, packed dHashes and 4x4 colour thumbnails of
+    FINGERPRINT_FRAMES frames sampled at evenly spaced timestamps), or None
+    for unreadable videos.
+    Sampling by time, not frame number, keeps re-encodes at another frame
+    rate comparable.
+    """
+    import cv2
+    from utils.keyframes import dhash
+
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        total = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        if fps <= 0 or total <= 0:
+            return None
+        duration = total / fps
+        frames = []
+        for i in range(FINGERPRINT_FRAMES):
+            capture.set(cv2.CAP_PROP_POS_MSEC, (i + 0.5) / FINGERPRINT_FRAMES * duration * 1000)
+            ret, frame = capture.read()
+            if ret:
+                frames.append(frame)
+    finally:
+        capture.release()
+    if len(frames) < FINGERPRINT_FRAMES:
+        return None
+    colours = np.stack([cv2.resize(frame, (4, 4), interpolation=cv2.INTER_AREA) for frame in frames])
+    return duration, dhash(frames).tobytes(), colours.tobytes()
+
+def audio_fingerprint(video_path: Path) -> Optional[bytes]:
+    """Returns the audio fingerprint of a video, or None without ffmpeg or sound."""
+    if not ffmpeg_available():
+        return None
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-i", str(video_path), "-vn", "-ac", "1",
+         "-ar", str(AUDIO_RATE), "-f", "s16le", "-"],
+        capture_output=True,
+    )
+    samples = np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32)
+    windows = len(samples) // AUDIO_WINDOW
+    if result.returncode != 0 or windows < 2:
+        return None
+
+    spectrum = np.abs(np.fft.rfft(samples[:windows * AUDIO_WINDOW].reshape(windows, AUDIO_WINDOW), axis=1)) ** 2
+    edges = np.searchsorted(np.fft.rfftfreq(AUDIO_WINDOW, 1 / AUDIO_RATE), AUDIO_BANDS)
+    energy = np.stack([spectrum[:, lo:hi].sum(axis=1) for lo, hi in zip(edges[:-1], edges[1:])], axis=1)
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    return np.packbits(bits, axis=1).tobytes()
+
+def bit_distance(a: bytes, b: bytes) -> int:
+    return int(np.unpackbits(np.frombuffer(a, dtype=np.uint8) ^ np.frombuffer(b, dtype=np.uint8)).sum())
+
+def frame_distances(a: Dict[str, Any], b: Dict[str, Any]) -> tuple:
+    """Returns the median dHash bit distance and colour distance of two sequences of sampled frames."""
+    hashes = np.unpackbits(np.frombuffer(a["frames"], dtype=np.uint8) ^ np.frombuffer(b["frames"], dtype=np.uint8))
+    colours = np.abs(np.frombuffer(a["colours"], dtype=np.uint8).astype(np.int16) - np.frombuffer(b["colours"], dtype=np.uint8))
+    return (float(np.median(hashes.reshape(FINGERPRINT_FRAMES, -1).sum(axis=1))),
+            float(np.median(colours.reshape(FINGERPRINT_FRAMES, -1).mean(axis=1))))
+
+def same_creative(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Compares two fingerprints (dicts with "duration", "frames", "colours", "audio")."""
+    if abs(a["duration"] - b["duration"]) > MAX_DURATION_DELTA_SECONDS:
+        return False
+    hash_distance, colour_distance = frame_distances(a, b)
+    if hash_distance > MAX_FRAME_DISTANCE or colour_distance > MAX_COLOUR_DISTANCE:
+        return False
+    if a["audio"] is None and b["audio"] is None:
+        return True
+    return same_audio(a["audio"], b["audio"])
+
+def same_audio(a: Optional[bytes], b: Optional[bytes]) -> bool:
+    """True if both audio fingerprints exist and at most MAX_AUDIO_BIT_ERRORS of their bits differ."""
+    if a is None or b is None:
+        return False
+    length = min(len(a), len(b))
+    return length > 0 and bit_distance(a[:length], b[:length]) / (length * 8) <= MAX_AUDIO_BIT_ERRORS
+
+class CreativeIndex:
+    """
+    Fingerprint index of downloaded videos. Every video belongs to one
+    creative, named after the first video seen with it (its canonical
+    video); re-uploads of the same creative under new video ids join it.
+    """
+
+    def __init__(self, db_path: Path = CREATIVES_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS videos (
+                video TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                duration REAL NOT NULL,
+                frames BLOB NOT NULL,
+                colours BLOB NOT NULL,
+                audio BLOB,
+                canonical TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS videos_duration ON videos(duration);
+            CREATE INDEX IF NOT EXISTS videos_canonical ON videos(canonical);
+        """)
+
+    def canonical(self, video: str) -> Optional[str]:
+        """Returns the canonical video of `video`'s creative, or None if it is not indexed."""
+        with self.lock:
+            row = self.conn.execute("SELECT canonical FROM videos WHERE video = ?", (video,)).fetchone()
+        return row[0] if row else None
+
+    def same_soundtrack(self, video: str, other: str) -> bool:
+        """
+        True if two indexed videos are identical files or both have matching
+        audio fingerprints. Without ffmpeg there are none, and only identical
+        files count.
+        """
+        with self.lock:
+            rows = dict(
+                (row[0], row[1:]) for row in self.conn.execute(
+                    "SELECT video, sha256, audio FROM videos WHERE video IN (?, ?)", (video, other)
+                ).fetchall()
+            )
+        if video not in rows or other not in rows:
+            return False
+        (sha256, audio), (other_sha256, other_audio) = rows[video], rows[other]
+        return sha256 == other_sha256 or same_audio(audio, other_audio)
+
+    def match(self, fingerprint: Dict[str, Any], sha256: str, video: str) -> Optional[str]:
+        """Returns the canonical video of an indexed creative matching `fingerprint`, or None."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT video, sha256, duration, frames, colours, audio, canonical FROM videos "
+                "WHERE video != ? AND duration BETWEEN ? AND ? ORDER BY indexed_at",
+                (video, fingerprint["duration"] - MAX_DURATION_DELTA_SECONDS, fingerprint["duration"] + MAX_DURATION_DELTA_SECONDS),
+            ).fetchall()
+        for _, other_sha256, duration, frames, colours, audio, canonical in rows:
+            other = {"duration": duration, "frames": frames, "colours": colours, "audio": audio}
+            if other_sha256 == sha256 or same_creative(fingerprint, other):
+                return canonical
+        return None
+
+    def add(self, video: str, path: Path, sha256: str) -> Optional[str]:
+        """
+        Fingerprints a downloaded video unless it is indexed with this content
+        already, and files it under a matching creative or a new one.
+
+        Returns:
+            str: The canonical video of its creative, or None if it could not be fingerprinted.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT sha256, canonical FROM videos WHERE video = ?", (video,)).fetchone()
+        if row and row[0] == sha256:
+            return row[1]
+
+        visual = visual_fingerprint(path)
+        if visual is None:
+            return None
+        fingerprint = {"duration": visual[0], "frames": visual[1], "colours": visual[2], "audio": audio_fingerprint(path)}
+        canonical = self.match(fingerprint, sha256, video) or video
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO videos (video, sha256, duration, frames, colours, audio, canonical, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video, sha256, fingerprint["duration"], fingerprint["frames"], fingerprint["colours"],
+                 fingerprint["audio"], canonical, time.time()),
+            )
+        return canonical
+
+    def groups(self) -> Dict[str, list]:
+        """Returns canonical video -> every video of its creative, for creatives with copies."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT canonical, video FROM videos WHERE canonical IN "
+                "(SELECT canonical FROM videos GROUP BY canonical HAVING COUNT(*) > 1) ORDER BY canonical, indexed_at"
+            ).fetchall()
+        groups = {}
+        for canonical, video in rows:
+            groups.setdefault(canonical, []).append(video)
+        return groups
+
+_index: Optional[CreativeIndex] = None
+_index_lock = threading.Lock()
+
+def get_creative_index() -> CreativeIndex:
+    """Returns the process-wide creative index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CreativeIndex()
+        return _index
+
+def reuse_result(video: str, stage: str) -> Optional[Any]:
+    """
+    Returns the stored `stage` result ("transcribe" or "analyze_frames") of
+    an earlier copy of `video`'s creative, if that result is up to date
+    under the current stage parameters; otherwise None. Results of
+    AUDIO_STAGES are only reused when the soundtracks match too.
+    """
+    if not CREATIVE_DEDUP:
+        return None
+    index = get_creative_index()
+    canonical = index.canonical(video)
+    if not canonical or canonical == video or media_plan(canonical)[stage] != "up to date":
+        return None
+    if stage in AUDIO_STAGES and not index.same_soundtrack(video, canonical):
+        return None
+    result = get_result_store().get(canonical, stage)
+    if result:
+        print(f"[🧬] {video}: reusing the {stage} result of {canonical} (same creative)")
+    return result
+
+def print_creative_groups() -> None:
+    """Lists the creatives uploaded under several video ids, with their ads."""
+    store = get_result_store()
+    groups = get_creative_index().groups()
+    if not groups:
+        print("[🧬] No creative is used under more than one video id.")
+        return
+    print(f"[🧬] {len(groups)} creatives used under several video ids:")
+    for canonical, videos in groups.items():
+        ads = sorted({ad for row in store.query(stage="analyze_ad", video_ids=videos) for ad in row["ad_ids"]})
+        print(f"  {canonical}: {len(videos)} videos ({', '.join(videos)}), {len(ads)} ads")
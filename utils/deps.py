@@ -0,0 +1,182 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+from utils.results import get_result_store
+from utils.settings import DATA_DIR
+from utils.storage import get_storage_manager
+
+# Per-video stage records live next to the result cache
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+DEPS_DB_PATH = CACHE_DIR / "deps.sqlite"
+
+# Stage -> upstream stages, mirroring the graph edges
+STAGE_DEPENDENCIES = {
+    "download": [],
+    "transcribe": ["download"],
+    "extract_frames": ["download"],
+    "analyze_transcription": ["transcribe"],
+    "analyze_frames": ["extract_frames"],
+    "analyze_ad": ["analyze_transcription", "analyze_frames"],
+}
+
+# In fused mode the final analysis reads the raw transcript and also writes
+# the transcript analysis
+FUSED_STAGE_DEPENDENCIES = {
+    "download": [],
+    "transcribe": ["download"],
+    "extract_frames": ["download"],
+    "analyze_frames": ["extract_frames"],
+    "analyze_ad": ["transcribe", "analyze_frames"],
+}
+
+def stage_fingerprint(stage: str, params: Dict[str, Any], inputs: list) -> str:
+    """
+    Fingerprints one stage run from its parameters and the content digests of
+    its input artifact handles. Any change to either makes the stage stale.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"stage": stage, "params": params}, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    for sha256 in sorted(handle["sha256"] for handle in inputs):
+        digest.update(sha256.encode("ascii"))
+    return digest.hexdigest()
+
+class DependencyTracker:
+    """
+    Records, per video and stage, the input fingerprint a stage last ran with
+    and the artifact handles it produced (make-style targets).
+
+    A stage is up to date when its fingerprint is unchanged and every recorded
+    output still exists with the same size and mtime (files) or digest (rows
+    of the result store), so checking costs a stat() or an indexed lookup per
+    output and no hashing. Files the storage manager evicted count as unchanged.
+    """
+
+    def __init__(self, db_path: Path = DEPS_DB_PATH):
+        self.lock = threading.Lock()
+        self.session_stats: Dict[str, Dict[str, int]] = {}
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                video TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (video, stage)
+            )
+        """)
+
+    def recorded(self, video: str, stage: str) -> Optional[tuple]:
+        """Returns (fingerprint, output handles with mtimes) from the last run, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fingerprint, outputs FROM stages WHERE video = ? AND stage = ?", (video, stage)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def lookup(self, video: str, stage: str, fingerprint: str, count: bool = True) -> Optional[list]:
+        """
+        Returns the recorded output handles if the stage is up to date for
+        `fingerprint`, otherwise None.
+        """
+        record = self.recorded(video, stage)
+        fresh = record is not None and record[0] == fingerprint and all(outputs_unchanged(record[1]))
+        if count:
+            counters = self.session_stats.setdefault(stage, {"fresh": 0, "stale": 0})
+            counters["fresh" if fresh else "stale"] += 1
+        if not fresh:
+            return None
+        return [{key: value for key, value in handle.items() if key != "mtime_ns"} for handle in record[1]]
+
+    def record(self, video: str, stage: str, fingerprint: str, outputs: list) -> None:
+        """Stores the fingerprint and output handles of a completed stage run."""
+        stamped = []
+        for handle in outputs:
+            if "stage" in handle:
+                stamped.append(handle)
+                continue
+            stat = Path(handle["path"]).stat()
+            stamped.append({**handle, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stages (video, stage, fingerprint, outputs, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (video, stage, fingerprint, json.dumps(stamped, ensure_ascii=False), time.time()),
+            )
+
+def outputs_unchanged(handles: list):
+    for handle in handles:
+        if "stage" in handle:
+            yield get_result_store().digest(handle["id"], handle["stage"]) == handle["sha256"]
+            continue
+        try:
+            stat = Path(handle["path"]).stat()
+        except OSError:
+            yield get_storage_manager().is_evicted(handle["path"])
+            continue
+        yield stat.st_size == handle["size"] and stat.st_mtime_ns == handle.get("mtime_ns")
+
+_tracker: Optional[DependencyTracker] = None
+_tracker_lock = threading.Lock()
+
+def get_dependency_tracker() -> DependencyTracker:
+    """Returns the process-wide dependency tracker shared by all nodes."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = DependencyTracker()
+        return _tracker
+
+def check_stage(video: str, stage: str, params: Dict[str, Any], inputs: list) -> tuple:
+    """
+    Fingerprints a stage run for one video and looks it up.
+
+    Returns:
+        tuple: (fingerprint, recorded output handles if up to date else None)
+    """
+    fingerprint = stage_fingerprint(stage, params, inputs)
+    return fingerprint, get_dependency_tracker().lookup(video, stage, fingerprint)
+
+def split_fresh(jobs: list) -> tuple:
+    """
+    Splits prepared jobs (dicts with a "fresh" entry from check_stage) into the
+    recorded output handles of up-to-date jobs and the jobs that must run.
+    """
+    fresh = [handle for job in jobs if job.get("fresh") for handle in job["fresh"]]
+    return fresh, [job for job in jobs if not job.get("fresh")]
+
+def plan_video(video: str, dependencies: Dict[str, list], stage_params: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Works out which stages a run would execute for one video, without running
+    anything. A stage whose upstream would run is stale as well, because its
+    inputs are not known yet.
+
+    Returns:
+        dict: stage -> "up to date", "stale" or "new", in pipeline order.
+    """
+    tracker = get_dependency_tracker()
+    plan = {}
+    outputs = {}
+
+    for stage, upstream in dependencies.items():
+        record = tracker.recorded(video, stage)
+        if record is None:
+            plan[stage] = "new"
+            continue
+        if any(plan[dep] != "up to date" for dep in upstream):
+            plan[stage] = "stale"
+            continue
+
+        inputs = [handle for dep in upstream for handle in outputs[dep]]
+        fresh = tracker.lookup(video, stage, stage_fingerprint(stage, stage_params.get(stage, {}), inputs), count=False)
+        plan[stage] = "up to date" if fresh is not None else "stale"
+        if fresh is not None:
+            outputs[stage] = fresh
+
+    return plan
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from utils.tracing import map_in_context, record_call
+
+# Worker count, global bandwidth cap (0 = unlimited) and resume attempts
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_MAX_BYTES_PER_SEC = int(os.getenv("DOWNLOAD_MAX_BYTES_PER_SEC", "0"))
+DOWNLOAD_ATTEMPTS = int(os.getenv("DOWNLOAD_ATTEMPTS", "3"))
+
+# Re-hash cached files on every run instead of trusting the recorded size
+VERIFY_CACHED = os.getenv("DOWNLOAD_VERIFY_CACHED", "0") == "1"
+
+# Adaptive chunk sizing: grow while chunks arrive fast, shrink when they are slow
+MIN_CHUNK = 64 * 1024
+START_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+FAST_CHUNK_SECONDS = 0.05
+SLOW_CHUNK_SECONDS = 1.0
+
+class DownloadError(Exception):
+    """Raised when a download cannot be completed or fails verification."""
+
+class BandwidthLimiter:
+    """Token bucket shared by all download threads."""
+
+    def __init__(self, bytes_per_sec: int):
+        self.rate = bytes_per_sec
+        self.tokens = float(bytes_per_sec)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+def meta_path(path: Path) -> Path:
+    return path.with_name(path.name + ".meta.json")
+
+def part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+def looks_like_mp4(path: Path) -> bool:
+    """Checks for the ISO-BMFF 'ftyp' box that starts every MP4 file."""
+    with open(path, "rb") as f:
+        header = f.read(12)
+    return len(header) >= 8 and header[4:8] == b"ftyp"
+
+def read_verified(path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Returns the recorded {"size", "sha256"} of a completed download if the file
+    still matches it, else None. Files without a sidecar are never trusted.
+    """
+    meta_file = meta_path(path)
+    if not path.exists() or not meta_file.exists():
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if path.stat().st_size != meta.get("size"):
+        return None
+    if VERIFY_CACHED:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(MAX_CHUNK), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != meta.get("sha256"):
+            return None
+    return meta
+
+class DownloadManager:
+    """
+    Downloads files concurrently over a shared connection pool. At most
+    `max_workers` downloads run at once across all callers, which matches the
+    size of the connection pool.
+
+    Each download streams into `<name>.part`, resumes with an HTTP Range request
+    after an interruption, is checked against Content-Length (and the MP4 header)
+    and is atomically renamed into place. A `<name>.meta.json` sidecar records the
+    size and SHA-256 so later runs can tell complete files from partial ones.
+    """
+
+    def __init__(self, max_workers: int = DOWNLOAD_WORKERS, max_bytes_per_sec: int = DOWNLOAD_MAX_BYTES_PER_SEC):
+        self.max_workers = max_workers
+        self.limiter = BandwidthLimiter(max_bytes_per_sec)
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _attempt(self, url: str, part: Path, digest: Any) -> tuple:
+        """
+        Streams the remainder of `url` into `part`, updating `digest`.
+        Returns (expected total size or -1, digest of the whole file so far).
+        """
+        offset = part.stat().st_size if part.exists() else 0
+        # Content-Length and Range count the bytes on the wire, so ask for them unencoded
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        with self.session.get(url, stream=True, timeout=(10, 60), headers=headers) as response:
+            if response.status_code == 416:
+                # Range not satisfiable: the .part is already complete (or bogus)
+                return offset, digest
+            response.raise_for_status()
+
+            if offset and response.status_code != 206:
+                # Server ignored the Range header, start over
+                offset = 0
+                digest = hashlib.sha256()
+                part.unlink(missing_ok=True)
+
+            length = response.headers.get("Content-Length")
+            expected = offset + int(length) if length is not None else -1
+
+            # A server that encodes the body anyway: decode it, which leaves its
+            # length unknown and an encoded range unusable (the next attempt starts over)
+            encoded = response.headers.get("Content-Encoding", "identity").lower() != "identity"
+            if encoded:
+                expected = -1
+                if response.status_code == 206:
+                    part.unlink(missing_ok=True)
+                    raise requests.exceptions.ContentDecodingError("encoded partial response")
+
+            chunk_size = START_CHUNK
+            with open(part, "ab") as f:
+                while True:
+                    started = time.monotonic()
+                    chunk = response.raw.read(chunk_size, decode_content=encoded)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    digest.update(chunk)
+                    self.limiter.consume(len(chunk))
+
+                    elapsed = time.monotonic() - started
+                    if elapsed < FAST_CHUNK_SECONDS and chunk_size < MAX_CHUNK:
+                        chunk_size *= 2
+                    elif elapsed > SLOW_CHUNK_SECONDS and chunk_size > MIN_CHUNK:
+                        chunk_size //= 2
+
+        return expected, digest
+
+    def fetch(self, url: str, dest: Path) -> Dict[str, Any]:
+        """
+        Downloads `url` to `dest` unless a verified copy already exists.
+
+        Returns:
+            dict: {"path", "size", "sha256", "cached"}
+
+        Raises:
+            DownloadError: If the download fails after DOWNLOAD_ATTEMPTS, fails
+                verification or cannot be written to disk.
+        """
+        dest = Path(dest)
+        # Per-video sub-runs each call in with one job, so the limit lives here
+        with self.slots:
+            started = time.perf_counter()
+            try:
+                return self._fetch(url, dest, started)
+            except OSError as e:
+                # A full or read-only disk fails this download, not the whole batch
+                record_call("download", time.perf_counter() - started, video=dest.stem, status="error", error=str(e))
+                raise DownloadError(f"{dest.name}: {e}") from e
+
+    def _fetch(self, url: str, dest: Path, started: float) -> Dict[str, Any]:
+        cached = read_verified(dest)
+        if cached:
+            record_call("download", time.perf_counter() - started, video=dest.stem, cached=True, bytes_down=0, status="ok")
+            return {"path": str(dest), "size": cached["size"], "sha256": cached["sha256"], "cached": True}
+
+        part = part_path(dest)
+        resumed_from = part.stat().st_size if part.exists() else 0
+        last_error = None
+
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            # Hash what is already on disk so a resumed download still gets a full digest
+            digest = hashlib.sha256()
+            if part.exists():
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(MAX_CHUNK), b""):
+                        digest.update(chunk)
+            try:
+                expected, digest = self._attempt(url, part, digest)
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+                # Keep the .part file, the next attempt resumes from where this one stopped
+                last_error = e
+                time.sleep(min(2 ** attempt, 10))
+                continue
+
+            size = part.stat().st_size if part.exists() else 0
+            if expected >= 0 and size != expected:
+                last_error = DownloadError(f"got {size} of {expected} bytes")
+                if size > expected:
+                    part.unlink(missing_ok=True)
+                continue
+            if size == 0 or not looks_like_mp4(part):
+                part.unlink(missing_ok=True)
+                record_call("download", time.perf_counter() - started, video=dest.stem, retries=attempt - 1, status="error", error="not a valid MP4")
+                raise DownloadError(f"{dest.name}: downloaded file is not a valid MP4")
+
+            sha256 = digest.hexdigest()
+            os.replace(part, dest)
+            with open(meta_path(dest), "w", encoding="utf-8") as f:
+                json.dump({"size": size, "sha256": sha256}, f)
+            record_call("download", time.perf_counter() - started, video=dest.stem, cached=False,
+                        retries=attempt - 1, bytes_down=size - resumed_from, status="ok")
+            return {"path": str(dest), "size": size, "sha256": sha256, "cached": False}
+
+        record_call("download", time.perf_counter() - started, video=dest.stem, retries=DOWNLOAD_ATTEMPTS - 1,
+                    status="error", error=str(last_error))
+        raise DownloadError(f"{dest.name}: failed after {DOWNLOAD_ATTEMPTS} attempts: {last_error}")
+
+    def fetch_all(self, jobs: list) -> list:
+        """
+        Downloads (url, dest) pairs on the worker pool.
+
+        Returns:
+            list: One result dict or DownloadError per job, in job order.
+        """
+        def run(job):
+            try:
+                return self.fetch(*job)
+            except DownloadError as e:
+                return e
+
+        if len(jobs) <= 1:
+            return [run(job) for job in jobs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return map_in_context(pool, run, jobs)
+
+_manager: Optional[DownloadManager] = None
+_manager_lock = threading.Lock()
+
+def get_download_manager() -> DownloadManager:
+    """Returns the process-wide manager, so the download slots, connection pool and bandwidth cap are shared by every sub-run."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DownloadManager()
+        return _manager
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from typing import Dict, Any, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils.settings import load_settings
+from utils.tracing import record_call
+
+load_settings()
+
+ACCESS_TOKEN = os.getenv("FB_ACCESS_TOKEN")
+GRAPH_API_URL = os.getenv("FB_GRAPH_API_URL", "https://graph.facebook.com/v19.0").rstrip("/")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide keep-alive session used for Graph API calls.
+    Transient 5xx responses are retried with backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=("GET",),
+            )
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+            session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+            _session = session
+        return _session
+
+def traced_get(url: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30) -> requests.Response:
+    """GETs `url` on the shared session and records the call (path only, never the token) in the run trace."""
+    started = time.perf_counter()
+    try:
+        response = get_session().get(url, params=params, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        record_call("graph_api", time.perf_counter() - started, endpoint=urlparse(url).path, status="error", error=str(e))
+        raise
+    record_call(
+        "graph_api",
+        time.perf_counter() - started,
+        endpoint=urlparse(response.url).path,
+        http_status=response.status_code,
+        bytes_down=len(response.content),
+        status="ok" if response.ok else "error",
+    )
+    return response
+
+def graph_get(path: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30) -> Dict[str, Any]:
+    """
+    GETs a Graph API path (e.g. "act_123/ads") and returns the decoded JSON body.
+
+    Raises:
+        requests.exceptions.RequestException: On network errors or non-2xx responses.
+    """
+    params = {"access_token": ACCESS_TOKEN, **(params or {})}
+    response = traced_get(f"{GRAPH_API_URL}/{path.lstrip('/')}", params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+def graph_paginate(path: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30) -> Iterator[list]:
+    """
+    Yields the "data" list of every page of a Graph API edge, following `paging.next`
+    cursors until the last page.
+    """
+    page = graph_get(path, params, timeout=timeout)
+    while True:
+        yield page.get("data", [])
+
+        next_url = page.get("paging", {}).get("next")
+        if not next_url:
+            return
+
+        # The next URL already carries the access token, fields and cursor
+        response = traced_get(next_url, timeout=timeout)
+        response.raise_for_status()
+        page = response.json()
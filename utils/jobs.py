@@ -0,0 +1,366 @@
+import hmac
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, Optional
+from utils.settings import DATA_DIR, load_settings
+
+load_settings()
+
+# "" keeps the queue in the local data directory; "sqlite:///path/jobs.sqlite"
+# puts it elsewhere; "http://host:8790" uses a queue server (main.py queue-server),
+# so workers on other hosts share it
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "")
+
+# Shared secret between the queue server and its clients (sent as a bearer
+# token); required when the server listens on a non-loopback interface
+JOB_QUEUE_TOKEN = os.getenv("JOB_QUEUE_TOKEN", "")
+
+# A leased job returns to the queue if its worker stops renewing the lease
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Failed attempts wait RETRY_BASE_SECONDS * 2**(attempt - 1) before the next one
+RETRY_BASE_SECONDS = 5
+
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+JOBS_DB_PATH = CACHE_DIR / "jobs.sqlite"
+
+class JobQueue(ABC):
+    """
+    Durable job queue with leases, in the shape of a Redis-backed queue:
+
+    - enqueue() adds a job under a caller-chosen id; enqueueing an existing id is a no-op.
+    - lease() hands the oldest available job to one worker until its lease expires.
+    - heartbeat() renews a lease; complete() and fail() end an attempt.
+    - release() hands a leased job back untried, e.g. when its worker stops.
+    - A job whose lease expires is handed out again, up to max_attempts.
+    - complete() is idempotent: the first result of a job is kept.
+
+    Jobs are dicts {"id", "queue", "status", "payload", "result", "error",
+    "attempts", "token"}; status is "queued", "leased", "done" or "failed".
+
+    The queue also keeps rate limits shared by every worker process on every
+    host (reserve() and settle(), token buckets like utils.openai_client.RateLimiter),
+    so N workers together stay within one account's limits.
+    """
+
+    @abstractmethod
+    def enqueue(self, queue: str, job_id: str, payload: Dict[str, Any], max_attempts: int = JOB_MAX_ATTEMPTS) -> bool: ...
+
+    @abstractmethod
+    def lease(self, queue: str, worker: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, token: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool: ...
+
+    @abstractmethod
+    def complete(self, job_id: str, token: str, result: Any) -> bool: ...
+
+    @abstractmethod
+    def fail(self, job_id: str, token: str, error: str, retry: bool = True) -> Optional[str]: ...
+
+    @abstractmethod
+    def release(self, job_id: str, token: str) -> bool: ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def stats(self, queue: Optional[str] = None) -> Dict[str, int]: ...
+
+    @abstractmethod
+    def reserve(self, limit: str, tokens: int, rpm: int, tpm: int) -> float:
+        """Reserves one request and `tokens` tokens of the shared limit `limit`; returns seconds to wait before sending."""
+
+    @abstractmethod
+    def settle(self, limit: str, tokens: int) -> None:
+        """Returns `tokens` to the shared limit `limit` (negative to take more) once a request's real usage is known."""
+
+class SqliteJobQueue(JobQueue):
+    """JobQueue in a SQLite database; safe for any number of processes on one host."""
+
+    def __init__(self, db_path: Path = JOBS_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                queue TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                worker TEXT,
+                token TEXT,
+                lease_expires REAL,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_available ON jobs(queue, status, available_at);
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                requests REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+
+    def enqueue(self, queue: str, job_id: str, payload: Dict[str, Any], max_attempts: int = JOB_MAX_ATTEMPTS) -> bool:
+        now = time.time()
+        with self.lock:
+            return self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, queue, status, payload, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, queue, json.dumps(payload, ensure_ascii=False), max_attempts, now, now, now),
+            ).rowcount == 1
+
+    def lease(self, queue: str, worker: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Leases that ran out on their last attempt fail instead of being handed out again
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                    "WHERE queue = ? AND status = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                    (now, queue, now),
+                )
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE queue = ? AND ((status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'leased' AND lease_expires < ?)) ORDER BY available_at, created_at LIMIT 1",
+                    (queue, now, now),
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                token = uuid.uuid4().hex
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, token = ?, "
+                    "lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (worker, token, now + lease_seconds, now, row[0]),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0])
+
+    def heartbeat(self, job_id: str, token: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND token = ? AND status = 'leased'",
+                (time.time() + lease_seconds, time.time(), job_id, token),
+            ).rowcount == 1
+
+    def complete(self, job_id: str, token: str, result: Any) -> bool:
+        # Any attempt may complete a job that is not done yet: the work is
+        # idempotent, and a worker whose lease was taken over still finished it
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, token = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'leased')",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id),
+            ).rowcount == 1
+
+    def fail(self, job_id: str, token: str, error: str, retry: bool = True) -> Optional[str]:
+        """Ends a failed attempt; returns the job's new status, or None if the lease was lost."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND token = ? AND status = 'leased'", (job_id, token)
+            ).fetchone()
+            if row is None:
+                return None
+            attempts, max_attempts = row
+            if retry and attempts < max_attempts:
+                status, available_at = "queued", now + RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            else:
+                status, available_at = "failed", now
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, token = NULL, available_at = ?, updated_at = ? WHERE id = ?",
+                (status, error, available_at, now, job_id),
+            )
+        return status
+
+    def release(self, job_id: str, token: str) -> bool:
+        """Requeues a leased job at once and gives back its attempt; False if the lease was lost."""
+        now = time.time()
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), token = NULL, "
+                "lease_expires = NULL, available_at = ?, updated_at = ? WHERE id = ? AND token = ? AND status = 'leased'",
+                (now, now, job_id, token),
+            ).rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, queue, status, payload, result, error, attempts, token FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, queue, status, payload, result, error, attempts, token = row
+        return {"id": job_id, "queue": queue, "status": status, "payload": json.loads(payload),
+                "result": json.loads(result) if result else None, "error": error, "attempts": attempts, "token": token}
+
+    def stats(self, queue: Optional[str] = None) -> Dict[str, int]:
+        sql = "SELECT status, COUNT(*) FROM jobs" + (" WHERE queue = ?" if queue else "") + " GROUP BY status"
+        with self.lock:
+            return dict(self.conn.execute(sql, (queue,) if queue else ()).fetchall())
+
+    def reserve(self, limit: str, tokens: int, rpm: int, tpm: int) -> float:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT requests, tokens, updated_at FROM rate_limits WHERE name = ?", (limit,)
+                ).fetchone()
+                requests, available, updated_at = row or (float(rpm), float(tpm), now)
+                elapsed = max(0.0, now - updated_at)
+                requests = min(rpm, requests + elapsed * rpm / 60) - 1
+                available = min(tpm, available + elapsed * tpm / 60) - tokens
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (name, requests, tokens, updated_at) VALUES (?, ?, ?, ?)",
+                    (limit, requests, available, now),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        wait_requests = -requests * 60 / rpm if requests < 0 else 0.0
+        wait_tokens = -available * 60 / tpm if available < 0 and tpm > 0 else 0.0
+        return max(wait_requests, wait_tokens)
+
+    def settle(self, limit: str, tokens: int) -> None:
+        with self.lock:
+            self.conn.execute("UPDATE rate_limits SET tokens = tokens + ? WHERE name = ?", (tokens, limit))
+
+# Methods the queue server exposes
+QUEUE_METHODS = ("enqueue", "lease", "heartbeat", "complete", "fail", "release", "get", "stats", "reserve", "settle")
+
+class HttpJobQueue(JobQueue):
+    """JobQueue client for a queue server (see serve_job_queue) on another host."""
+
+    def __init__(self, base_url: str, token: str = JOB_QUEUE_TOKEN):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def call(self, method: str, **kwargs) -> Any:
+        response = self.session.post(f"{self.base_url}/{method}", json=kwargs, timeout=30)
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def enqueue(self, queue, job_id, payload, max_attempts=JOB_MAX_ATTEMPTS):
+        return self.call("enqueue", queue=queue, job_id=job_id, payload=payload, max_attempts=max_attempts)
+
+    def lease(self, queue, worker, lease_seconds=JOB_LEASE_SECONDS):
+        return self.call("lease", queue=queue, worker=worker, lease_seconds=lease_seconds)
+
+    def heartbeat(self, job_id, token, lease_seconds=JOB_LEASE_SECONDS):
+        return self.call("heartbeat", job_id=job_id, token=token, lease_seconds=lease_seconds)
+
+    def complete(self, job_id, token, result):
+        return self.call("complete", job_id=job_id, token=token, result=result)
+
+    def fail(self, job_id, token, error, retry=True):
+        return self.call("fail", job_id=job_id, token=token, error=error, retry=retry)
+
+    def release(self, job_id, token):
+        return self.call("release", job_id=job_id, token=token)
+
+    def get(self, job_id):
+        return self.call("get", job_id=job_id)
+
+    def stats(self, queue=None):
+        return self.call("stats", queue=queue)
+
+    def reserve(self, limit, tokens, rpm, tpm):
+        return self.call("reserve", limit=limit, tokens=tokens, rpm=rpm, tpm=tpm)
+
+    def settle(self, limit, tokens):
+        return self.call("settle", limit=limit, tokens=tokens)
+
+def open_job_queue(url: str = JOB_QUEUE_URL) -> JobQueue:
+    """Opens the queue named by `url` (see JOB_QUEUE_URL)."""
+    if url.startswith(("http://", "https://")):
+        return HttpJobQueue(url)
+    if url.startswith("sqlite:///"):
+        return SqliteJobQueue(Path(url.removeprefix("sqlite:///")))
+    return SqliteJobQueue()
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Returns the process-wide job queue."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = open_job_queue()
+        return _queue
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def serve_job_queue(queue: JobQueue, host: str = "127.0.0.1", port: int = 8790, token: str = JOB_QUEUE_TOKEN) -> ThreadingHTTPServer:
+    """
+    Serves `queue` over HTTP (POST /{method} with keyword arguments as JSON),
+    so workers on other hosts can use it through HttpJobQueue. With `token`,
+    requests must carry it as a bearer token.
+
+    Raises:
+        ValueError: If `host` is not a loopback interface and no token is set.
+    """
+    if not token and not is_loopback(host):
+        raise ValueError(f"set JOB_QUEUE_TOKEN to serve the job queue on {host}; anyone who reaches it could run or forge jobs")
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            method = self.path.strip("/")
+            try:
+                if token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                    raise PermissionError("missing or wrong JOB_QUEUE_TOKEN")
+                if method not in QUEUE_METHODS:
+                    raise ValueError(f"unknown method {method!r}")
+                kwargs = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                body, status = {"result": getattr(queue, method)(**kwargs)}, 200
+            except PermissionError as e:
+                body, status = {"error": str(e)}, 401
+            except (ValueError, TypeError) as e:
+                body, status = {"error": str(e)}, 400
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+def dhash(frames: list, hash_size: int = 8) -> np.ndarray:
+    """
+    Computes difference hashes for a batch of BGR frames.
+
+    Each frame is reduced to a (hash_size x hash_size+1) grayscale thumbnail and
+    every bit records whether a pixel is brighter than its right neighbour.
+
+    Returns:
+        np.ndarray: (N, hash_size * hash_size / 8) uint8 array of packed hash bits.
+    """
+    thumbs = np.stack([
+        cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+        for frame in frames
+    ]).astype(np.int16)
+    bits = thumbs[:, :, 1:] > thumbs[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), -1), axis=1)
+
+def hamming_matrix(hashes: np.ndarray) -> np.ndarray:
+    """Returns the (N, N) matrix of bit differences between packed hashes."""
+    xor = hashes[:, None, :] ^ hashes[None, :, :]
+    return np.unpackbits(xor, axis=2).sum(axis=2)
+
+def color_histograms(frames: list, bins=(16, 4, 4)) -> np.ndarray:
+    """Returns L1-normalized HSV histograms, one row per frame."""
+    hists = []
+    for frame in frames:
+        small = cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1, 2], None, list(bins), [0, 180, 0, 256, 0, 256]).ravel()
+        hists.append(hist / max(hist.sum(), 1))
+    return np.stack(hists)
+
+def histogram_distances(hists: np.ndarray) -> np.ndarray:
+    """Returns the (N, N) matrix of total variation distances between histograms."""
+    return 0.5 * np.abs(hists[:, None, :] - hists[None, :, :]).sum(axis=2)
+
+def scene_change_scores(hists: np.ndarray) -> np.ndarray:
+    """
+    Scores each frame by how much its color distribution differs from the
+    previous one (total variation distance, 0 = identical, 1 = disjoint).
+    The first frame gets +inf so it is always considered first.
+    """
+    scores = np.empty(len(hists))
+    scores[0] = np.inf
+    scores[1:] = 0.5 * np.abs(hists[1:] - hists[:-1]).sum(axis=1)
+    return scores
+
+def select_keyframes(frames: list, budget: int, min_distance: int, min_color_distance: float) -> list[int]:
+    """
+    Picks up to `budget` representative frames from time-ordered candidates.
+
+    Candidates are visited from the strongest scene change to the weakest and
+    dropped as near-duplicates of a kept frame only if their dHash differs
+    from it by fewer than `min_distance` bits and their HSV histogram by
+    less than `min_color_distance`. dHash only sees brightness gradients, so
+    shots that differ in colour alone are kept.
+
+    Returns:
+        list[int]: Indices into `frames`, in time order.
+    """
+    if not frames:
+        return []
+
+    hists = color_histograms(frames)
+    distances = hamming_matrix(dhash(frames))
+    color_distances = histogram_distances(hists)
+    scores = scene_change_scores(hists)
+
+    selected = []
+    for index in np.argsort(-scores, kind="stable"):
+        if len(selected) >= budget:
+            break
+        if all(
+            distances[index, kept] >= min_distance or color_distances[index, kept] >= min_color_distance
+            for kept in selected
+        ):
+            selected.append(int(index))
+
+    return sorted(selected)
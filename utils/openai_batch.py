@@ -0,0 +1,201 @@
+import hashlib
+import io
+import json
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from utils.openai_client import call_with_limits, get_client
+from utils.settings import DATA_DIR
+from utils.tracing import estimate_cost, record_call
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+# "sync" sends every request to the chat endpoint as it comes; "batch" collects
+# a stage's requests into JSONL files and runs them as Batch API jobs (half the
+# price, separate rate limits, results within the completion window)
+EXECUTION_MODE = os.getenv("OPENAI_EXECUTION_MODE", "sync")
+
+BATCH_DIR = DATA_DIR / "batches"
+
+BATCH_POLL_SECONDS = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", "30"))
+BATCH_COMPLETION_WINDOW = "24h"
+CHAT_ENDPOINT = "/v1/chat/completions"
+
+# Batch API input limits are 50,000 requests and 200 MB per file
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchError(RuntimeError):
+    """Raised when a batch job ends without usable output."""
+
+def batch_mode() -> bool:
+    return EXECUTION_MODE == "batch"
+
+def write_batch_files(stage: str, requests: Dict[str, Dict[str, Any]]) -> list[Path]:
+    """
+    Writes `requests` (custom_id -> chat completion body) as Batch API JSONL,
+    split to stay under the per-file limits. File names are derived from the
+    content, so re-running the same backfill finds the same files.
+    """
+    lines = [
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_ENDPOINT, "body": body}, ensure_ascii=False)
+        for custom_id, body in sorted(requests.items())
+    ]
+
+    groups = [[]]
+    group_bytes = 0
+    for line in lines:
+        size = len(line.encode("utf-8")) + 1
+        if groups[-1] and (len(groups[-1]) >= BATCH_MAX_REQUESTS or group_bytes + size > BATCH_MAX_BYTES):
+            groups.append([])
+            group_bytes = 0
+        groups[-1].append(line)
+        group_bytes += size
+
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for group in groups:
+        content = "\n".join(group) + "\n"
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+        path = BATCH_DIR / f"{stage}_{digest}.jsonl"
+        if not path.exists():
+            path.write_text(content, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+def submit_batch(input_path: Path, stage: str) -> str:
+    """
+    Uploads a JSONL file and creates its batch job. The batch id is recorded
+    next to the file, so an interrupted run resumes polling the same job
+    instead of paying for it twice. Returns the batch id.
+    """
+    client = get_client()
+    record_path = input_path.with_suffix(".batch.json")
+
+    if record_path.exists():
+        batch_id = json.loads(record_path.read_text(encoding="utf-8"))["batch_id"]
+        batch = call_with_limits(client.batches.retrieve, {"batch_id": batch_id}, 0, api=None)
+        if batch.status not in FINAL_STATUSES - {"completed"}:
+            print(f"[🔁] Reusing batch {batch_id} ({batch.status}) for {input_path.name}")
+            return batch_id
+
+    uploaded = call_with_limits(
+        client.files.create,
+        {"file": (input_path.name, io.BytesIO(input_path.read_bytes())), "purpose": "batch"},
+        0,
+        api=None,
+    )
+    batch = call_with_limits(
+        client.batches.create,
+        {
+            "input_file_id": uploaded.id,
+            "endpoint": CHAT_ENDPOINT,
+            "completion_window": BATCH_COMPLETION_WINDOW,
+            "metadata": {"stage": stage, "input": input_path.name},
+        },
+        0,
+        api=None,
+    )
+    record_path.write_text(json.dumps({"batch_id": batch.id, "input_file_id": uploaded.id}), encoding="utf-8")
+    print(f"[📦] Submitted batch {batch.id} for {input_path.name}")
+    return batch.id
+
+def wait_for_batch(batch_id: str, poll_seconds: float = BATCH_POLL_SECONDS):
+    """Polls a batch job until it reaches a final status and returns it."""
+    client = get_client()
+    while True:
+        batch = call_with_limits(client.batches.retrieve, {"batch_id": batch_id}, 0, api=None)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        progress = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+        print(f"[⏳] Batch {batch_id}: {batch.status}, {progress} requests done")
+        time.sleep(poll_seconds)
+
+def read_batch_output(batch) -> Dict[str, Optional["ChatCompletion"]]:
+    """
+    Downloads the output and error files of a finished batch.
+
+    Returns:
+        dict: custom_id -> ChatCompletion, or None for requests that failed.
+    """
+    from openai.types.chat import ChatCompletion
+
+    client = get_client()
+    results = {}
+
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = call_with_limits(client.files.content, {"file_id": file_id}, 0, api=None).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200 and not record.get("error"):
+                results[record["custom_id"]] = ChatCompletion.model_validate(response["body"])
+            else:
+                error = record.get("error") or response.get("body", {}).get("error")
+                print(f"[❌] Batch request {record['custom_id']} failed: {error}")
+                results[record["custom_id"]] = None
+
+    return results
+
+def run_chat_batch(stage: str, requests: Dict[str, Dict[str, Any]]) -> Dict[str, Optional["ChatCompletion"]]:
+    """
+    Runs chat completion requests through the Batch API and waits for them.
+    The stage's jobs are recorded as one "openai_batch" call in the run trace.
+
+    Args:
+        stage (str): Pipeline stage, used in file names and batch metadata.
+        requests (dict): custom_id -> chat completion request body.
+
+    Returns:
+        dict: custom_id -> ChatCompletion. Failed or missing requests map to None.
+    """
+    if not requests:
+        return {}
+
+    started = time.perf_counter()
+    paths = write_batch_files(stage, requests)
+    print(f"[📦] {stage}: {len(requests)} requests in {len(paths)} batch file(s)")
+    batch_ids = [submit_batch(path, stage) for path in paths]
+
+    results = {}
+    for batch_id in batch_ids:
+        batch = wait_for_batch(batch_id)
+        if batch.status != "completed":
+            print(f"[❌] Batch {batch_id} ended as {batch.status}")
+            continue
+        results.update(read_batch_output(batch))
+
+    trace_batch(stage, requests, results, paths, started)
+    return {custom_id: results.get(custom_id) for custom_id in requests}
+
+def trace_batch(stage: str, requests: Dict[str, Dict[str, Any]], results: Dict[str, Optional["ChatCompletion"]], paths: list, started: float) -> None:
+    """Records a stage's batch jobs as one call in the run trace, priced at the batch discount."""
+    usages = [response.usage for response in results.values() if response is not None and response.usage]
+    prompt_tokens = sum(usage.prompt_tokens for usage in usages)
+    cached_tokens = sum(getattr(usage.prompt_tokens_details, "cached_tokens", None) or 0 for usage in usages)
+    completion_tokens = sum(usage.completion_tokens for usage in usages)
+    model = next(iter(requests.values())).get("model")
+    record_call(
+        "openai_batch",
+        time.perf_counter() - started,
+        stage=stage,
+        model=model,
+        requests=len(requests),
+        failed=sum(results.get(custom_id) is None for custom_id in requests),
+        bytes_up=sum(Path(path).stat().st_size for path in paths),
+        prompt_tokens=prompt_tokens,
+        cached_tokens=cached_tokens,
+        completion_tokens=completion_tokens,
+        cost_usd=estimate_cost(model, prompt_tokens, completion_tokens, batch=True, cached_tokens=cached_tokens),
+        status="ok",
+    )
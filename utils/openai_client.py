@@ -0,0 +1,335 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from utils.settings import load_settings
+from utils.tokens import count_tokens
+from utils.tracing import call_attributes, estimate_cost, record_call
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+load_settings()
+
+# Account limits shared by every node in this process (and, for queue
+# workers, by every worker process on every host; see use_shared_limiter)
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+
+# Backoff for retries without a retry-after header: full jitter, capped
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# Rough token cost of an image part when estimating a request up front
+IMAGE_TOKEN_ESTIMATE = {"low": 85, "high": 765, "auto": 765}
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute.
+
+    Callers reserve capacity before sending a request and get back how long
+    to wait, so the same limiter serves threads (time.sleep) and coroutines
+    (asyncio.sleep). Buckets may go negative; later callers then wait longer.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def reserve(self, tokens: int) -> float:
+        """Reserves one request and `tokens` tokens. Returns seconds to wait before sending."""
+        with self.lock:
+            self._refill()
+            self.requests -= 1
+            self.tokens -= tokens
+            wait_requests = -self.requests * 60 / self.rpm if self.requests < 0 else 0.0
+            wait_tokens = -self.tokens * 60 / self.tpm if self.tokens < 0 and self.tpm > 0 else 0.0
+            return max(wait_requests, wait_tokens)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Corrects the token bucket once the real usage of a request is known."""
+        with self.lock:
+            self.tokens += estimated - actual
+
+class SharedRateLimiter:
+    """
+    RateLimiter interface backed by the job queue (utils.jobs), whose token
+    buckets every worker process on every host draws from. Used by queue
+    workers, so `worker --processes N` on several hosts stays within one
+    account's RPM and TPM instead of N times them.
+    """
+
+    def __init__(self, queue: Any, name: str = "openai", rpm: int = OPENAI_RPM, tpm: int = OPENAI_TPM):
+        self.queue = queue
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+
+    def reserve(self, tokens: int) -> float:
+        return self.queue.reserve(self.name, tokens, self.rpm, self.tpm)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        if estimated != actual:
+            self.queue.settle(self.name, estimated - actual)
+
+class ConcurrencyLimit:
+    """Caps in-flight requests across threads and coroutines alike."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self.condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+limiter = RateLimiter(OPENAI_RPM, OPENAI_TPM)
+concurrency = ConcurrencyLimit(OPENAI_MAX_CONCURRENCY)
+
+def use_shared_limiter(queue: Any) -> None:
+    """Makes every request of this process draw from the rate limits kept by the job queue `queue`."""
+    global limiter
+    limiter = SharedRateLimiter(queue)
+
+# The SDK takes about half a second to import, so it is only imported once a
+# client is needed
+_client: Optional["OpenAI"] = None
+# One async client per event loop, dropped with its loop (see aclose_async_client)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+def get_client() -> "OpenAI":
+    """Returns the shared synchronous client, created on first use. Retries are handled here, not by the SDK."""
+    from openai import OpenAI
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return _client
+
+def get_async_client() -> "AsyncOpenAI":
+    """Returns the shared async client for the running event loop."""
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return _async_clients[loop]
+
+async def aclose_async_client() -> None:
+    """Closes and drops the async client of the running event loop; call it before the loop ends."""
+    with _client_lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Estimates prompt plus completion tokens of a chat request with the model's tokenizer."""
+    model = request.get("model", "gpt-4o")
+    total = 0
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += count_tokens(part["text"], model)
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKEN_ESTIMATE.get(part["image_url"].get("detail", "auto"), 765)
+    return total + request.get("max_tokens", 500)
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Returns how long to wait before retrying `error`, or None if it is not retryable.
+    429s, 5xx, timeouts and connection errors are retried; retry-after is honored.
+    A 429 for an exhausted quota is not transient and is not retried.
+    """
+    import openai
+
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        if "insufficient_quota" in (getattr(error, "code", None), getattr(error, "type", None)):
+            return None
+        headers = error.response.headers
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return None
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+def upload_bytes(request: Dict[str, Any]) -> int:
+    """Size of a request body: the audio file for transcriptions, the JSON (with inline images) for chat."""
+    upload = request.get("file")
+    if upload is None:
+        return len(json.dumps(request, ensure_ascii=False, default=str).encode("utf-8"))
+    if isinstance(upload, tuple):
+        return len(upload[1])
+    return os.fstat(upload.fileno()).st_size
+
+def trace_call(api: Optional[str], request: Dict[str, Any], response: Any, started: float, queue_seconds: float, retries: int, error: Optional[Exception] = None) -> None:
+    """Records one rate-limited call (all of its attempts) in the run trace under `api`; None skips it."""
+    if api is None:
+        return
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    # Input tokens served from the provider's prompt cache (the static prompt prefix)
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    # Whisper reports the duration only in verbose_json; callers annotate it otherwise
+    audio_seconds = getattr(response, "duration", None) or call_attributes.get().get("audio_seconds")
+    whisper = api == "whisper"
+    fields = {
+        "model": request.get("model"),
+        "queue_ms": round(queue_seconds * 1000, 1),
+        "retries": retries,
+        "bytes_up": upload_bytes(request),
+        "bytes_down": len(response.to_json(indent=None).encode("utf-8")) if hasattr(response, "to_json") else None,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": completion_tokens,
+        "status": "error" if error else "ok",
+    }
+    if error:
+        fields["error"] = f"{type(error).__name__}: {error}"
+    elif whisper:
+        fields["cost_usd"] = estimate_cost(request.get("model"), audio_seconds=audio_seconds) if audio_seconds else None
+    else:
+        fields["cost_usd"] = estimate_cost(request.get("model"), prompt_tokens or 0, completion_tokens or 0, cached_tokens=cached_tokens or 0)
+    if audio_seconds is not None:
+        fields["audio_seconds"] = audio_seconds
+    record_call(api, time.perf_counter() - started, **fields)
+
+def call_with_limits(create, request: Dict[str, Any], tokens: int, api: Optional[str] = "openai") -> Any:
+    """
+    Runs `create(**request)` under the rate limiter and concurrency cap, with
+    retries, and records it in the run trace as `api` (None for housekeeping calls).
+    """
+    started = time.perf_counter()
+    queued = 0.0
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        wait_started = time.perf_counter()
+        time.sleep(limiter.reserve(tokens))
+        concurrency.acquire()
+        queued += time.perf_counter() - wait_started
+        error = None
+        try:
+            response = create(**request)
+        except Exception as e:
+            error = e
+        finally:
+            concurrency.release()
+
+        # The slot is released first, so a request backing off does not hold it
+        if error is not None:
+            delay = retry_delay(error, attempt)
+            if delay is None or attempt == OPENAI_MAX_RETRIES:
+                trace_call(api, request, None, started, queued, attempt, error)
+                raise error
+            print(f"[⏳] OpenAI {type(error).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{OPENAI_MAX_RETRIES})")
+            time.sleep(delay)
+            continue
+
+        actual = _usage_tokens(response)
+        if actual is not None:
+            limiter.settle(tokens, actual)
+        trace_call(api, request, response, started, queued, attempt)
+        return response
+
+async def acall_with_limits(create, request: Dict[str, Any], tokens: int, api: Optional[str] = "openai") -> Any:
+    """Async counterpart of call_with_limits."""
+    started = time.perf_counter()
+    queued = 0.0
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        wait_started = time.perf_counter()
+        await asyncio.sleep(limiter.reserve(tokens))
+        await concurrency.aacquire()
+        queued += time.perf_counter() - wait_started
+        error = None
+        try:
+            response = await create(**request)
+        except Exception as e:
+            error = e
+        finally:
+            concurrency.release()
+
+        if error is not None:
+            delay = retry_delay(error, attempt)
+            if delay is None or attempt == OPENAI_MAX_RETRIES:
+                trace_call(api, request, None, started, queued, attempt, error)
+                raise error
+            print(f"[⏳] OpenAI {type(error).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{OPENAI_MAX_RETRIES})")
+            await asyncio.sleep(delay)
+            continue
+
+        actual = _usage_tokens(response)
+        if actual is not None:
+            limiter.settle(tokens, actual)
+        trace_call(api, request, response, started, queued, attempt)
+        return response
+
+def chat(**request) -> Any:
+    """Rate-limited client.chat.completions.create."""
+    return call_with_limits(get_client().chat.completions.create, request, estimate_tokens(request))
+
+async def achat(**request) -> Any:
+    """Rate-limited async client.chat.completions.create."""
+    return await acall_with_limits(get_async_client().chat.completions.create, request, estimate_tokens(request))
+
+def transcribe(**request) -> Any:
+    """Rate-limited client.audio.transcriptions.create (counts against RPM only)."""
+    return call_with_limits(get_client().audio.transcriptions.create, request, 0, api="whisper")
+
+async def atranscribe(**request) -> Any:
+    """Rate-limited async client.audio.transcriptions.create (counts against RPM only)."""
+    return await acall_with_limits(get_async_client().audio.transcriptions.create, request, 0, api="whisper")
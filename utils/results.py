@@ -0,0 +1,265 @@
+import csv
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
+from rich import print
+from utils.settings import DATA_DIR
+
+# One database for every text result of the pipeline, keyed by video and stage
+RESULTS_DB_PATH = DATA_DIR / "results.sqlite"
+
+# Stages whose results are JSON objects; the others are plain text
+JSON_STAGES = {"analyze_frames", "analyze_ad"}
+
+# Videos per join query, well under SQLite's limit on bound parameters
+JOIN_CHUNK = 500
+
+# Per-video result files written before the store, by stage:
+# (directory, file name suffix)
+LEGACY_LAYOUT = {
+    "transcribe": ("transcriptions", ".txt"),
+    "analyze_transcription": ("transcription_analysis", "_analysis.txt"),
+    "analyze_frames": ("frame_analysis", "_analysis.json"),
+    "analyze_ad": ("ad_analysis", "_final.json"),
+}
+
+def encode_result(stage: str, value: Any) -> str:
+    """Serializes a stage result the way it is stored (JSON stages compact, text as is)."""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True) if stage in JSON_STAGES else value
+
+def decode_result(stage: str, content: str) -> Any:
+    return json.loads(content) if stage in JSON_STAGES else content
+
+class ResultStore:
+    """
+    Stores transcripts and analyses in SQLite instead of one small file per
+    video and stage.
+
+    `results` holds one row per (video, stage) with the content and its
+    SHA-256, so dependency checks compare digests without reading content.
+    `ad_videos` links ads to their videos; several ads can share a video.
+    Writes inside `transaction()` are committed together.
+    """
+
+    def __init__(self, db_path: Path = RESULTS_DB_PATH):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                video_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                content TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (video_id, stage)
+            );
+            CREATE INDEX IF NOT EXISTS results_stage ON results(stage, video_id);
+            CREATE TABLE IF NOT EXISTS ad_videos (
+                ad_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                PRIMARY KEY (ad_id, video_id)
+            );
+            CREATE INDEX IF NOT EXISTS ad_videos_video ON ad_videos(video_id);
+        """)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups writes into one commit; other threads wait until it ends. Nests."""
+        with self.lock:
+            self.depth += 1
+            try:
+                if self.depth == 1:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                yield
+            except BaseException:
+                if self.depth == 1:
+                    self.conn.execute("ROLLBACK")
+                raise
+            else:
+                if self.depth == 1:
+                    self.conn.execute("COMMIT")
+            finally:
+                self.depth -= 1
+
+    def put(self, video_id: str, stage: str, value: Any) -> tuple:
+        """
+        Stores a stage result unless the stored one is identical, so unchanged
+        results keep their updated_at.
+
+        Returns:
+            tuple: (handle, True if the row was written)
+        """
+        content = encode_result(stage, value)
+        sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        handle = {"id": video_id, "stage": stage, "sha256": sha256, "size": len(content.encode("utf-8"))}
+        with self.lock:
+            if self.digest(video_id, stage) == sha256:
+                return handle, False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (video_id, stage, content, sha256, size, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, stage, content, sha256, handle["size"], time.time()),
+            )
+        return handle, True
+
+    def digest(self, video_id: str, stage: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT sha256 FROM results WHERE video_id = ? AND stage = ?", (video_id, stage)).fetchone()
+        return row[0] if row else None
+
+    def get(self, video_id: str, stage: str) -> Optional[Any]:
+        """Returns the decoded result of one video and stage, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM results WHERE video_id = ? AND stage = ?", (video_id, stage)).fetchone()
+        return decode_result(stage, row[0]) if row else None
+
+    def join(self, video_ids: list, stages: list) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns {video_id: {stage: result}} for the videos that have a result
+        for every one of `stages`, with one indexed query per JOIN_CHUNK videos.
+        """
+        columns = ", ".join(f"s{i}.content" for i in range(len(stages)))
+        joins = " ".join(
+            f"JOIN results s{i} ON s{i}.video_id = v.video_id AND s{i}.stage = ?" for i in range(len(stages))
+        )
+        joined = {}
+        for start in range(0, len(video_ids) if stages else 0, JOIN_CHUNK):
+            chunk = video_ids[start:start + JOIN_CHUNK]
+            sql = f"WITH v(video_id) AS (VALUES {', '.join('(?)' for _ in chunk)}) SELECT v.video_id, {columns} FROM v {joins}"
+            with self.lock:
+                rows = self.conn.execute(sql, [*chunk, *stages]).fetchall()
+            for row in rows:
+                joined[row[0]] = {stage: decode_result(stage, content) for stage, content in zip(stages, row[1:])}
+        return joined
+
+    def link_ads(self, pairs: list) -> None:
+        """Records (ad_id, video_id) pairs; video ids as used for results, e.g. "video_123"."""
+        with self.transaction():
+            self.conn.executemany("INSERT OR IGNORE INTO ad_videos (ad_id, video_id) VALUES (?, ?)", pairs)
+
+    def query(self, stage: Optional[str] = None, video_ids: Optional[list] = None, ad_ids: Optional[list] = None) -> list:
+        """
+        Returns stored results as dicts {"ad_ids", "video_id", "stage",
+        "result", "updated_at"}, ordered by video and stage.
+
+        Args:
+            stage (str, optional): Only results of this stage.
+            video_ids (list, optional): Only these videos.
+            ad_ids (list, optional): Only videos of these ads.
+        """
+        conditions, params = [], []
+        if stage:
+            conditions.append("r.stage = ?")
+            params.append(stage)
+        if video_ids:
+            conditions.append(f"r.video_id IN ({', '.join('?' for _ in video_ids)})")
+            params.extend(video_ids)
+        if ad_ids:
+            conditions.append(f"r.video_id IN (SELECT video_id FROM ad_videos WHERE ad_id IN ({', '.join('?' for _ in ad_ids)}))")
+            params.extend(ad_ids)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = (
+            "SELECT r.video_id, r.stage, r.content, r.updated_at, "
+            "(SELECT group_concat(ad_id, ',') FROM ad_videos a WHERE a.video_id = r.video_id) "
+            f"FROM results r {where} ORDER BY r.video_id, r.stage"
+        )
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [
+            {"ad_ids": sorted(ads.split(",")) if ads else [], "video_id": video_id, "stage": stage,
+             "result": decode_result(stage, content), "updated_at": updated_at}
+            for video_id, stage, content, updated_at, ads in rows
+        ]
+
+    def count(self, stage: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results WHERE stage = ?", (stage,)).fetchone()[0]
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+
+def get_result_store() -> ResultStore:
+    """Returns the process-wide result store shared by all nodes."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
+
+def read_result(handle: Dict[str, Any]) -> Any:
+    """
+    Returns the content behind a result handle: a store row, or a file for
+    handles recorded before the store existed.
+    """
+    stage = handle.get("stage")
+    if stage:
+        return get_result_store().get(handle["id"], stage)
+    path = Path(handle["path"])
+    text = path.read_text(encoding="utf-8")
+    return json.loads(text) if path.suffix == ".json" else text
+
+def export_results(output: Path, fmt: str, stage: str = "analyze_ad", ad_ids: Optional[list] = None) -> int:
+    """
+    Writes the stored results of `stage` to a CSV or JSON file for analysts.
+    In CSV, the fields of JSON results become columns and lists are joined
+    with "; ".
+
+    Returns:
+        int: Number of results written.
+    """
+    rows = get_result_store().query(stage=stage, ad_ids=ad_ids)
+    output = Path(output)
+
+    if fmt == "json":
+        output.write_text(json.dumps(rows, indent=2, ensure_ascii=False), encoding="utf-8")
+        return len(rows)
+
+    fields = []
+    for row in rows:
+        result = row["result"] if isinstance(row["result"], dict) else {"result": row["result"]}
+        fields.extend(key for key in result if key not in fields)
+    with open(output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["ad_ids", "video_id", "stage", "updated_at", *fields])
+        writer.writeheader()
+        for row in rows:
+            result = row["result"] if isinstance(row["result"], dict) else {"result": row["result"]}
+            writer.writerow({
+                "ad_ids": ",".join(row["ad_ids"]),
+                "video_id": row["video_id"],
+                "stage": row["stage"],
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(row["updated_at"])),
+                **{key: "; ".join(map(str, value)) if isinstance(value, list) else value for key, value in result.items()},
+            })
+    return len(rows)
+
+def import_legacy(data_dir: Path = DATA_DIR) -> Dict[str, int]:
+    """
+    Loads the per-video result files under `data_dir` (see LEGACY_LAYOUT)
+    into the store in one transaction. The files are left in place.
+
+    Returns:
+        dict: stage -> number of results written (unchanged rows are not counted)
+    """
+    store = get_result_store()
+    written = {}
+    with store.transaction():
+        for stage, (directory, suffix) in LEGACY_LAYOUT.items():
+            written[stage] = 0
+            for path in sorted((Path(data_dir) / directory).glob(f"*{suffix}")):
+                video_id = path.name[:-len(suffix)]
+                try:
+                    text = path.read_text(encoding="utf-8")
+                    value = json.loads(text) if stage in JSON_STAGES else text
+                except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+                    print(f"[⚠️] Skipping {path}: {e}")
+                    continue
+                written[stage] += store.put(video_id, stage, value)[1]
+    return written
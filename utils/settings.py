@@ -0,0 +1,24 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+_loaded = False
+
+def load_settings() -> None:
+    """
+    Loads .env into the environment. Every module reads its settings with
+    os.getenv at import time, so they call this first; only the first call
+    reads the file.
+    """
+    global _loaded
+    if not _loaded:
+        load_dotenv()
+        _loaded = True
+
+load_settings()
+
+# Root of everything the pipeline reads and writes at run time: ads, videos,
+# frames, analyses, caches, checkpoints and traces. Defaults to the repository
+# checkout; benchmarks point it at a scratch directory.
+DATA_DIR = Path(os.getenv("AD_ANALYZER_DATA_DIR", Path(__file__).resolve().parent.parent))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,316 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+from rich import print
+from utils.settings import DATA_DIR, load_settings
+
+load_settings()
+
+# Byte quotas per artifact class in MB (0 = unlimited). Past its quota, a
+# class is trimmed by evicting its least recently used entries whose
+# downstream results are final
+STORAGE_QUOTAS = {
+    "videos": int(float(os.getenv("STORAGE_QUOTA_VIDEOS_MB", "0")) * 1024 * 1024),
+    "frames": int(float(os.getenv("STORAGE_QUOTA_FRAMES_MB", "0")) * 1024 * 1024),
+}
+
+# Delete a downloaded video as soon as its transcript and frames exist
+STORAGE_STREAMING = os.getenv("STORAGE_STREAMING", "0") == "1"
+
+# Artifact classes: one downloaded MP4 or one directory of frames per video
+VIDEO_DIR = DATA_DIR / "tmp_videos"
+FRAMES_DIR = DATA_DIR / "extracted_frames"
+AUDIO_DIR = DATA_DIR / "tmp_audio"
+
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+STORAGE_DB_PATH = CACHE_DIR / "storage.sqlite"
+
+# Stages that write or read the media files, mirroring the graph edges
+MEDIA_DEPENDENCIES = {
+    "download": [],
+    "transcribe": ["download"],
+    "extract_frames": ["download"],
+    "analyze_frames": ["extract_frames"],
+}
+
+def artifact_path(kind: str, video: str) -> Path:
+    return VIDEO_DIR / f"{video}.mp4" if kind == "videos" else FRAMES_DIR / video
+
+def disk_usage(path: Path) -> tuple:
+    """Returns (files, bytes) under `path`, a file or a directory."""
+    if path.is_file():
+        return 1, path.stat().st_size
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.stat(os.path.join(root, name)).st_size
+                files += 1
+            except OSError:
+                pass
+    return files, size
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def media_plan(video: str) -> Dict[str, str]:
+    """Status of the stages that use the media of `video` (see plan_video)."""
+    from nodes import analyze_frames, extract_frames, transcribe_video
+    from utils.deps import plan_video
+
+    return plan_video(video, MEDIA_DEPENDENCIES, {
+        "download": {},
+        "transcribe": transcribe_video.stage_params(),
+        "extract_frames": extract_frames.stage_params(),
+        "analyze_frames": analyze_frames.stage_params(),
+    })
+
+class StorageManager:
+    """
+    Keeps downloaded videos and extracted frames within per-class byte quotas.
+
+    Every entry (one video file or one frames directory) is tracked with its
+    size and last access. Eviction takes the least recently used entries
+    first and skips entries that are pinned by a live process or whose
+    downstream stages are not up to date yet: a video once it is transcribed
+    and its frames are extracted, frames once they are analyzed.
+
+    Evicted entries stay recorded, and the dependency tracker counts their
+    outputs as unchanged, so later runs do not download or extract them
+    again unless a stage that reads them has to run (see restore_if_needed).
+    """
+
+    def __init__(self, db_path: Path = STORAGE_DB_PATH):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                kind TEXT NOT NULL,
+                video TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                evicted INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kind, video)
+            );
+            CREATE INDEX IF NOT EXISTS artifacts_lru ON artifacts(kind, evicted, last_access);
+            CREATE TABLE IF NOT EXISTS pins (
+                video TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                PRIMARY KEY (video, pid)
+            );
+        """)
+
+    def touch(self, kind: str, video: str) -> None:
+        """Records that an entry was written or read; missing entries are ignored."""
+        path = artifact_path(kind, video)
+        if not path.exists():
+            return
+        size = disk_usage(path)[1]
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO artifacts (kind, video, size, last_access, evicted) VALUES (?, ?, ?, ?, 0)",
+                (kind, video, size, time.time()),
+            )
+
+    def pin(self, videos: list) -> None:
+        """Protects the media of `videos` from eviction until unpin_all() or this process exits."""
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO pins (video, pid) VALUES (?, ?)", [(v, self.pid) for v in videos])
+
+    def unpin_all(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM pins WHERE pid = ?", (self.pid,))
+
+    def pinned(self, video: str, by_others: bool = False) -> bool:
+        """True if a live process (other than this one with `by_others`) pinned `video`."""
+        with self.lock:
+            pids = [row[0] for row in self.conn.execute("SELECT pid FROM pins WHERE video = ?", (video,))]
+        return any(process_alive(pid) for pid in pids if not (by_others and pid == self.pid))
+
+    def is_evicted(self, path: Path) -> bool:
+        """True if `path` (a video, a frames directory or a frame in one) was evicted."""
+        path = Path(path)
+        if path.parent == VIDEO_DIR and path.suffix == ".mp4":
+            kind, video = "videos", path.stem
+        elif path.parent.parent == FRAMES_DIR:
+            kind, video = "frames", path.parent.name
+        else:
+            return False
+        with self.lock:
+            row = self.conn.execute("SELECT evicted FROM artifacts WHERE kind = ? AND video = ?", (kind, video)).fetchone()
+        return bool(row and row[0])
+
+    def evict(self, kind: str, video: str) -> int:
+        """Deletes one entry and marks it evicted; returns the bytes freed."""
+        path = artifact_path(kind, video)
+        size = disk_usage(path)[1] if path.exists() else 0
+        if kind == "videos":
+            for extra in (path.with_name(path.name + ".meta.json"), path.with_name(path.name + ".part")):
+                extra.unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO artifacts (kind, video, size, last_access, evicted) VALUES (?, ?, ?, ?, 1)",
+                (kind, video, size, time.time()),
+            )
+        return size
+
+    def forget(self, kind: str, video: str) -> None:
+        """Drops the eviction record of an entry, so stages that produce it run again."""
+        with self.lock:
+            self.conn.execute("DELETE FROM artifacts WHERE kind = ? AND video = ? AND evicted = 1", (kind, video))
+
+    def restore_if_needed(self, video: str) -> bool:
+        """
+        Before a run of `video`: if a stage that reads an evicted entry has
+        to run, forgets the eviction so the entry is downloaded or extracted again.
+
+        Returns:
+            bool: True if the video has to be downloaded again.
+        """
+        with self.lock:
+            evicted = {row[0] for row in self.conn.execute(
+                "SELECT kind FROM artifacts WHERE video = ? AND evicted = 1", (video,)
+            )}
+        if not evicted:
+            return False
+        plan = media_plan(video)
+        frames_needed = "frames" in evicted and plan["analyze_frames"] != "up to date"
+        video_needed = frames_needed or plan["transcribe"] != "up to date" or plan["extract_frames"] != "up to date"
+        if frames_needed:
+            self.forget("frames", video)
+        if video_needed and "videos" in evicted:
+            print(f"[♻️] Downloading evicted {video} again")
+            self.forget("videos", video)
+            return True
+        return False
+
+    def evictable(self, kind: str, video: str) -> bool:
+        if self.pinned(video):
+            return False
+        plan = media_plan(video)
+        stages = ("download", "transcribe", "extract_frames") if kind == "videos" else ("extract_frames", "analyze_frames")
+        return all(plan[stage] == "up to date" for stage in stages)
+
+    def release_source(self, video: str) -> None:
+        """In streaming mode, evicts the video of `video` once its transcript and frames exist."""
+        if not STORAGE_STREAMING or not artifact_path("videos", video).exists() or self.pinned(video, by_others=True):
+            return
+        plan = media_plan(video)
+        if all(plan[stage] == "up to date" for stage in ("download", "transcribe", "extract_frames")):
+            freed = self.evict("videos", video)
+            print(f"[🧹] Streaming: removed {video}.mp4 ({freed / 1024 / 1024:.1f} MB)")
+
+    def scan(self, kind: str) -> None:
+        """Starts tracking entries written before the manager, and drops entries deleted by hand."""
+        directory = VIDEO_DIR if kind == "videos" else FRAMES_DIR
+        if kind == "videos":
+            found = {path.stem: path for path in directory.glob("*.mp4")}
+        else:
+            found = {path.name: path for path in directory.iterdir() if path.is_dir()} if directory.exists() else {}
+        with self.lock:
+            known = {row[0] for row in self.conn.execute("SELECT video FROM artifacts WHERE kind = ?", (kind,))}
+            gone = [(kind, video) for video in known - found.keys()]
+            self.conn.executemany("DELETE FROM artifacts WHERE kind = ? AND video = ? AND evicted = 0", gone)
+            self.conn.executemany(
+                "INSERT INTO artifacts (kind, video, size, last_access) VALUES (?, ?, ?, ?)",
+                [(kind, video, disk_usage(path)[1], path.stat().st_mtime) for video, path in found.items() if video not in known],
+            )
+
+    def enforce(self, kinds: Optional[list] = None) -> Dict[str, int]:
+        """
+        Evicts least recently used entries of every class over its quota.
+
+        Returns:
+            dict: kind -> bytes freed
+        """
+        freed = {}
+        for kind in kinds or STORAGE_QUOTAS:
+            quota = STORAGE_QUOTAS.get(kind, 0)
+            if quota <= 0:
+                continue
+            self.scan(kind)
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT video, size FROM artifacts WHERE kind = ? AND evicted = 0 ORDER BY last_access", (kind,)
+                ).fetchall()
+            used = sum(size for _, size in rows)
+            freed[kind] = 0
+            for video, size in rows:
+                if used <= quota:
+                    break
+                if not self.evictable(kind, video):
+                    continue
+                self.evict(kind, video)
+                used -= size
+                freed[kind] += size
+            if freed[kind]:
+                print(f"[🧹] Evicted {freed[kind] / 1024 / 1024:.1f} MB of {kind}; "
+                      f"{used / 1024 / 1024:.1f} of {quota / 1024 / 1024:.0f} MB in use")
+        return freed
+
+    def evicted_count(self, kind: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM artifacts WHERE kind = ? AND evicted = 1", (kind,)).fetchone()[0]
+
+_manager: Optional[StorageManager] = None
+_manager_lock = threading.Lock()
+
+def get_storage_manager() -> StorageManager:
+    """Returns the process-wide storage manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StorageManager()
+        return _manager
+
+def storage_usage() -> Dict[str, Dict[str, Any]]:
+    """
+    Measures the disk usage of the data directory by stage.
+
+    Returns:
+        dict: stage -> {"path", "files", "bytes"}
+    """
+    from utils.results import RESULTS_DB_PATH
+
+    locations = {
+        "download": VIDEO_DIR,
+        "extract_frames": FRAMES_DIR,
+        "transcribe (audio chunks)": AUDIO_DIR,
+        "results": RESULTS_DB_PATH,
+        "caches": CACHE_DIR,
+        "traces": DATA_DIR / "traces",
+    }
+    usage = {}
+    for stage, path in locations.items():
+        files, size = disk_usage(path) if path.exists() else (0, 0)
+        usage[stage] = {"path": str(path), "files": files, "bytes": size}
+    return usage
+
+def print_storage_report() -> None:
+    usage = storage_usage()
+    manager = get_storage_manager()
+    print("[💽] Disk usage by stage:")
+    for stage, entry in usage.items():
+        print(f"  {stage}: {entry['bytes'] / 1024 / 1024:.1f} MB in {entry['files']} files ({entry['path']})")
+    for kind, quota in STORAGE_QUOTAS.items():
+        limit = f"{quota / 1024 / 1024:.0f} MB quota" if quota else "no quota"
+        print(f"  {kind}: {limit}, {manager.evicted_count(kind)} evicted")
+    if STORAGE_STREAMING:
+        print("  streaming: videos are removed once transcribed and extracted")
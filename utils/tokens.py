@@ -0,0 +1,73 @@
+import functools
+import os
+from typing import Optional
+from rich import print
+from utils.settings import load_settings
+from utils.tracing import record_trim
+
+load_settings()
+
+# Token budgets for the variable parts of the analysis prompts. Longer inputs
+# keep their beginning and end (hook and call to action) and lose the middle.
+TRANSCRIPT_TOKEN_BUDGET = int(os.getenv("TRANSCRIPT_TOKEN_BUDGET", "3000"))
+VISUAL_SUMMARY_TOKEN_BUDGET = int(os.getenv("VISUAL_SUMMARY_TOKEN_BUDGET", "800"))
+
+# Share of a trimmed input taken from its beginning; the rest comes from its end
+HEAD_SHARE = 0.7
+
+# Characters per token when no tokenizer is available (same rule as the rate limiter)
+CHARS_PER_TOKEN = 4
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Returns the tiktoken encoding of `model`, or None if tiktoken or its
+    encoding files are unavailable (they are downloaded on first use).
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"[⚠️] No tokenizer for {model} ({type(e).__name__}); estimating {CHARS_PER_TOKEN} characters per token.")
+        return None
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def fit_to_budget(text: str, budget: int, model: str, field: str) -> str:
+    """
+    Returns `text` unchanged if it fits in `budget` tokens, otherwise its
+    beginning and end joined by an omission marker. Trims are recorded in the
+    run trace under `field`.
+
+    Args:
+        text (str): Variable prompt content, e.g. a transcript.
+        budget (int): Maximum tokens to keep; 0 disables the budget.
+        model (str): Model whose tokenizer counts the tokens.
+        field (str): Name of the input for the trace, e.g. "transcript".
+    """
+    if budget <= 0 or not text:
+        return text
+
+    encoding = get_encoding(model)
+    tokens: Optional[list] = encoding.encode(text, disallowed_special=()) if encoding else None
+    total = len(tokens) if tokens is not None else len(text) // CHARS_PER_TOKEN
+    if total <= budget:
+        return text
+
+    head = int(budget * HEAD_SHARE)
+    tail = budget - head
+    marker = f"\n[... {total - budget} tokens omitted ...]\n"
+    if tokens is not None:
+        trimmed = encoding.decode(tokens[:head]) + marker + encoding.decode(tokens[-tail:])
+    else:
+        trimmed = text[:head * CHARS_PER_TOKEN] + marker + text[-tail * CHARS_PER_TOKEN:]
+
+    record_trim(field, total, budget)
+    return trimmed
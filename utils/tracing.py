@@ -0,0 +1,276 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
+from rich import print
+from rich.table import Table
+from utils.settings import DATA_DIR
+
+# One JSONL trace per run, appended to when the run is resumed
+TRACE_DIR = DATA_DIR / "traces"
+TRACE_ENABLED = os.getenv("AD_TRACE", "1") == "1"
+
+# USD per 1M (input, output) tokens, and per minute of Whisper audio.
+# Batch API requests are billed at half price, and so are input tokens
+# served from the provider's prompt cache.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+WHISPER_PRICE_PER_MINUTE = 0.006
+BATCH_DISCOUNT = 0.5
+CACHED_INPUT_DISCOUNT = 0.5
+
+# Node and video the current code runs for; calls made inside a node inherit them
+current_node: ContextVar[Optional[str]] = ContextVar("current_node", default=None)
+current_video: ContextVar[Optional[str]] = ContextVar("current_video", default=None)
+call_attributes: ContextVar[Dict[str, Any]] = ContextVar("call_attributes", default={})
+
+def estimate_cost(model: Optional[str], prompt_tokens: int = 0, completion_tokens: int = 0,
+                  audio_seconds: Optional[float] = None, batch: bool = False, cached_tokens: int = 0) -> Optional[float]:
+    """Returns the estimated USD cost of one call, or None for unknown models. `cached_tokens` are part of `prompt_tokens`."""
+    if audio_seconds is not None:
+        cost = audio_seconds / 60 * WHISPER_PRICE_PER_MINUTE
+    elif model in MODEL_PRICES:
+        input_price, output_price = MODEL_PRICES[model]
+        billed_input = prompt_tokens - cached_tokens * (1 - CACHED_INPUT_DISCOUNT)
+        cost = (billed_input * input_price + completion_tokens * output_price) / 1_000_000
+    else:
+        return None
+    return round(cost * (BATCH_DISCOUNT if batch else 1), 6)
+
+class Tracer:
+    """
+    Collects node spans, API calls and cache lookups for one run. Records are
+    kept in memory for the end-of-run summary and appended to the run's JSONL
+    trace as they happen, so a crashed run still leaves its trace behind.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records: list = []
+        self.run_id: Optional[str] = None
+        self.file = None
+        self.profiles: list = []
+        self.profile_nodes: set = set()
+        # Profiled nodes run one at a time: per-video sub-runs run nodes on
+        # several threads, and only one profiler can be enabled at a time
+        # (Python 3.12+ raises otherwise; before, each saw only its own thread)
+        self.profile_lock = threading.Lock()
+
+    def start(self, run_id: str) -> Path:
+        """Starts writing records to traces/{run_id}.jsonl."""
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        path = TRACE_DIR / f"{run_id}.jsonl"
+        with self.lock:
+            if self.file:
+                self.file.close()
+            self.run_id = run_id
+            self.records = []
+            self.file = open(path, "a", encoding="utf-8", buffering=1)
+        return path
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        if not TRACE_ENABLED:
+            return
+        record = {
+            "ts": round(time.time(), 3),
+            "run_id": self.run_id,
+            "node": current_node.get(),
+            "video": current_video.get(),
+            **record,
+        }
+        with self.lock:
+            self.records.append(record)
+            if self.file:
+                self.file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+tracer = Tracer()
+
+@contextmanager
+def node_span(name: str, video: Optional[str] = None) -> Iterator[None]:
+    """
+    Times one node run and makes `name` and `video` the context of every call
+    it makes. Nodes listed in tracer.profile_nodes also run under cProfile,
+    one at a time across the process.
+    """
+    node_token = current_node.set(name)
+    video_token = current_video.set(video)
+    profile = cProfile.Profile() if name in tracer.profile_nodes else None
+    if profile:
+        tracer.profile_lock.acquire()
+    started = time.perf_counter()
+    error = None
+    if profile:
+        profile.enable()
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profile:
+            profile.disable()
+            tracer.profile_lock.release()
+            with tracer.lock:
+                tracer.profiles.append(profile)
+        tracer.emit({
+            "kind": "node",
+            "name": name,
+            "video": video,
+            "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+            "status": "error" if error else "ok",
+            **({"error": error} if error else {}),
+        })
+        current_node.reset(node_token)
+        current_video.reset(video_token)
+
+@contextmanager
+def annotate(**attributes) -> Iterator[None]:
+    """Adds `attributes` (e.g. audio_seconds) to every call recorded inside the block."""
+    token = call_attributes.set({**call_attributes.get(), **attributes})
+    try:
+        yield
+    finally:
+        call_attributes.reset(token)
+
+def record_call(api: str, wall_seconds: float, **fields) -> None:
+    """
+    Records one external call.
+
+    Args:
+        api (str): "openai", "whisper", "openai_batch", "graph_api" or "download".
+        wall_seconds (float): Time from the first attempt to the result, including queue wait.
+        **fields: queue_ms, retries, bytes_up, bytes_down, model, prompt_tokens,
+            cached_tokens, completion_tokens, cost_usd, status, ...
+    """
+    tracer.emit({"kind": "call", "api": api, "wall_ms": round(wall_seconds * 1000, 1), **call_attributes.get(), **fields})
+
+def record_cache(stage: str, hit: bool) -> None:
+    tracer.emit({"kind": "cache", "stage": stage, "hit": hit})
+
+def record_trim(field: str, tokens_before: int, tokens_after: int) -> None:
+    """Records a prompt input cut down to its token budget."""
+    tracer.emit({"kind": "trim", "field": field, "tokens_before": tokens_before, "tokens_after": tokens_after})
+
+def map_in_context(pool: Executor, fn, items: list) -> list:
+    """pool.map that runs every item in a copy of the caller's context, so calls keep their node and video."""
+    futures = [pool.submit(copy_context().run, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+# ---- Summary ----
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def load_trace(run_id: str) -> list:
+    path = TRACE_DIR / f"{run_id}.jsonl"
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize_trace(records: list, slowest: int = 5) -> None:
+    """Prints per-node and per-API p50/p95 tables, the slowest videos, prompt savings and the estimated cost."""
+    nodes: Dict[str, list] = {}
+    calls: Dict[str, list] = {}
+    videos: Dict[str, Dict[str, Any]] = {}
+    trims: list = []
+
+    for record in records:
+        if record["kind"] == "node":
+            nodes.setdefault(record["name"], []).append(record)
+            if record.get("video"):
+                video = videos.setdefault(record["video"], {"start": math.inf, "end": 0.0, "stages": {}})
+                video["start"] = min(video["start"], record["ts"] - record["wall_ms"] / 1000)
+                video["end"] = max(video["end"], record["ts"])
+                video["stages"][record["name"]] = video["stages"].get(record["name"], 0) + record["wall_ms"]
+        elif record["kind"] == "call":
+            label = f"{record['api']} {record.get('model') or ''}".strip()
+            calls.setdefault(label, []).append(record)
+        elif record["kind"] == "trim":
+            trims.append(record)
+
+    if nodes:
+        table = Table(title="Nodes")
+        for column in ("node", "runs", "p50 s", "p95 s", "total s", "errors"):
+            table.add_column(column, justify="left" if column == "node" else "right")
+        for name, spans in nodes.items():
+            walls = [span["wall_ms"] / 1000 for span in spans]
+            errors = sum(span["status"] != "ok" for span in spans)
+            table.add_row(name, str(len(spans)), f"{percentile(walls, 50):.2f}", f"{percentile(walls, 95):.2f}",
+                          f"{sum(walls):.1f}", str(errors))
+        print(table)
+
+    total_cost = 0.0
+    if calls:
+        table = Table(title="API calls")
+        for column in ("api", "calls", "p50 s", "p95 s", "queue p95 s", "tokens in/cached/out", "MB up/down", "cost $"):
+            table.add_column(column, justify="left" if column == "api" else "right")
+        for label, records_ in sorted(calls.items()):
+            walls = [r["wall_ms"] / 1000 for r in records_]
+            queues = [r.get("queue_ms", 0) / 1000 for r in records_]
+            tokens_in = sum(r.get("prompt_tokens") or 0 for r in records_)
+            tokens_cached = sum(r.get("cached_tokens") or 0 for r in records_)
+            tokens_out = sum(r.get("completion_tokens") or 0 for r in records_)
+            mb_up = sum(r.get("bytes_up") or 0 for r in records_) / 1e6
+            mb_down = sum(r.get("bytes_down") or 0 for r in records_) / 1e6
+            cost = sum(r.get("cost_usd") or 0 for r in records_)
+            total_cost += cost
+            table.add_row(label, str(len(records_)), f"{percentile(walls, 50):.2f}", f"{percentile(walls, 95):.2f}",
+                          f"{percentile(queues, 95):.2f}", f"{tokens_in}/{tokens_cached}/{tokens_out}", f"{mb_up:.2f}/{mb_down:.2f}", f"{cost:.4f}")
+        print(table)
+
+    if videos:
+        table = Table(title=f"Slowest videos (top {slowest})")
+        for column in ("video", "wall s", "slowest stage"):
+            table.add_column(column, justify="right" if column == "wall s" else "left")
+        ranked = sorted(videos.items(), key=lambda item: item[1]["end"] - item[1]["start"], reverse=True)
+        for video, info in ranked[:slowest]:
+            stage, stage_ms = max(info["stages"].items(), key=lambda item: item[1])
+            table.add_row(video, f"{info['end'] - info['start']:.2f}", f"{stage} ({stage_ms / 1000:.2f}s)")
+        print(table)
+
+    cached = sum(r.get("cached_tokens") or 0 for records_ in calls.values() for r in records_)
+    prompt = sum(r.get("prompt_tokens") or 0 for records_ in calls.values() for r in records_)
+    if cached:
+        print(f"[🧾] Prompt cache: {cached} of {prompt} input tokens ({cached / prompt:.0%}) billed at the cached rate.")
+    if trims:
+        saved = sum(r["tokens_before"] - r["tokens_after"] for r in trims)
+        fields = ", ".join(sorted({r["field"] for r in trims}))
+        print(f"[✂️] Token budgets: trimmed {len(trims)} inputs ({fields}), {saved} tokens not sent.")
+    if calls:
+        print(f"[💰] Estimated API cost: ${total_cost:.4f}")
+
+def save_profile(run_id: str, top: int = 15) -> Optional[Path]:
+    """Merges the cProfile runs of the profiled nodes, saves them next to the trace and prints the top entries."""
+    if not tracer.profiles:
+        return None
+    stats = pstats.Stats(tracer.profiles[0])
+    for profile in tracer.profiles[1:]:
+        stats.add(profile)
+
+    TRACE_DIR.mkdir(parents=True, exist_ok=True)
+    names = "_".join(sorted(name.lower().replace(" ", "_") for name in tracer.profile_nodes))
+    path = TRACE_DIR / f"{run_id}_{names}.prof"
+    stats.dump_stats(str(path))
+
+    output = io.StringIO()
+    pstats.Stats(str(path), stream=output).sort_stats("cumulative").print_stats(top)
+    sys.stdout.write(output.getvalue())
+    return path
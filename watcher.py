@@ -0,0 +1,428 @@
+"""
+Service mode: keeps the local ad store in sync and analyzes new or changed
+video creatives as they appear, instead of waiting for a full batch run.
+
+- A poll thread syncs the ad account every `interval` seconds (incrementally,
+  by high-water mark). POST /webhook wakes it up early, e.g. from a Meta
+  webhook relay, and names ads to look at even before their sync.
+- Synced ads are diffed against the creative each ad was last analyzed with;
+  only new and changed creatives are queued.
+- The dispatcher sends queued ads through the compiled graph in micro-batches,
+  one run at a time, with `workers` per-video sub-runs in parallel.
+- GET /metrics reports queue depth, lag and throughput.
+
+Usage:
+    python main.py watch [--interval 300] [--workers 4] [--batch-size 20] [--port 8780]
+    curl -X POST localhost:8780/webhook -d '{"ad_ids": ["123"]}'
+    curl localhost:8780/metrics
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional
+import requests
+from rich import print
+from nodes.get_ads import describe_filters, load_stored_ads, parse_graph_time, sync_ads, sync_incrementally
+from nodes.get_video_urls import get_ad_video_id
+from utils.settings import DATA_DIR, load_settings
+
+load_settings()
+
+WATCH_INTERVAL_SECONDS = float(os.getenv("WATCH_INTERVAL_SECONDS", "300"))
+WATCH_WORKERS = int(os.getenv("WATCH_WORKERS", "4"))
+WATCH_BATCH_SIZE = int(os.getenv("WATCH_BATCH_SIZE", "20"))
+WATCH_PORT = int(os.getenv("WATCH_PORT", "8780"))
+
+# Runs an ad may fail before it waits for its next change; failed ads wait
+# WATCH_RETRY_BASE_SECONDS * 2**(attempt - 1) before the next run
+WATCH_MAX_ATTEMPTS = 3
+WATCH_RETRY_BASE_SECONDS = float(os.getenv("WATCH_RETRY_BASE_SECONDS", "60"))
+
+# Throughput is averaged over this window; lag percentiles over the last samples
+THROUGHPUT_WINDOW_SECONDS = 600
+LAG_SAMPLES = 200
+
+# Creative each ad was last analyzed with
+CACHE_DIR = DATA_DIR / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+WATCH_DB_PATH = CACHE_DIR / "watcher.sqlite"
+
+def creative_signature(ad: Dict[str, Any]) -> str:
+    """Digest of an ad's creative; status, budget or name edits leave it unchanged."""
+    return hashlib.sha256(json.dumps(ad.get("creative", {}), sort_keys=True).encode("utf-8")).hexdigest()
+
+def percentile(values: list, share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, math.ceil(share * len(ordered)) - 1)], 1)
+
+class ProcessedAds:
+    """Records, per ad, the creative signature its last successful analysis ran with."""
+
+    def __init__(self, db_path=WATCH_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed (
+                ad_id TEXT PRIMARY KEY,
+                creative TEXT NOT NULL,
+                processed_at REAL NOT NULL
+            )
+        """)
+
+    def signatures(self, ad_ids: list) -> Dict[str, str]:
+        found = {}
+        with self.lock:
+            for start in range(0, len(ad_ids), 500):
+                chunk = ad_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT ad_id, creative FROM processed WHERE ad_id IN ({', '.join('?' for _ in chunk)})", chunk
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def mark(self, ads: list) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO processed (ad_id, creative, processed_at) VALUES (?, ?, ?)",
+                [(ad["id"], creative_signature(ad), now) for ad in ads],
+            )
+
+class WatchQueue:
+    """
+    Ads waiting for analysis, oldest first. An ad that changes again before
+    it is analyzed is queued once and keeps the time it was first seen.
+    Failed ads are not taken again before their backoff has passed.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: Dict[str, float] = {}
+        self.attempts: Dict[str, int] = {}
+        self.not_before: Dict[str, float] = {}
+
+    def put(self, ad_ids: list, seen_at: Optional[float] = None) -> int:
+        with self.cond:
+            added = 0
+            for ad_id in ad_ids:
+                if ad_id not in self.pending:
+                    self.pending[ad_id] = seen_at or time.time()
+                    added += 1
+            self.cond.notify_all()
+            return added
+
+    def take(self, limit: int, timeout: float) -> list:
+        """Returns up to `limit` due (ad_id, first seen) pairs; waits up to `timeout` for the first."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.time()
+                due = [(ad_id, seen_at) for ad_id, seen_at in self.pending.items() if self.not_before.get(ad_id, 0) <= now]
+                remaining = deadline - time.monotonic()
+                if due or remaining <= 0:
+                    break
+                next_due = min((self.not_before[ad_id] for ad_id in self.pending if ad_id in self.not_before), default=None)
+                self.cond.wait(remaining if next_due is None else min(remaining, next_due - now))
+            batch = due[:limit]
+            for ad_id, _ in batch:
+                del self.pending[ad_id]
+                self.not_before.pop(ad_id, None)
+            return batch
+
+    def retry(self, batch: list) -> list:
+        """Requeues failed ads under WATCH_MAX_ATTEMPTS with backoff; returns the ids given up on."""
+        dropped = []
+        now = time.time()
+        with self.cond:
+            for ad_id, seen_at in batch:
+                self.attempts[ad_id] = self.attempts.get(ad_id, 0) + 1
+                if self.attempts[ad_id] < WATCH_MAX_ATTEMPTS:
+                    self.pending.setdefault(ad_id, seen_at)
+                    self.not_before[ad_id] = now + WATCH_RETRY_BASE_SECONDS * 2 ** (self.attempts[ad_id] - 1)
+                else:
+                    del self.attempts[ad_id]
+                    dropped.append(ad_id)
+            self.cond.notify_all()
+        return dropped
+
+    def done(self, ad_ids: list) -> None:
+        with self.cond:
+            for ad_id in ad_ids:
+                self.attempts.pop(ad_id, None)
+
+    def depth(self) -> tuple:
+        """Returns (queued ads, seconds the oldest one has waited)."""
+        with self.cond:
+            oldest = min(self.pending.values(), default=None)
+            return len(self.pending), (time.time() - oldest if oldest else 0.0)
+
+class WatchMetrics:
+    """Counters and recent samples behind GET /metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.polls = 0
+        self.poll_errors = 0
+        self.last_poll_at: Optional[float] = None
+        self.last_poll_seconds: Optional[float] = None
+        self.detected = 0
+        self.analyzed = 0
+        self.failed = 0
+        self.runs = 0
+        self.in_flight = 0
+        self.completions: deque = deque()
+        self.lags: deque = deque(maxlen=LAG_SAMPLES)
+        self.update_lags: deque = deque(maxlen=LAG_SAMPLES)
+
+    def poll(self, seconds: float, detected: int, error: bool = False) -> None:
+        with self.lock:
+            self.polls += 1
+            self.poll_errors += error
+            self.last_poll_at = time.time()
+            self.last_poll_seconds = round(seconds, 2)
+            self.detected += detected
+
+    def completed(self, seen_at: float, updated_at: Optional[int]) -> None:
+        now = time.time()
+        with self.lock:
+            self.analyzed += 1
+            self.completions.append(now)
+            self.lags.append(now - seen_at)
+            if updated_at:
+                self.update_lags.append(now - updated_at)
+
+    def snapshot(self, queue: WatchQueue) -> Dict[str, Any]:
+        depth, oldest = queue.depth()
+        now = time.time()
+        with self.lock:
+            while self.completions and now - self.completions[0] > THROUGHPUT_WINDOW_SECONDS:
+                self.completions.popleft()
+            window = min(THROUGHPUT_WINDOW_SECONDS, max(now - self.started_at, 1))
+            return {
+                "queue_depth": depth,
+                "oldest_queued_seconds": round(oldest, 1),
+                "in_flight": self.in_flight,
+                "detected": self.detected,
+                "analyzed": self.analyzed,
+                "failed": self.failed,
+                "runs": self.runs,
+                "throughput_per_min": round(len(self.completions) / window * 60, 2),
+                "lag_p50_seconds": percentile(list(self.lags), 0.5),
+                "lag_p95_seconds": percentile(list(self.lags), 0.95),
+                "update_lag_p50_seconds": percentile(list(self.update_lags), 0.5),
+                "polls": self.polls,
+                "poll_errors": self.poll_errors,
+                "last_poll_seconds": self.last_poll_seconds,
+                "seconds_since_poll": round(now - self.last_poll_at, 1) if self.last_poll_at else None,
+                "uptime_seconds": round(now - self.started_at, 1),
+            }
+
+class Watcher:
+    """
+    Polls, diffs and dispatches ads (see the module docstring).
+
+    Args:
+        filters (dict): Run filters (see nodes/get_ads.py) limiting what is watched; max_ads is not supported.
+        interval (float): Seconds between polls.
+        workers (int): Per-video sub-runs analyzed in parallel.
+        batch_size (int): Most ads per graph run.
+    """
+
+    def __init__(self, filters: Optional[Dict[str, Any]] = None, interval: float = WATCH_INTERVAL_SECONDS,
+                 workers: int = WATCH_WORKERS, batch_size: int = WATCH_BATCH_SIZE):
+        self.filters = filters or {}
+        self.interval = interval
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processed = ProcessedAds()
+        self.queue = WatchQueue()
+        self.metrics = WatchMetrics()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.hint_lock = threading.Lock()
+        self.hinted: set = set()
+
+    def notify(self, ad_ids: list) -> None:
+        """Webhook entry point: look at `ad_ids` (may be empty) on an immediate poll."""
+        with self.hint_lock:
+            self.hinted.update(ad_ids)
+        self.wake.set()
+
+    def diff(self, ads: list) -> list:
+        """Returns the video ads whose creative differs from the one last analyzed; the rest are marked done."""
+        signatures = self.processed.signatures([ad["id"] for ad in ads])
+        changed = [ad for ad in ads if signatures.get(ad["id"]) != creative_signature(ad)]
+        without_video = [ad for ad in changed if not get_ad_video_id(ad)]
+        self.processed.mark(without_video)
+        return [ad for ad in changed if get_ad_video_id(ad)]
+
+    def poll(self, full: bool = False) -> None:
+        """
+        Syncs the ad store and queues new and changed creatives. A `full` poll
+        diffs every stored ad in the filters, so changes made while the
+        service was down are picked up.
+        """
+        with self.hint_lock:
+            hinted, self.hinted = self.hinted, set()
+        started = time.time()
+        try:
+            result = sync_incrementally(self.filters)
+            candidates = set(result["changed"]) | hinted
+            stored = {ad["id"]: ad for ad in load_stored_ads({**self.filters, "ad_ids": sorted(candidates)})} if candidates else {}
+            # Webhooks can name ads the incremental sync has not returned yet
+            missing = sorted(hinted - stored.keys())
+            if missing:
+                sync_ads(filters={**self.filters, "ad_ids": missing})
+                stored.update((ad["id"], ad) for ad in load_stored_ads({**self.filters, "ad_ids": missing}))
+            ads = load_stored_ads(self.filters) if full else list(stored.values())
+        except requests.exceptions.RequestException as e:
+            print(f"[❌] Poll failed: {e}")
+            with self.hint_lock:
+                self.hinted |= hinted
+            self.metrics.poll(time.time() - started, 0, error=True)
+            return
+
+        queued = self.queue.put([ad["id"] for ad in self.diff(ads)])
+        self.metrics.poll(time.time() - started, queued)
+        if queued:
+            print(f"[🆕] {queued} new or changed creatives queued.")
+
+    def poll_loop(self) -> None:
+        full = True
+        while not self.stopping.is_set():
+            try:
+                self.poll(full=full)
+                full = False
+            except Exception as e:
+                print(f"[❌] Unexpected poll error: {e}")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def run_batch(self, batch: list) -> None:
+        """Analyzes one micro-batch of (ad_id, first seen) through the graph."""
+        from graph import run_ad_analysis_graph
+
+        ad_ids = [ad_id for ad_id, _ in batch]
+        with self.metrics.lock:
+            self.metrics.in_flight = len(batch)
+        try:
+            # Finished runs leave nothing to resume, so their checkpoints are dropped
+            # instead of piling up while the service runs for weeks
+            final_state = run_ad_analysis_graph(
+                max_concurrency=self.workers, filters={"ad_ids": ad_ids}, skip_sync=True, keep_checkpoints=False,
+            )
+            analyzed = {item["video"] for item in (final_state or {}).get("final_ad_analysis", [])}
+        except Exception as e:
+            print(f"[❌] Run for {len(batch)} ads failed: {e}")
+            analyzed = set()
+        finally:
+            with self.metrics.lock:
+                self.metrics.in_flight = 0
+                self.metrics.runs += 1
+
+        ads = {ad["id"]: ad for ad in load_stored_ads({"ad_ids": ad_ids})}
+        done = [ad_id for ad_id in ad_ids if ad_id in ads and f"video_{get_ad_video_id(ads[ad_id])}" in analyzed]
+        seen_at = dict(batch)
+        self.processed.mark([ads[ad_id] for ad_id in done])
+        self.queue.done(done)
+        for ad_id in done:
+            updated = ads[ad_id].get("updated_time")
+            self.metrics.completed(seen_at[ad_id], parse_graph_time(updated) if updated else None)
+
+        failed = [(ad_id, seen) for ad_id, seen in batch if ad_id not in done]
+        dropped = self.queue.retry(failed)
+        with self.metrics.lock:
+            self.metrics.failed += len(dropped)
+        if dropped:
+            print(f"[⚠️] Gave up on {len(dropped)} ads after {WATCH_MAX_ATTEMPTS} attempts: {', '.join(dropped)}")
+
+    def log_metrics(self) -> None:
+        m = self.metrics.snapshot(self.queue)
+        print(f"[📈] queue {m['queue_depth']} (oldest {m['oldest_queued_seconds']}s), analyzed {m['analyzed']}, "
+              f"failed {m['failed']}, {m['throughput_per_min']} ads/min, lag p50 {m['lag_p50_seconds']}s "
+              f"p95 {m['lag_p95_seconds']}s")
+
+    def run(self, port: Optional[int] = WATCH_PORT) -> None:
+        """Runs until interrupted. `port` serves /webhook and /metrics on localhost; None disables it."""
+        print(f"[👀] Watching {describe_filters(self.filters)}: polling every {self.interval:g}s, "
+              f"{self.workers} workers, batches of {self.batch_size}.")
+        server = serve(self, port) if port is not None else None
+        if server:
+            print(f"[🌐] Webhook and metrics on http://127.0.0.1:{server.server_port} (/webhook, /metrics)")
+        poller = threading.Thread(target=self.poll_loop, name="watch-poll", daemon=True)
+        poller.start()
+        try:
+            while True:
+                batch = self.queue.take(self.batch_size, timeout=self.interval)
+                if batch:
+                    self.run_batch(batch)
+                    self.log_metrics()
+        except KeyboardInterrupt:
+            print("[🛑] Stopping watcher.")
+        finally:
+            self.stopping.set()
+            self.wake.set()
+            if server:
+                server.shutdown()
+
+def webhook_ad_ids(payload: Dict[str, Any]) -> list:
+    """
+    Ad ids from {"ad_ids": [...]} or a Meta-style change notification
+    ({"entry": [{"changes": [{"value": {"ad_id": ...}}]}]}).
+    """
+    ad_ids = [str(ad_id) for ad_id in payload.get("ad_ids", [])]
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value") or {}
+            if value.get("ad_id") or value.get("id"):
+                ad_ids.append(str(value.get("ad_id") or value.get("id")))
+    return ad_ids
+
+def make_handler(watcher: Watcher):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.split("?")[0] == "/metrics":
+                self.send_json(watcher.metrics.snapshot(watcher.queue))
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/webhook":
+                self.send_json({"error": "not found"}, 404)
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                ad_ids = webhook_ad_ids(payload)
+            except (ValueError, AttributeError) as e:
+                self.send_json({"error": f"invalid payload: {e}"}, 400)
+                return
+            watcher.notify(ad_ids)
+            self.send_json({"accepted": len(ad_ids)}, 202)
+
+    return Handler
+
+def serve(watcher: Watcher, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(watcher))
+    threading.Thread(target=server.serve_forever, name="watch-http", daemon=True).start()
+    return server
@@ -0,0 +1,146 @@
+"""
+Worker mode: runs per-video sub-runs that a graph run in queue execution
+(AD_EXECUTION=queue) put on the job queue.
+
+- Each worker process leases one video job at a time, runs the per-video
+  sub-graph on it (download, transcription, frames, analyses) and completes
+  the job with the sub-run's output, which the graph run collects.
+- A lease is renewed while the job runs. If a worker dies, its lease
+  expires and another worker takes the job over; failed jobs are retried up
+  to JOB_MAX_ATTEMPTS times.
+- Workers on other hosts reach the queue through a queue server; each host
+  keeps its own caches and media in its data directory.
+- OpenAI requests of all workers draw from one set of rate limits kept by
+  the queue, so OPENAI_RPM and OPENAI_TPM are account-wide, not per worker.
+  (OPENAI_MAX_CONCURRENCY stays per process.)
+
+Usage:
+    python main.py worker [--processes 4]
+    JOB_QUEUE_TOKEN=... python main.py queue-server [--host 0.0.0.0] [--port 8790]   # on the queue host
+    JOB_QUEUE_URL=http://queue-host:8790 JOB_QUEUE_TOKEN=... python main.py worker   # on the other hosts
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from typing import Dict, Any
+from rich import print
+from utils.jobs import JOB_LEASE_SECONDS, JOB_POLL_SECONDS, JobQueue, get_job_queue
+from utils.settings import load_settings
+from utils.storage import get_storage_manager
+
+load_settings()
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+
+@functools.lru_cache(maxsize=None)
+def video_graph(fused: bool):
+    from graph import build_video_graph
+    return build_video_graph(fused)
+
+async def ainvoke_closing(graph, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """graph.ainvoke that closes the event loop's OpenAI client before asyncio.run ends the loop."""
+    from utils.openai_client import aclose_async_client
+
+    try:
+        return await graph.ainvoke(inputs)
+    finally:
+        await aclose_async_client()
+
+def process_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs the per-video sub-graph on a job's payload; returns its output
+    {"final_ad_analysis", "errors"}. Spans are appended to the run's trace.
+    """
+    from graph import USE_ASYNC
+    from utils.tracing import tracer
+
+    payload = job["payload"]
+    inputs = {"video_urls": payload["video_urls"]}
+    tracer.start(payload["run_id"])
+    try:
+        if USE_ASYNC:
+            output = asyncio.run(ainvoke_closing(video_graph(payload["fused"]), inputs))
+        else:
+            output = video_graph(payload["fused"]).invoke(inputs)
+    finally:
+        tracer.close()
+        get_storage_manager().unpin_all()
+    return {"final_ad_analysis": output.get("final_ad_analysis", []), "errors": output.get("errors", [])}
+
+def keep_leased(queue: JobQueue, job: Dict[str, Any], done: threading.Event) -> None:
+    """Renews the lease of `job` until `done` is set."""
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        if not queue.heartbeat(job["id"], job["token"]):
+            print(f"[⚠️] Lost the lease on {job['id']}; another worker may run it too.")
+            return
+
+def run_worker(worker: str) -> None:
+    """Leases and runs video jobs until interrupted."""
+    from utils.openai_client import use_shared_limiter
+
+    queue = get_job_queue()
+    use_shared_limiter(queue)
+    print(f"[🛠️] Worker {worker} waiting for jobs.")
+    try:
+        while True:
+            job = queue.lease("videos", worker)
+            if job is None:
+                time.sleep(JOB_POLL_SECONDS)
+                continue
+
+            print(f"[🛠️] {worker}: {job['id']} (attempt {job['attempts']})")
+            done = threading.Event()
+            threading.Thread(target=keep_leased, args=(queue, job, done), daemon=True).start()
+            try:
+                result = process_job(job)
+            except KeyboardInterrupt:
+                # Hand the job back without waiting for the lease to expire; it did not fail
+                queue.release(job["id"], job["token"])
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                status = queue.fail(job["id"], job["token"], f"{type(e).__name__}: {e}")
+                print(f"[❌] {worker}: {job['id']} failed ({status or 'lease lost'})")
+                continue
+            finally:
+                done.set()
+
+            if queue.complete(job["id"], job["token"], result):
+                print(f"[✅] {worker}: {job['id']} done")
+            else:
+                print(f"[⏩] {worker}: {job['id']} was already completed")
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(processes: int = WORKER_PROCESSES) -> None:
+    """Runs `processes` workers, each in its own process, until interrupted."""
+    host = socket.gethostname()
+    if processes == 1:
+        run_worker(f"{host}-{os.getpid()}")
+        return
+
+    # Workers start fresh interpreters rather than forks of this one
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(f"{host}-{os.getpid()}-{n}",), name=f"worker-{n}")
+        for n in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers started from a terminal got the interrupt as well
+        for process in workers:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in workers:
+            process.join()
+    print("[🛑] Workers stopped.")